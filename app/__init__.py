@@ -4,15 +4,28 @@ Initialing the application
 from flask_api import FlaskAPI
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask import request, jsonify, redirect
+from flask import request, jsonify, redirect, g
 from flask_mail import Mail
 
 # Local import
 from instance.config import app_config
+from .cache import TokenCache, FriendCache, AccessCache
+from .events import ListEvents
+from .graph import FriendGraph
+from .hashing import PasswordHasher, HashingBusy
+from .mailer import MailWorker
+from .ratelimit import RateLimitMiddleware, RatePolicy, backend_from_url
 
 # Initialize sql-alchemy
 db = SQLAlchemy()
 mail = Mail()
+mail_worker = MailWorker(mail, db)
+token_cache = TokenCache()
+friend_cache = FriendCache()
+friend_graph = FriendGraph()
+access_cache = AccessCache()
+list_events = ListEvents()
+password_hasher = PasswordHasher()
 
 
 # Middleware for path prefixing
@@ -36,11 +49,26 @@ class PrefixMiddleware(object):
         return ["Ooops! Looks like we don't recognize this url.".encode()]
 
 
+def init_extensions(app):
+    """
+    Configure the extensions and the process wide caches and workers
+    """
+    db.init_app(app)
+    mail.init_app(app)
+    mail_worker.init_app(app)
+    token_cache.init_app(app)
+    friend_cache.init_app(app)
+    friend_graph.init_app(app)
+    access_cache.init_app(app)
+    list_events.init_app(app)
+    password_hasher.init_app(app)
+
+
 def create_app(config_name):
     """
     Initialize the application
     """
-    from .models import User
+    from .models import User, Friend
 
     app = FlaskAPI(__name__, instance_relative_config=True)
     CORS(app)
@@ -49,8 +77,13 @@ def create_app(config_name):
     app.config.from_pyfile('config.py')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.wsgi_app = PrefixMiddleware(app.wsgi_app, prefix='/v1')
-    db.init_app(app)
-    mail.init_app(app)
+    if app.config.get('RATELIMIT_ENABLED'):
+        app.wsgi_app = RateLimitMiddleware(
+            app.wsgi_app,
+            policies=[RatePolicy(policy) for policy in app.config['RATELIMIT_POLICIES']],
+            backend=backend_from_url(app.config.get('RATELIMIT_STORAGE_URL')),
+            config=app.config)
+    init_extensions(app)
 
     @app.before_first_request
     def dummy_insert_initial_user(*_args, **_kwargs):
@@ -65,6 +98,29 @@ def create_app(config_name):
             admin_user.admin = True
             admin_user.save()
 
+    @app.before_request
+    def dummy_reset_list_access():
+        """
+        Start each request without memoized list access decisions
+        """
+        g.list_access = {}
+
+    @app.before_first_request
+    def dummy_start_friend_graph(*_args, **_kwargs):
+        """
+        Start building the friend graph before the first suggestions are asked for
+        """
+        if friend_graph.background:
+            friend_graph.refresh(Friend.accepted_pairs)
+
+    @app.before_first_request
+    def dummy_start_mail_worker(*_args, **_kwargs):
+        """
+        Start delivering queued emails in the background
+        """
+        if app.config.get('MAIL_WORKER_ENABLED'):
+            mail_worker.start()
+
     @app.errorhandler(404)
     def dummy_error_404(_error):
         """
@@ -94,6 +150,21 @@ def create_app(config_name):
 
         return response
 
+    @app.errorhandler(HashingBusy)
+    def dummy_error_hashing_busy(_error):
+        """
+        Handles a full or slow password hashing pool
+        """
+        message = {
+            'status': 503,
+            'message': 'The server is busy. Please try again shortly.'
+        }
+        response = jsonify(message)
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+
+        return response
+
     @app.route('/', methods=['GET'])
     def dummy_index():
         """
@@ -109,6 +180,7 @@ def create_app(config_name):
     from .item import item_blueprint
     from .friend import friend_blueprint
     from .share import share_blueprint
+    from .sync import sync_blueprint
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(user_blueprint)
     app.register_blueprint(admin_blueprint)
@@ -116,5 +188,6 @@ def create_app(config_name):
     app.register_blueprint(item_blueprint)
     app.register_blueprint(friend_blueprint)
     app.register_blueprint(share_blueprint)
+    app.register_blueprint(sync_blueprint)
 
     return app
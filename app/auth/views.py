@@ -1,20 +1,36 @@
 """
 Views for the auth blueprint
 """
-import re
 from datetime import datetime, timedelta
 from flask.views import MethodView
-from flask import request, jsonify, make_response, current_app
+from flask import jsonify, make_response, current_app, g
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import jwt
-from flask_bcrypt import Bcrypt
 from . import auth_blueprint
 from ..models import User, PasswordReset
-from ..decorators import MyDecorator
-from app import mail
-from flask_mail import Message
-
-my_dec = MyDecorator()
+from ..validation import validate, load_body, ValidationError, Schema, String, Name, Email
+from app import db, mail_worker, password_hasher
+
+PASSWORD_LENGTH_MESSAGE = 'The password should be at least 6 characters long'
+
+REGISTRATION_BODY = Schema(
+    Email('email', required=True),
+    Name('username', 'username', required=True),
+    String('password', required=True, min_length=6,
+           length_message=PASSWORD_LENGTH_MESSAGE),
+    required_message='Please provide all required information')
+LOGIN_BODY = Schema(
+    String('email', required=True),
+    String('password', required=True),
+    required_message='Email or password not provided')
+RESET_BODY = Schema(
+    String('email', required=True),
+    required_message='Email not provided')
+NEW_PASSWORD_BODY = Schema(
+    String('password', required=True, min_length=6,
+           length_message=PASSWORD_LENGTH_MESSAGE),
+    required_message='Email or password not provided')
 
 
 class RegistrationView(MethodView):
@@ -22,55 +38,34 @@ class RegistrationView(MethodView):
     Handles user registration
     """
     @staticmethod
+    @validate(body=REGISTRATION_BODY)
     def post():
         """
         POST request for user registration
         """
-        username = str(request.data.get('username', ''))
-        email = str(request.data.get('email', ''))
-        password = str(request.data.get('password', ''))
-
-        if email and password and username:
-            email_resp = my_dec.validate_email(email)
-            if not email_resp:
-                response = {'message': 'The email is not valid'}
-                return make_response(jsonify(response)), 400
-
-            if not re.match("^[a-zA-Z0-9 _]*$", username):
-                response = {
-                    'message': 'The username cannot contain special characters. '
-                               'Only underscores'
-                }
-                return make_response(jsonify(response)), 400
-
-            if len(password) < 6:
-                response = {
-                    'message': 'The password should be at least 6 characters long'
-                }
-                return make_response(jsonify(response)), 400
-
-            user = User.query.filter(func.lower(User.email) == email.lower()).first()
-            if not user:
-                # There is no user so we'll try to register them
-                post_data = request.data
-                # Register the user
-                username = post_data['username']
-                email = post_data['email']
-                password = post_data['password']
-                user = User(username=username, email=email, password=password)
+        username = g.data['username']
+        email = g.data['email']
+        password = g.data['password']
+
+        # The indexed lookup saves hashing a password for an existing user,
+        # the unique index catches registrations that race past it
+        user = User.query.filter(func.lower(User.email) == email.lower()).first()
+        if not user:
+            # There is no user so we'll try to register them
+            user = User(username=username, email=email, password=password)
+            try:
                 user.save()
-
+            except IntegrityError:
+                db.session.rollback()
+            else:
                 response = {'message': 'You were registered successfully. Please log in.'}
                 # return a response notifying the user that they registered successfully
                 return make_response(jsonify(response)), 201
 
-            # There is an existing user. We don't want to register users twice
-            # Return a message to the user telling them that they they already exist
-            response = {'message': 'User already exists. Please login.'}
-            return make_response(jsonify(response)), 202
-
-        response = {'message': 'Please provide all required information'}
-        return make_response(jsonify(response)), 400
+        # There is an existing user. We don't want to register users twice
+        # Return a message to the user telling them that they they already exist
+        response = {'message': 'User already exists. Please login.'}
+        return make_response(jsonify(response)), 202
 
 
 class LoginView(MethodView):
@@ -78,35 +73,35 @@ class LoginView(MethodView):
     Handles user log in
     """
     @staticmethod
+    @validate(body=LOGIN_BODY)
     def post():
         """
         POST request for user login
         """
-        email = str(request.data.get('email', ''))
-        password = str(request.data.get('password', ''))
-
-        if email and password:
-            user = User.query.filter_by(email=email).first()
-            # Try to authenticate the found user using their password
-            if user and user.password_is_valid(request.data['password']):
-                # Generate the access token. This will be used as the authorization header
-                token = jwt.encode({'id': user.id,
-                                    'username': user.username,
-                                    'exp': datetime.utcnow() + timedelta(days=1)},
-                                   current_app.config.get('SECRET'))
-                if token:
-                    response = {
-                        'access_token': token.decode('UTF-8'),
-                        'message': 'You logged in successfully.'
-                    }
-                    return make_response(jsonify(response)), 200
-            else:
-                # User does not exist. Therefore, we return an error message
-                response = {'message': 'Invalid email or password. Please try again'}
-                return make_response(jsonify(response)), 401
-
-        response = {'message': 'Email or password not provided'}
-        return make_response(jsonify(response)), 400
+        email = g.data['email']
+        password = g.data['password']
+
+        user = User.query.filter_by(email=email).first()
+        # Try to authenticate the found user using their password
+        if user and user.password_is_valid(password):
+            if user.password_needs_rehash():
+                # Upgrade the stored hash to the configured work factor
+                user.rehash_password(password)
+
+            # Generate the access token. This will be used as the authorization header
+            token = jwt.encode({'id': user.id,
+                                'username': user.username,
+                                'exp': datetime.utcnow() + timedelta(days=1)},
+                               current_app.config.get('SECRET'))
+            response = {
+                'access_token': token.decode('UTF-8'),
+                'message': 'You logged in successfully.'
+            }
+            return make_response(jsonify(response)), 200
+
+        # User does not exist. Therefore, we return an error message
+        response = {'message': 'Invalid email or password. Please try again'}
+        return make_response(jsonify(response)), 401
 
 
 class ResetView(MethodView):
@@ -114,51 +109,45 @@ class ResetView(MethodView):
     Generates password reset token
     """
     @staticmethod
+    @validate(body=RESET_BODY)
     def post():
         """
         POST request for password reset token
         """
-        email = str(request.data.get('email', ''))
-
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                # Generate the password reset token
-                token = jwt.encode({'email': user.email,
-                                    'exp': datetime.utcnow() + timedelta(minutes=60)},
-                                   current_app.config.get('SECRET'))
-                if token:
-                    reset_email = PasswordReset.query.filter_by(email=email).first()
-                    if reset_email:
-                        # Email already has token so delete it
-                        reset_email.delete()
-
-                    post_data = request.data
-                    # Save reset details
-                    email = post_data['email']
-                    p_token = token.decode('UTF-8')
-                    pass_reset = PasswordReset(email=email, token=p_token)
-                    pass_reset.save()
-
-                    # Send email
-                    url = str(current_app.config.get('APP_URL')) + \
-                        '/auth/password/{}'.format(str(token.decode()))
-                    subject = "Reset Password"
-                    message = "<p> Hey {},<br/><br/> Click on the link below to reset your password:</p><br/><b>{}</b>"\
-                        .format(str(email), str(url))
-                    msg = Message(recipients=[email],
-                                  html=message, subject=subject)
-                    mail.send(msg)
-
-                    response = {'pass_reset_token': token.decode('UTF-8')}
-                    return make_response(jsonify(response)), 200
-            else:
-                # User does not exist. Therefore, we return an error message
-                response = {'message': 'Invalid email. Please try again'}
-                return make_response(jsonify(response)), 401
-
-        response = {'message': 'Email not provided'}
-        return make_response(jsonify(response)), 400
+        email = g.data['email']
+
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            # User does not exist. Therefore, we return an error message
+            response = {'message': 'Invalid email. Please try again'}
+            return make_response(jsonify(response)), 401
+
+        # Generate the password reset token
+        expires_at = datetime.utcnow() + timedelta(minutes=60)
+        token = jwt.encode({'email': user.email, 'exp': expires_at},
+                           current_app.config.get('SECRET'))
+        p_token = token.decode('UTF-8')
+        pass_reset = PasswordReset.query.filter_by(email=email).first()
+        if pass_reset:
+            # Email already has a token so replace it in place
+            pass_reset.token_hash = PasswordReset.hash_token(p_token)
+            pass_reset.expires_at = expires_at
+        else:
+            pass_reset = PasswordReset(email=email, token=p_token,
+                                       expires_at=expires_at)
+        pass_reset.save()
+
+        # Send email
+        url = str(current_app.config.get('APP_URL')) + \
+            '/auth/password/{}'.format(p_token)
+        subject = "Reset Password"
+        message = "<p> Hey {},<br/><br/> Click on the link below to reset your password:</p><br/><b>{}</b>"\
+            .format(str(email), str(url))
+        # Delivered in the background by the mail worker
+        mail_worker.enqueue(recipient=email, subject=subject, html=message)
+
+        response = {'pass_reset_token': p_token}
+        return make_response(jsonify(response)), 200
 
 
 class PassReset(MethodView):
@@ -171,40 +160,34 @@ class PassReset(MethodView):
         POST request for password reset
         """
         # Retrieve email related to token
-        reset_dets = PasswordReset.query.filter_by(token=token).first()
+        reset_dets = PasswordReset.find_valid(token)
 
         if not reset_dets:
             response = {'message': 'The token is not valid or missing'}
             return make_response(jsonify(response)), 400
 
-        if request.method == 'PUT':
-            email = reset_dets.email
-            password = str(request.data.get('password', ''))
-
-            if email and password:
-                if len(password) < 6:
-                    response = {'message': 'The password should be at least 6 characters long'}
-                    return make_response(jsonify(response)), 400
-
-                user = User.query.filter(func.lower(User.email) == email.lower()).first()
-                if user:
-
-                    post_data = request.data
-
-                    password = post_data['password']
-                    password_hash = Bcrypt().generate_password_hash(password).decode()
-                    user.password = password_hash
-                    user.save()
-
-                    response = {
-                        'message': 'Password reset successfully. Please log in.'
-                    }
-                    # Return a response notifying the user that they registered successfully
-                    return make_response(jsonify(response)), 201
+        try:
+            password = load_body(NEW_PASSWORD_BODY)['password']
+        except ValidationError as error:
+            return error.response()
 
+        email = reset_dets.email
+        user = User.query.filter(func.lower(User.email) == email.lower()).first()
+        if not user:
             response = {'message': 'Email or password not provided'}
             return make_response(jsonify(response)), 400
 
+        user.password = password_hasher.generate_password_hash(password)
+        user.save()
+        # A reset token can only be used once
+        reset_dets.delete()
+
+        response = {
+            'message': 'Password reset successfully. Please log in.'
+        }
+        # Return a response notifying the user that they registered successfully
+        return make_response(jsonify(response)), 201
+
 
 registration_view = RegistrationView.as_view('register_view')  # pylint: disable=invalid-name
 login_view = LoginView.as_view('login_view')  # pylint: disable=invalid-name
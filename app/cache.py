@@ -0,0 +1,376 @@
+"""
+In-process caches shared by the request handlers
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# A verified access token, the user it belongs to and whether they are an admin
+CachedToken = namedtuple('CachedToken', ['user_id', 'admin', 'expires_at'])
+# The ids of a user's accepted friends, of the users who sent them a pending
+# request and of the users they sent one to
+FriendSets = namedtuple('FriendSets', ['friends', 'requests', 'sent'])
+# The FriendSets of a user and when they stop being served
+CachedFriends = namedtuple('CachedFriends', ['sets', 'expires_at'])
+# The access decision of a user on a list
+CachedAccess = namedtuple('CachedAccess', ['decision', 'expires_at'])
+
+
+class TokenCache(object):
+    """
+    Bounded, TTL based cache of verified access tokens.
+    Entries are evicted in least recently used order once the cache is full.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._user_tokens = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the cache from the application settings
+        """
+        self.max_size = app.config.get('TOKEN_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('TOKEN_CACHE_TTL', self.ttl)
+        self.clear()
+        app.extensions['token_cache'] = self
+
+    def get(self, token):
+        """
+        Return the cached entry for a token or None if it is missing or stale
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry
+
+    def set(self, token, user_id, admin, token_exp=None):
+        """
+        Cache a verified token.
+        The entry never outlives the expiry time embedded in the token itself.
+        """
+        if not self.max_size or not self.ttl:
+            return
+
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+
+            self._entries[token] = CachedToken(user_id, admin, expires_at)
+            self._user_tokens.setdefault(user_id, set()).add(token)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """
+        Drop every cached token that belongs to a user
+        """
+        with self._lock:
+            for token in list(self._user_tokens.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        """
+        Empty the cache and reset its counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return the cache counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(float(self.hits) / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+    def _remove(self, token):
+        """
+        Remove a token. The caller must hold the lock.
+        """
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+
+        tokens = self._user_tokens.get(entry.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[entry.user_id]
+
+
+class FriendCache(object):
+    """
+    Bounded, TTL based cache of each user's FriendSets, filled on demand.
+    Entries are dropped whenever a friendship of the user changes, but only in
+    the process that made the change, so the ttl bounds how long other processes
+    can serve stale friends. They are evicted in least recently used order once
+    the cache is full.
+    """
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Bumped by every invalidation so a load that raced with one is not kept
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the cache from the application settings
+        """
+        self.max_size = app.config.get('FRIEND_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('FRIEND_CACHE_TTL', self.ttl)
+        self.clear()
+        app.extensions['friend_cache'] = self
+
+    def get(self, user_id):
+        """
+        Return the cached FriendSets of a user or None if they are missing or stale
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= time.time():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry.sets
+
+    def version(self):
+        """
+        Return the invalidation counter, to be passed to set() after a load
+        """
+        with self._lock:
+            return self._version
+
+    def set(self, user_id, entry, version):
+        """
+        Cache the FriendSets of a user loaded when the counter was at version.
+        Nothing is cached if a friendship changed in the meantime.
+        """
+        if not self.max_size or not self.ttl:
+            return
+
+        with self._lock:
+            if version != self._version:
+                return
+
+            self._entries[user_id] = CachedFriends(entry, time.time() + self.ttl)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_users(self, user_ids):
+        """
+        Drop the cached FriendSets of some users
+        """
+        with self._lock:
+            self._version += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def invalidate_all(self):
+        """
+        Drop every cached entry but keep the counters
+        """
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def clear(self):
+        """
+        Empty the cache and reset its counters
+        """
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return the cache counters and the approximate memory used by the entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            memory = sys.getsizeof(self._entries)
+            for entry in self._entries.values():
+                memory += sys.getsizeof(entry) + sys.getsizeof(entry.sets)
+                for ids in entry.sets:
+                    memory += sys.getsizeof(ids) + sum(sys.getsizeof(i) for i in ids)
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(float(self.hits) / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'memory_bytes': memory
+            }
+
+
+class AccessCache(object):
+    """
+    Short lived cache of list access decisions keyed by (user_id, list_id).
+    Disabled unless it has a ttl. Entries of a list are dropped when it or one
+    of its shares changes, but only in the process that made the change,
+    so the ttl bounds how long other processes can serve a stale decision.
+    """
+
+    def __init__(self, max_size=10000, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._list_keys = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the cache from the application settings
+        """
+        self.max_size = app.config.get('ACCESS_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('ACCESS_CACHE_TTL', self.ttl)
+        self.clear()
+        app.extensions['access_cache'] = self
+
+    def get(self, user_id, list_id):
+        """
+        Return the cached entry of a user on a list or None if it is missing or stale
+        """
+        if not self.ttl:
+            return None
+
+        key = (user_id, list_id)
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, user_id, list_id, decision):
+        """
+        Cache the access decision of a user on a list
+        """
+        if not self.max_size or not self.ttl:
+            return
+
+        key = (user_id, list_id)
+        with self._lock:
+            self._entries[key] = CachedAccess(decision, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            self._list_keys.setdefault(list_id, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_lists(self, list_ids):
+        """
+        Drop the cached decisions on some lists
+        """
+        with self._lock:
+            for list_id in list_ids:
+                for key in list(self._list_keys.get(list_id, ())):
+                    self._remove(key)
+
+    def invalidate_all(self):
+        """
+        Drop every cached decision but keep the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self._list_keys.clear()
+
+    def clear(self):
+        """
+        Empty the cache and reset its counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self._list_keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return the cache counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(float(self.hits) / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+    def _remove(self, key):
+        """
+        Remove a decision. The caller must hold the lock.
+        """
+        if self._entries.pop(key, None) is None:
+            return
+
+        keys = self._list_keys.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._list_keys[key[1]]
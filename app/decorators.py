@@ -1,10 +1,12 @@
 """
 Custom decorator functions
 """
-import re
+from functools import wraps
 import jwt
-from flask import request, current_app
+from flask import request, current_app, jsonify, make_response, g, abort
+from app import token_cache
 from app.models import User
+from app.validation import EMAIL_PATTERN
 
 
 class MyDecorator(object):
@@ -14,7 +16,8 @@ class MyDecorator(object):
     @staticmethod
     def check_token():
         """
-        Helper function to check access token header
+        Helper function to check access token header.
+        The caller is stored on g so it is only resolved once per request.
         """
         token = None
 
@@ -25,23 +28,90 @@ class MyDecorator(object):
         if not token:
             return 'Missing'
 
+        # Tokens that were verified recently do not need to hit the database
+        cached = token_cache.get(token)
+        if cached:
+            g.user = None
+            g.user_id = cached.user_id
+            g.is_admin = cached.admin
+            return cached.user_id
+
         try:
             data = jwt.decode(token, current_app.config.get('SECRET'))
-            current_user = User.query.filter_by(id=data['id']).first()
-            user_id = current_user.id
-            return user_id
-
         except (jwt.InvalidTokenError, jwt.ExpiredSignatureError):
             return 'Invalid'
 
+        current_user = User.query.filter_by(id=data['id']).first()
+        if not current_user:
+            return 'Invalid'
+
+        token_cache.set(token, current_user.id, current_user.admin, data.get('exp'))
+        g.user = current_user
+        g.user_id = current_user.id
+        g.is_admin = current_user.admin
+        return current_user.id
+
     @staticmethod
-    def validate_email(email):
+    def current_user():
         """
-        Helper function to validate email
+        Helper function to get the row of the authenticated user.
+        It is only loaded when the token was served from the cache, so a user
+        deleted since then is rejected as an invalid token.
         """
-        email_exp = r"(^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$)"
+        if getattr(g, 'user', None) is None:
+            g.user = User.query.get(g.user_id)
+            if g.user is None:
+                token_cache.invalidate_user(g.user_id)
+                response = {'message': 'Your token is either expired or invalid.'}
+                abort(make_response(jsonify(response), 401))
+
+        return g.user
+
+    @staticmethod
+    def token_required(func):
+        """
+        Decorator that rejects requests without a valid access token
+        """
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            """
+            Resolve the caller before running the view
+            """
+            user_id = MyDecorator.check_token()
+
+            if user_id == 'Missing':
+                response = {'message': 'You cannot access that page without a token.'}
+                return make_response(jsonify(response)), 401
+            elif user_id == 'Invalid':
+                response = {'message': 'Your token is either expired or invalid.'}
+                return make_response(jsonify(response)), 401
 
-        if re.match(email_exp, email):
-            return True
+            return func(*args, **kwargs)
 
-        return False
+        return decorated
+
+    @staticmethod
+    def admin_required(func):
+        """
+        Decorator that rejects callers without admin rights.
+        It must be applied inside token_required.
+        """
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            """
+            Check the admin flag resolved with the token
+            """
+            if not g.is_admin:
+                response = {'message': 'Cannot perform that operation without admin rights'}
+                return make_response(jsonify(response)), 403
+
+            return func(*args, **kwargs)
+
+        return decorated
+
+    @staticmethod
+    def validate_email(email):
+        """
+        Helper function to validate email
+        """
+        return bool(EMAIL_PATTERN.match(email))
@@ -0,0 +1,21 @@
+"""
+Errors turned into client responses
+"""
+from flask import jsonify, make_response
+
+
+class ValidationError(Exception):
+    """
+    Raised when a request does not match its schema
+    """
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+
+    def response(self):
+        """
+        The error response returned to the client
+        """
+        return make_response(jsonify({'message': self.message})), self.status
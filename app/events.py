@@ -0,0 +1,275 @@
+"""
+Live changes to shopping lists.
+Item changes are published once they are committed and streamed to the
+subscribers of each list as Server-Sent Events. A broker carries the changes
+between processes: the local broker only reaches the subscribers of the
+process that made the change, the Redis broker reaches every worker.
+"""
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Subscription(object):
+    """
+    The changes to a list waiting to be streamed to one client
+    """
+
+    def __init__(self, user_id, list_id, max_size):
+        self.user_id = user_id
+        self.list_id = list_id
+        self.overflowed = False
+        self._queue = queue.Queue(max_size)
+
+    def put(self, message):
+        """
+        Queue a change without ever blocking the publisher
+        """
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # A client that cannot keep up is disconnected and reloads the list
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        Wait up to timeout seconds for the next change, None if there was none
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBroker(object):
+    """
+    Delivers changes to the subscribers of the current process only.
+    It stands in for a shared broker with a single worker or in development.
+    """
+
+    def __init__(self):
+        self._deliver = None
+
+    def start(self, deliver):
+        """
+        Pass every published change to deliver(list_id, message)
+        """
+        self._deliver = deliver
+
+    def publish(self, list_id, message):
+        """
+        Deliver a change straight away
+        """
+        if self._deliver:
+            self._deliver(list_id, message)
+
+    def stop(self):
+        """
+        Stop delivering changes
+        """
+        self._deliver = None
+
+
+class RedisBroker(object):
+    """
+    Delivers changes to the subscribers of every worker through Redis pub/sub
+    """
+
+    def __init__(self, url, prefix='list_events:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for a redis:// '
+                               'LIST_EVENTS_BROKER_URL')
+
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+        self._pubsub = None
+        self._thread = None
+
+    def start(self, deliver):
+        """
+        Listen for the changes of every worker in a background thread
+        """
+        def handle(message):
+            """
+            Pass a change received from Redis on to the local subscribers
+            """
+            list_id = int(message['channel'].decode('utf-8')[len(self.prefix):])
+            deliver(list_id, json.loads(message['data'].decode('utf-8')))
+
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{self.prefix + '*': handle})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def publish(self, list_id, message):
+        """
+        Send a change to every worker
+        """
+        self.client.publish(self.prefix + str(list_id), json.dumps(message))
+
+    def stop(self):
+        """
+        Stop listening
+        """
+        if self._thread:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub:
+            self._pubsub.close()
+            self._pubsub = None
+
+
+def broker_from_url(url):
+    """
+    Create the broker named by LIST_EVENTS_BROKER_URL
+    """
+    if not url or url.startswith('memory://'):
+        return LocalBroker()
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBroker(url)
+    raise ValueError('Unsupported LIST_EVENTS_BROKER_URL: {}'.format(url))
+
+
+def format_event(event, data):
+    """
+    Encode a change as a Server-Sent Event
+    """
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+class ListEvents(object):
+    """
+    Publishes committed list changes and fans them out to the subscribers
+    of this process. Each subscriber holds a thread while it streams, so
+    their number is capped to leave threads for the other requests.
+    """
+
+    def __init__(self):
+        self.keepalive = 15
+        self.max_seconds = 300
+        self.max_subscribers = 8
+        self.queue_size = 100
+        self.broker = LocalBroker()
+        self.published = 0
+        self.delivered = 0
+        self.failures = 0
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the events and start the broker from the application settings
+        """
+        self.keepalive = app.config.get('LIST_EVENTS_KEEPALIVE', self.keepalive)
+        self.max_seconds = app.config.get('LIST_EVENTS_MAX_SECONDS', self.max_seconds)
+        self.max_subscribers = app.config.get('LIST_EVENTS_MAX_SUBSCRIBERS',
+                                              self.max_subscribers)
+        threads = app.config.get('WEB_THREADS')
+        if threads and self.max_subscribers > threads // 2:
+            logger.warning('LIST_EVENTS_MAX_SUBSCRIBERS (%s) leaves only %s of the %s threads '
+                           'for other requests', self.max_subscribers,
+                           threads - self.max_subscribers, threads)
+        self.queue_size = app.config.get('LIST_EVENTS_QUEUE_SIZE', self.queue_size)
+
+        self.broker.stop()
+        self.broker = broker_from_url(app.config.get('LIST_EVENTS_BROKER_URL'))
+        self.broker.start(self._deliver)
+        with self._lock:
+            self._subscribers = {}
+        app.extensions['list_events'] = self
+
+    @staticmethod
+    def queue(session, list_id, event, data):
+        """
+        Hold a change made in a session until the session commits
+        """
+        session.info.setdefault('list_events', []).append((list_id, event, data))
+
+    def publish_queued(self, session):
+        """
+        Publish the changes of a session that has committed
+        """
+        for list_id, event, data in session.info.pop('list_events', ()):
+            self.publish(list_id, {'event': event, 'data': data})
+
+    @staticmethod
+    def discard_queued(session):
+        """
+        Forget the changes of a session that rolled back
+        """
+        session.info.pop('list_events', None)
+
+    def publish(self, list_id, message):
+        """
+        Send a change to the subscribers of a list.
+        The change is already committed, so a broker failure is only logged.
+        """
+        try:
+            self.broker.publish(list_id, message)
+            self.published += 1
+        except Exception:  # pylint: disable=broad-except
+            self.failures += 1
+            logger.exception('Could not publish a change to list %s', list_id)
+
+    def subscribe(self, user_id, list_id):
+        """
+        Start receiving the changes to a list.
+        Returns None when this process already streams to max_subscribers clients.
+        """
+        with self._lock:
+            if self.subscriber_count() >= self.max_subscribers:
+                return None
+            subscription = Subscription(user_id, list_id, self.queue_size)
+            self._subscribers.setdefault(list_id, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop receiving changes
+        """
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.list_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.list_id]
+
+    def subscriber_count(self):
+        """
+        The number of clients streaming from this process
+        """
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def _deliver(self, list_id, message):
+        """
+        Queue a change for each local subscriber of the list
+        """
+        with self._lock:
+            subscriptions = list(self._subscribers.get(list_id, ()))
+
+        for subscription in subscriptions:
+            subscription.put(message)
+        self.delivered += len(subscriptions)
+
+    def stats(self):
+        """
+        Return the number of subscribers and changes published
+        """
+        with self._lock:
+            subscribers = self.subscriber_count()
+            lists = len(self._subscribers)
+
+        return {
+            'broker': type(self.broker).__name__,
+            'subscribers': subscribers,
+            'max_subscribers': self.max_subscribers,
+            'lists': lists,
+            'published': self.published,
+            'delivered': self.delivered,
+            'failures': self.failures
+        }
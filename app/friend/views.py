@@ -2,343 +2,336 @@
 Views for the friend blueprint
 """
 from flask.views import MethodView
-from flask import request, jsonify, make_response
+from flask import jsonify, make_response, g
 from sqlalchemy.sql.expression import false
-from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from app import db, friend_graph
 from . import friend_blueprint
 from ..models import Friend, User
 from ..decorators import MyDecorator
+from ..pagination import paginate, paginate_ranked
+from ..search import search
+from ..validation import validate, Schema, Integer, IntegerList, Choice, PAGINATION
 my_dec = MyDecorator()
 
+FRIEND_BODY = Schema(
+    Integer('friend_id', required=True),
+    type_message='The parameters provided should be integers',
+    required_message='The parameters provided should be integers',
+    required_status=401)
+FRIEND_PATH = Schema(
+    Integer('friend_id'),
+    type_message='The parameter needs to be an integer')
+# The listings can also count the friends each user has in common with the caller
+FRIEND_LISTING = Schema(
+    *(PAGINATION.fields + (Choice('mutual', ('true', 'false'), default='false'),)),
+    type_message=PAGINATION.type_message)
+MAX_BULK_REQUESTS = 100
+BULK_REQUESTS_BODY = Schema(
+    IntegerList('friend_ids', required=True, max_length=MAX_BULK_REQUESTS,
+                length_message='At most {} requests can be answered at once'.format(
+                    MAX_BULK_REQUESTS)),
+    Choice('action', ('accept', 'reject'), default='accept'),
+    type_message='The friend ids should be a list of integers',
+    required_message='Please provide the ids of the users whose requests to answer',
+    required_status=400)
+
 
 class FriendOps(MethodView):
     """
     Handles sending friend requests and showing friends
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(body=FRIEND_BODY)
     def post():
         """
         POST - Sends a friend request to a user
         """
-        user_id = my_dec.check_token()
+        user_id = g.user_id
+        friend_id = g.data['friend_id']
 
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                friend_id = int(request.data.get('friend_id', ''))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        if friend_id == user_id:
+            response = {'message': 'You cannot befriend yourself'}
+            return make_response(jsonify(response)), 403
 
-            if friend_id == user_id:
-                response = {'message': 'You cannot befriend yourself'}
-                return make_response(jsonify(response)), 403
+        check_user_exists = User.query.filter_by(id=friend_id).first()
+        if not check_user_exists:
+            response = {'message': 'That user does not exist'}
+            return make_response(jsonify(response)), 401
 
-            check_user_exists = User.query.filter_by(id=friend_id).first()
-            if not check_user_exists:
-                response = {'message': 'That user does not exist'}
-                return make_response(jsonify(response)), 401
+        if friend_id:
+            friend_sets = Friend.sets_for(user_id)
 
-            if friend_id:
-                friend = Friend.query.\
-                    filter(or_(and_(Friend.user1 == user_id, Friend.user2 == friend_id),
-                               and_(Friend.user1 == friend_id, Friend.user2 == user_id))).first()
+            if friend_id in friend_sets.friends:
+                response = {'message': 'You are already friends'}
+                return make_response(jsonify(response)), 401
 
-                if not friend:
-                    # The users are not friends
-                    friend = Friend(user1=user_id, user2=friend_id)
+            if friend_id not in friend_sets.requests and friend_id not in friend_sets.sent:
+                # The users are not friends
+                friend = Friend(requested_by=user_id, requested_to=friend_id)
+                try:
                     friend.save()
-
-                    response = {'message': 'Friend request sent'}
-                    return make_response(jsonify(response)), 200
-
-                elif friend.accepted:
-                    response = {'message': 'You are already friends'}
+                except IntegrityError:
+                    # A concurrent request between the same users got there first
+                    db.session.rollback()
+                    response = {'message': 'Friend request already sent'}
                     return make_response(jsonify(response)), 401
 
-                response = {'message': 'Friend request already sent'}
-                return make_response(jsonify(response)), 401
+                response = {'message': 'Friend request sent'}
+                return make_response(jsonify(response)), 200
+
+            response = {'message': 'Friend request already sent'}
+            return make_response(jsonify(response)), 401
 
     @staticmethod
+    @validate(query=FRIEND_LISTING)
     def get():
         """
         GET - Retrieves all of a user's friends
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
-
+        user_id = g.user_id
+        search_query = g.args['q']
+
+        # The friendship can have been requested by either user
+        friends = User.query. \
+            join(Friend, Friend.other_user(user_id)). \
+            filter(Friend.accepted)
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            friends, rank = search(friends, User.username, search_query)
+
+        paginated_users = paginate(friends, User.username, User.id, g.args, rank=rank)
+        friends = []
+
+        if not paginated_users.items:
             if search_query:
-                result = User.query.filter(User.username.ilike('%' + search_query + '%')).all()
-                friend_list = []
-                search_output = []
-
-                for r_fr in result:
-                    output = Friend.query. \
-                        filter(or_((and_(Friend.user1 == user_id, Friend.user2 == r_fr.id)),
-                                   (and_(Friend.user1 == r_fr.id, Friend.user2 == user_id))),
-                               Friend.accepted).first()
-                    if output:
-                        if output.user1 != user_id:
-                            search_output.append(output.user1)
-                        elif output.user2 != user_id:
-                            search_output.append(output.user2)
-
-                if not search_output:
-                    response = {'message': 'You have no friends with that username'}
-                    return make_response(jsonify(response)), 404
-
-                for friend in search_output:
-                    user = User.query.filter_by(id=friend).first()
-                    obj = {
-                        'id': user.id,
-                        'username': user.username,
-                        'email': user.email
-                    }
-                    friend_list.append(obj)
-
-                response = jsonify(friend_list)
-                response.status_code = 200
-                return response
-
-            friends = []
-            friend_ids = []
-            friend_list = Friend.query. \
-                filter(or_(Friend.user1 == user_id, Friend.user2 == user_id), Friend.accepted).all()
-
-            if not friend_list:
+                response = {'message': 'You have no friends with that username'}
+            else:
                 response = {'message': 'You have no friends'}
-                return make_response(jsonify(response)), 404
-
-            for friend in friend_list:
-                if not friend.user1 == user_id:
-                    friend_ids.append(friend.user1)
-                if not friend.user2 == user_id:
-                    friend_ids.append(friend.user2)
+            return make_response(jsonify(response)), 404
 
-            total_users = User.query.filter(User.id.in_(friend_ids)).count()
-            paginated_users = User.query.filter(User.id.in_(friend_ids)). \
-                order_by(User.username.asc()).paginate(page, limit)
+        mutual = None
+        if g.args['mutual'] == 'true':
+            mutual = Friend.mutual_counts(user_id, [user.id for user in paginated_users.items])
 
-            for user in paginated_users.items:
-                obj = {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email
-                }
-                friends.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_users.has_next:
-                next_page = '/friends' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_users.has_prev:
-                previous_page = '/friends' + '?page=' + str(page - 1) + \
-                                '&limit=' + str(limit)
-
-            response = {
-                'total': total_users,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'friends': friends
+        for user in paginated_users.items:
+            obj = {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email
             }
+            if mutual is not None:
+                obj['mutual_friends'] = mutual.get(user.id, 0)
+            friends.append(obj)
+
+        response = {
+            'total': paginated_users.total,
+            'previous_page': paginated_users.previous_page,
+            'next_page': paginated_users.next_page,
+            'next_cursor': paginated_users.next_cursor,
+            'friends': friends
+        }
 
-            return make_response(jsonify(response)), 200
+        return make_response(jsonify(response)), 200
 
 
 class FriendMan(MethodView):
     """
     Handles friend manipulation
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=FRIEND_PATH)
     def put(friend_id):
         """
         Handles acceptance of friend requests
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(friend_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameter needs to be an integer'}
-                return make_response(jsonify(response)), 401
+        user_id = g.user_id
 
-            friend = Friend.query.filter_by(user1=friend_id, user2=user_id).first()
+        friend = Friend.between(user_id, friend_id)
 
-            if not friend:
-                response = {'message': 'You have no friend request from that user'}
-                return make_response(jsonify(response)), 404
+        if not friend or friend.requested_by != friend_id:
+            response = {'message': 'You have no friend request from that user'}
+            return make_response(jsonify(response)), 404
 
-            if friend.accepted:
-                response = {'message': 'You are already friends with that user'}
-                return make_response(jsonify(response)), 403
+        if friend.accepted:
+            response = {'message': 'You are already friends with that user'}
+            return make_response(jsonify(response)), 403
 
-            friend.accepted = True
-            friend.save()
+        friend.accepted = True
+        friend.save()
 
-            response = {'message': 'You are now friends'}
-            return make_response(jsonify(response)), 200
+        response = {'message': 'You are now friends'}
+        return make_response(jsonify(response)), 200
 
     @staticmethod
+    @validate(path=FRIEND_PATH)
     def delete(friend_id):
         """
         Removes a user as a friend
         """
-        user_id = my_dec.check_token()
+        user_id = g.user_id
 
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(friend_id)
-            except (ValueError, TypeError) as e:
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': str(e)}
-                return make_response(jsonify(response)), 401
+        friend = Friend.between(user_id, friend_id)
 
-            friend = Friend.query. \
-                filter(or_((and_(Friend.user1 == user_id, Friend.user2 == friend_id)),
-                           (and_(Friend.user1 == friend_id, Friend.user2 == user_id))),
-                       Friend.accepted).first()
+        if not friend or not friend.accepted:
+            response = {'message': 'You are not friends with that user'}
+            return make_response(jsonify(response)), 404
 
-            if not friend:
-                response = {'message': 'You are not friends with that user'}
-                return make_response(jsonify(response)), 404
+        friend.delete()
 
-            if friend.user1 == user_id or friend.user2 == user_id:
-                friend.delete()
-
-                response = {"message": "Friend deleted successfully"}
-                return make_response(jsonify(response)), 200
+        response = {"message": "Friend deleted successfully"}
+        return make_response(jsonify(response)), 200
 
 
 class FRequest(MethodView):
     """
     Handles friend requests
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(query=FRIEND_LISTING)
     def get():
         """
         Get friend requests
         """
-        user_id = my_dec.check_token()
+        user_id = g.user_id
+        search_query = g.args['q']
+
+        # Users who sent the user a request that has not been accepted yet
+        requesters = User.query. \
+            join(Friend, Friend.other_user(user_id)). \
+            filter(Friend.requested_by == User.id, Friend.accepted == false())
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            requesters, rank = search(requesters, User.username, search_query)
+
+        paginated_users = paginate(requesters, User.username, User.id, g.args, rank=rank)
+        friends = []
+
+        if not paginated_users.items:
+            if search_query:
+                response = {'message': 'You have no request from that user'}
+            else:
+                response = {'message': 'You have no friend requests'}
+            return make_response(jsonify(response)), 404
+
+        mutual = None
+        if g.args['mutual'] == 'true':
+            mutual = Friend.mutual_counts(user_id, [user.id for user in paginated_users.items])
+
+        for user in paginated_users.items:
+            obj = {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email
+            }
+            if mutual is not None:
+                obj['mutual_friends'] = mutual.get(user.id, 0)
+            friends.append(obj)
+
+        response = {
+            'total': paginated_users.total,
+            'previous_page': paginated_users.previous_page,
+            'next_page': paginated_users.next_page,
+            'next_cursor': paginated_users.next_cursor,
+            'friend_requests': friends
+        }
+
+        return make_response(jsonify(response)), 200
+
+    @staticmethod
+    @validate(body=BULK_REQUESTS_BODY)
+    def put():
+        """
+        Accepts or rejects the requests of several users at once
+        """
+        user_id = g.user_id
+        friend_ids = g.data['friend_ids']
 
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
+        if g.data['action'] == 'accept':
+            count = Friend.accept_requests(user_id, friend_ids)
+            message = '{} friend requests accepted'.format(count)
         else:
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+            count = Friend.reject_requests(user_id, friend_ids)
+            message = '{} friend requests rejected'.format(count)
 
-            if search_query:
-                result = User.query.filter(User.username.ilike('%' + search_query + '%')).all()
-                friend_list = []
-                search_output = []
-
-                for r_fr in result:
-                    output = Friend.query. \
-                        filter(and_(Friend.user1 == r_fr.id, Friend.user2 == user_id,
-                                    Friend.accepted == false())).first()
-                    if output:
-                        search_output.append(output.user2)
-
-                if not search_output:
-                    response = {'message': 'You have no request from that user'}
-                    return make_response(jsonify(response)), 404
-
-                for friend in search_output:
-                    user = User.query.filter_by(id=friend).first()
-                    obj = {
-                        'id': user.id,
-                        'username': user.username,
-                        'email': user.email
-                    }
-                    friend_list.append(obj)
-
-                response = jsonify(friend_list)
-                response.status_code = 200
-                return response
-
-            friends = []
-            friend_ids = []
-            friend_list = Friend.query. \
-                filter(and_(Friend.user2 == user_id, Friend.accepted == false())).all()
-
-            if not friend_list:
-                response = {'message': 'You have no friend requests'}
-                return make_response(jsonify(response)), 404
+        if not count:
+            response = {'message': 'You have no friend requests from those users'}
+            return make_response(jsonify(response)), 404
 
-            for friend in friend_list:
-                friend_ids.append(friend.user1)
+        response = {'message': message, 'count': count}
+        return make_response(jsonify(response)), 200
 
-            total_users = User.query.filter(User.id.in_(friend_ids)).count()
-            paginated_users = User.query.filter(User.id.in_(friend_ids)). \
-                order_by(User.username.asc()).paginate(page, limit)
 
-            for user in paginated_users.items:
+class FriendSuggestions(MethodView):
+    """
+    Handles friend suggestions
+    """
+    decorators = [my_dec.token_required]
+
+    @staticmethod
+    @validate(query=PAGINATION)
+    def get():
+        """
+        Suggests friends of friends, ranked by the number of mutual friends
+        """
+        user_id = g.user_id
+
+        friend_graph.refresh(Friend.accepted_pairs)
+        if not friend_graph.is_ready():
+            response = make_response(jsonify({'message': 'Friend suggestions are being prepared. '
+                                                         'Please try again shortly.'}))
+            response.status_code = 503
+            response.headers['Retry-After'] = '10'
+            return response
+
+        # The user's own friends and requests are current. Their friends' friends
+        # are as of the last build of the graph.
+        friend_sets = Friend.sets_for(user_id)
+        ranked = friend_graph.suggestions(user_id, friend_sets.friends,
+                                          exclude=friend_sets.requests | friend_sets.sent)
+        paginated_users = paginate_ranked(ranked, g.args)
+
+        if not paginated_users.items:
+            response = {'message': 'You have no friend suggestions'}
+            return make_response(jsonify(response)), 404
+
+        suggested_ids = [suggested_id for _, suggested_id in paginated_users.items]
+        users = {user.id: user for user in User.query.filter(User.id.in_(suggested_ids))}
+        suggestions = []
+
+        for mutual_friends, suggested_id in paginated_users.items:
+            user = users.get(suggested_id)
+            if user:
                 obj = {
                     'id': user.id,
                     'username': user.username,
-                    'email': user.email
+                    'mutual_friends': mutual_friends
                 }
-                friends.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_users.has_next:
-                next_page = '/friends/requests' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_users.has_prev:
-                previous_page = '/friends/requests' + '?page=' + str(page - 1) + \
-                                '&limit=' + str(limit)
-
-            response = {
-                'total': total_users,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'friend_requests': friends
-            }
+                suggestions.append(obj)
+
+        response = {
+            'total': paginated_users.total,
+            'previous_page': paginated_users.previous_page,
+            'next_page': paginated_users.next_page,
+            'next_cursor': paginated_users.next_cursor,
+            'suggestions': suggestions
+        }
 
-            return make_response(jsonify(response)), 200
+        return make_response(jsonify(response)), 200
 
 
 friend_ops = FriendOps.as_view('friend_ops')  # pylint: disable=invalid-name
 friend_man = FriendMan.as_view('friend_man')  # pylint: disable=invalid-name
 request_op = FRequest.as_view('request_op')  # pylint: disable=invalid-name
+suggestions_op = FriendSuggestions.as_view('suggestions_op')  # pylint: disable=invalid-name
 
 # Define rules
 friend_blueprint.add_url_rule('/friends',
@@ -346,4 +339,6 @@ friend_blueprint.add_url_rule('/friends',
 friend_blueprint.add_url_rule('/friends/<friend_id>',
                               view_func=friend_man, methods=['PUT', 'DELETE'])
 friend_blueprint.add_url_rule('/friends/requests',
-                              view_func=request_op, methods=['GET'])
+                              view_func=request_op, methods=['GET', 'PUT'])
+friend_blueprint.add_url_rule('/friends/suggestions',
+                              view_func=suggestions_op, methods=['GET'])
@@ -0,0 +1,170 @@
+"""
+In-memory friendship graph used to suggest friends of friends
+"""
+import logging
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+
+EMPTY = array('i')
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class FriendGraph(object):
+    """
+    Accepted friendships held as a sorted array of friend ids per user.
+    The graph is rebuilt from the database at most every ttl seconds. Builds
+    run in a background thread while requests keep answering from the previous
+    build, so a large graph never holds up a request. Until the first build is
+    done there is nothing to answer from.
+    """
+
+    def __init__(self, ttl=300, background=True):
+        self.ttl = ttl
+        self.background = background
+        self.app = None
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.failures = 0
+        self._adjacency = {}
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        """
+        Configure the graph from the application settings
+        """
+        self.ttl = app.config.get('FRIEND_GRAPH_TTL', self.ttl)
+        self.background = app.config.get('FRIEND_GRAPH_BACKGROUND', self.background)
+        self.app = app
+        self.clear()
+        app.extensions['friend_graph'] = self
+
+    def load(self, pairs):
+        """
+        Replace the graph with the friendships in an iterable of id pairs
+        """
+        start = time.time()
+        adjacency = {}
+        for user_id, friend_id in pairs:
+            if user_id not in adjacency:
+                adjacency[user_id] = array('i')
+            if friend_id not in adjacency:
+                adjacency[friend_id] = array('i')
+            adjacency[user_id].append(friend_id)
+            adjacency[friend_id].append(user_id)
+
+        for user_id, friend_ids in adjacency.items():
+            adjacency[user_id] = array('i', sorted(friend_ids))
+
+        # Readers pick up the new graph in a single assignment
+        self._adjacency = adjacency
+        self._built_at = time.time()
+        self.builds += 1
+        self.build_seconds = round(self._built_at - start, 4)
+
+    def is_stale(self):
+        """
+        Whether the graph is due to be rebuilt
+        """
+        return self._built_at is None or time.time() - self._built_at >= self.ttl
+
+    def is_ready(self):
+        """
+        Whether the graph has been built at least once
+        """
+        return self._built_at is not None
+
+    def refresh(self, load_pairs):
+        """
+        Rebuild the graph from load_pairs() if it is stale.
+        The build runs in a background thread unless background is off, in
+        which case the caller waits for it.
+        """
+        if not self.is_stale():
+            return
+
+        if not self.background:
+            with self._lock:
+                if self.is_stale():
+                    self.load(load_pairs())
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._build, args=(load_pairs,),
+                                            name='friend-graph', daemon=True)
+            self._thread.start()
+
+    def _build(self, load_pairs):
+        """
+        Build the graph in the background with an application context for the queries
+        """
+        try:
+            with self.app.app_context():
+                self.load(load_pairs())
+        except Exception:  # pylint: disable=broad-except
+            self.failures += 1
+            # The next refresh tries again
+            logger.exception('Could not build the friend graph')
+
+    def friends(self, user_id):
+        """
+        The sorted ids of a user's friends as of the last build
+        """
+        return self._adjacency.get(user_id, EMPTY)
+
+    def suggestions(self, user_id, friend_ids, exclude=()):
+        """
+        Rank the friends of friend_ids by how many of them they are friends with.
+        Returns (mutual_friends, id) pairs, most mutual friends first, leaving out
+        the user, their friends and the excluded ids.
+        """
+        adjacency = self._adjacency
+        counts = Counter()
+        for friend_id in friend_ids:
+            counts.update(adjacency.get(friend_id, EMPTY))
+
+        excluded = set(friend_ids)
+        excluded.update(exclude)
+        excluded.add(user_id)
+
+        ranked = [(count, other_id) for other_id, count in counts.items()
+                  if other_id not in excluded]
+        ranked.sort(key=lambda pair: (-pair[0], pair[1]))
+        return ranked
+
+    def clear(self):
+        """
+        Empty the graph so that it is rebuilt on next use
+        """
+        self._adjacency = {}
+        self._built_at = None
+
+    def stats(self):
+        """
+        Return the size of the graph and how long it took to build
+        """
+        adjacency = self._adjacency
+        memory = sys.getsizeof(adjacency)
+        edges = 0
+        for friend_ids in adjacency.values():
+            memory += sys.getsizeof(friend_ids)
+            edges += len(friend_ids)
+
+        return {
+            'users': len(adjacency),
+            'friendships': edges // 2,
+            'builds': self.builds,
+            'build_seconds': self.build_seconds,
+            'age_seconds': round(time.time() - self._built_at, 1) if self._built_at else None,
+            'ttl': self.ttl,
+            'building': self._thread is not None and self._thread.is_alive(),
+            'failures': self.failures,
+            'memory_bytes': memory
+        }
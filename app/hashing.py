@@ -0,0 +1,188 @@
+"""
+Password hashing offloaded to a bounded worker pool
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """
+    Raised when the hashing pool is full or a job takes too long
+    """
+    pass
+
+
+def _hash_password(password, rounds):
+    """
+    Hash a password. Runs inside a pool worker.
+    """
+    start = time.time()
+    pw_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return pw_hash, time.time() - start
+
+
+def _check_password(pw_hash, password):
+    """
+    Check a password against its hash. Runs inside a pool worker.
+    """
+    start = time.time()
+    try:
+        valid = bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # The stored value is not a bcrypt hash
+        valid = False
+    return valid, time.time() - start
+
+
+class PasswordHasher(object):
+    """
+    Runs bcrypt in a thread or process pool so that a burst of logins
+    cannot occupy every request thread.
+    At most pool_size + queue_size jobs are accepted at a time.
+    """
+
+    def __init__(self):
+        self.pool_type = 'thread'
+        self.pool_size = 2
+        self.queue_size = 16
+        self.timeout = 5.0
+        self.rounds = 12
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.pool_size + self.queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.hash_time = 0.0
+        self.max_hash_time = 0.0
+        self.wait_time = 0.0
+
+    def init_app(self, app):
+        """
+        Configure the pool from the application settings
+        """
+        self.shutdown()
+
+        self.pool_type = app.config.get('PASSWORD_POOL', self.pool_type)
+        self.pool_size = app.config.get('PASSWORD_POOL_SIZE', self.pool_size)
+        self.queue_size = app.config.get('PASSWORD_QUEUE_SIZE', self.queue_size)
+        self.timeout = app.config.get('PASSWORD_TIMEOUT', self.timeout)
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self._slots = threading.BoundedSemaphore(self.pool_size + self.queue_size)
+        self._reset_counters()
+        app.extensions['password_hasher'] = self
+
+    def generate_password_hash(self, password, rounds=None):
+        """
+        Hash a password with the configured work factor
+        """
+        return self._run(_hash_password, password, rounds or self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """
+        Check a password against its hash
+        """
+        return self._run(_check_password, pw_hash, password)
+
+    def shutdown(self):
+        """
+        Stop the worker pool without waiting for running jobs
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self):
+        """
+        Return the queue depth and latency counters
+        """
+        with self._lock:
+            completed = self.completed
+            return {
+                'pool': self.pool_type,
+                'workers': self.pool_size,
+                'capacity': self.pool_size + self.queue_size,
+                'in_flight': self.in_flight,
+                'queued': max(self.in_flight - self.pool_size, 0),
+                'completed': completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'avg_hash_ms': round(self.hash_time * 1000 / completed, 2) if completed else 0.0,
+                'max_hash_ms': round(self.max_hash_time * 1000, 2),
+                'avg_wait_ms': round(self.wait_time * 1000 / completed, 2) if completed else 0.0
+            }
+
+    def _get_executor(self):
+        """
+        Create the pool on first use so that it is started after gunicorn forks
+        """
+        with self._lock:
+            if self._executor is None:
+                if self.pool_type == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size)
+            return self._executor
+
+    def _run(self, func, *args):
+        """
+        Submit a job to the pool and wait for its result
+        """
+        slots = self._slots
+        if not slots.acquire(False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy('The password hashing queue is full')
+
+        with self._lock:
+            self.in_flight += 1
+
+        submitted = time.time()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._release(slots)
+            raise
+        # The slot is only given back once the worker is done with the job
+        future.add_done_callback(lambda _future: self._release(slots))
+
+        try:
+            result, hash_time = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HashingBusy('Password hashing timed out')
+
+        with self._lock:
+            self.completed += 1
+            self.hash_time += hash_time
+            self.max_hash_time = max(self.max_hash_time, hash_time)
+            self.wait_time += max(time.time() - submitted - hash_time, 0)
+
+        return result
+
+    def _release(self, slots):
+        """
+        Give back a queue slot
+        """
+        with self._lock:
+            if slots is self._slots:
+                self.in_flight -= 1
+        slots.release()
+
+    def _reset_counters(self):
+        """
+        Reset the metrics
+        """
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.hash_time = 0.0
+        self.max_hash_time = 0.0
+        self.wait_time = 0.0
@@ -1,339 +1,243 @@
 """
 Views for the item blueprint
 """
-import re
 from flask.views import MethodView
-from flask import request, jsonify, make_response
-from sqlalchemy import func
+from flask import jsonify, make_response, g
+from sqlalchemy.exc import IntegrityError
+from app import db
 from . import item_blueprint
-from ..models import ShoppingList, ShoppingListItem
+from ..models import ShoppingListItem
 from ..decorators import MyDecorator
+from ..pagination import paginate
+from ..permissions import can_read, can_write, load_item, WRITE
+from ..search import search
+from ..validation import validate, load_body, ValidationError, Schema, Integer, Float, \
+    Name, PAGINATION
 my_dec = MyDecorator()
 
+LIST_PATH = Schema(
+    Integer('list_id'),
+    type_message='The parameter provided should be an integer')
+ITEM_PATH = Schema(
+    Integer('list_id'),
+    Integer('item_id'),
+    type_message='The parameters provided should be integers')
+ITEM_BODY = Schema(
+    Name('name', 'item name', required=True),
+    Float('quantity', required=True, min_value=0,
+          range_message='The values should be positive numbers'),
+    Float('unit_price', required=True, min_value=0,
+          range_message='The values should be positive numbers'),
+    type_message='The parameters provided should be strings or floats',
+    required_message='Please provide all required the details.')
+ITEM_UPDATE_BODY = Schema(
+    Name('name', 'item name'),
+    Float('quantity', min_value=0,
+          range_message='The values should be positive numbers'),
+    Float('unit_price', min_value=0,
+          range_message='The values should be positive numbers'),
+    type_message='The parameters provided should be strings or floats')
+
 
 class ItemOps(MethodView):
     """
     Handles shopping list item creation and retrieval
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=LIST_PATH)
     def post(list_id):
         """
         POST - Creates a shopping list item
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameter provided should be an integer'}
-                return make_response(jsonify(response)), 401
-
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-
-            if not shopping_list:
-                response = {"message": "That shopping list in not yours or does not exist"}
-                return make_response(jsonify(response)), 404
-
-            try:
-                name = str(request.data.get('name', ''))
-                quantity = float(request.data.get('quantity', 0.0))
-                unit_price = float(request.data.get('unit_price', 0.0))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be strings or floats'}
-                return make_response(jsonify(response)), 401
-
-            if name and quantity and unit_price:
-                if not re.match("^[a-zA-Z0-9 _]*$", name):
-                    response = {
-                        'message': 'The item name cannot contain special characters. '
-                                   'Only underscores'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                if (quantity < 0) or (unit_price < 0):
-                    response = {
-                        'message': 'The values should be positive numbers'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                s_list_item = ShoppingListItem.query.\
-                    filter(func.lower(ShoppingListItem.name) == name.lower(),
-                           ShoppingListItem.list_id == list_id).first()
-
-                if not s_list_item:
-                    # There is no list item so we'll try to create it
-                    shopping_list_item = ShoppingListItem(list_id=list_id,
-                                                          name=name, quantity=quantity,
-                                                          unit_price=unit_price)
-                    shopping_list_item.save()
-
-                    response = jsonify({
-                        'id': shopping_list_item.id,
-                        'name': shopping_list_item.name,
-                        'quantity': shopping_list_item.quantity,
-                        'unit_price': shopping_list_item.unit_price,
-                        'date_created': shopping_list_item.date_created,
-                        'date_modified': shopping_list_item.date_modified
-                    })
-                    response.status_code = 201
-                    return response
-
-                response = {'message': 'That item already exists.'}
-                return make_response(jsonify(response)), 401
-
-            response = {'message': 'Please provide all required the details.'}
-            return make_response(jsonify(response)), 400
+        user_id = g.user_id
+
+        if not can_write(user_id, list_id):
+            response = {"message": "That shopping list in not yours or does not exist"}
+            return make_response(jsonify(response)), 404
+
+        try:
+            data = load_body(ITEM_BODY)
+        except ValidationError as error:
+            return error.response()
+
+        name = data['name']
+        quantity = data['quantity']
+        unit_price = data['unit_price']
+
+        shopping_list_item = ShoppingListItem(list_id=list_id, name=name, quantity=quantity,
+                                              unit_price=unit_price)
+        try:
+            shopping_list_item.save()
+        except IntegrityError:
+            # The unique index on (list_id, lower(name)) rejected the item
+            db.session.rollback()
+            response = {'message': 'That item already exists.'}
+            return make_response(jsonify(response)), 401
+
+        response = jsonify({
+            'id': shopping_list_item.id,
+            'name': shopping_list_item.name,
+            'quantity': shopping_list_item.quantity,
+            'unit_price': shopping_list_item.unit_price,
+            'date_created': shopping_list_item.date_created,
+            'date_modified': shopping_list_item.date_modified
+        })
+        response.status_code = 201
+        return response
 
     @staticmethod
+    @validate(path=LIST_PATH, query=PAGINATION)
     def get(list_id):
         """
         GET - Retrieves all items belonging to a specific shopping list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        user_id = g.user_id
+
+        if not can_read(user_id, list_id):
+            response = {"message": "That shopping list in not yours or does not exist"}
+            return make_response(jsonify(response)), 404
+
+        search_query = g.args['q']
 
+        shopping_list_items = ShoppingListItem.query.filter_by(list_id=list_id)
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            shopping_list_items, rank = search(shopping_list_items, ShoppingListItem.name,
+                                               search_query)
+
+        paginated_items = paginate(shopping_list_items, ShoppingListItem.name,
+                                   ShoppingListItem.id, g.args, rank=rank)
+        results = []
+
+        if not paginated_items.items:
             if search_query:
-                # if parameter q is specified
-                shopping_list_items = ShoppingListItem.query. \
-                    filter(ShoppingListItem.name.ilike('%' + search_query + '%')). \
-                    filter_by(list_id=list_id).all()
-                output = []
-
-                if not shopping_list_items:
-                    response = {'message': 'The list has no items matching that criteria'}
-                    return make_response(jsonify(response)), 404
-
-                for list_item in shopping_list_items:
-                    obj = {
-                        'id': list_item.id,
-                        'name': list_item.name,
-                        'quantity': list_item.quantity,
-                        'unit_price': list_item.unit_price,
-                        'date_created': list_item.date_created,
-                        'date_modified': list_item.date_modified
-                    }
-                    output.append(obj)
-
-                response = jsonify(output)
-                response.status_code = 200
-                return response
-
-            total_items = ShoppingListItem.query.filter_by(list_id=list_id).count()
-            paginated_items = ShoppingListItem.query.filter_by(list_id=list_id). \
-                order_by(ShoppingListItem.name.asc()).paginate(page, limit)
-            results = []
-
-            if not paginated_items.items:
-                response = {'message': 'That list has no items'}
-                return make_response(jsonify(response)), 200
-
-            for shopping_list_item in paginated_items.items:
-                obj = {
-                    'id': shopping_list_item.id,
-                    'name': shopping_list_item.name,
-                    'quantity': shopping_list_item.quantity,
-                    'unit_price': shopping_list_item.unit_price,
-                    'date_created': shopping_list_item.date_created,
-                    'date_modified': shopping_list_item.date_modified
-                }
-                results.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_items.has_next:
-                next_page = '/shopping_lists/<list_id>/items' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_items.has_prev:
-                previous_page = '/shopping_lists/<list_id>/items' + '?page=' + str(page - 1) + \
-                                '&limit=' + str(limit)
-
-            response = {
-                'total': total_items,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'shopping_list_items': results
-            }
+                response = {'message': 'The list has no items matching that criteria'}
+                return make_response(jsonify(response)), 404
 
+            response = {'message': 'That list has no items'}
             return make_response(jsonify(response)), 200
 
+        for shopping_list_item in paginated_items.items:
+            obj = {
+                'id': shopping_list_item.id,
+                'name': shopping_list_item.name,
+                'quantity': shopping_list_item.quantity,
+                'unit_price': shopping_list_item.unit_price,
+                'date_created': shopping_list_item.date_created,
+                'date_modified': shopping_list_item.date_modified
+            }
+            results.append(obj)
+
+        response = {
+            'total': paginated_items.total,
+            'previous_page': paginated_items.previous_page,
+            'next_page': paginated_items.next_page,
+            'next_cursor': paginated_items.next_cursor,
+            'shopping_list_items': results
+        }
+
+        return make_response(jsonify(response)), 200
+
 
 class ItemMan(MethodView):
     """
     Handles shopping list item manipulation operations
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=ITEM_PATH)
     def get(list_id, item_id):
         """
         Retrieves a specific item
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-                int(item_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
-
-            # Retrieve a shopping list item using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-            shopping_list_item = \
-                ShoppingListItem.query.filter_by(id=item_id, list_id=list_id).first()
-
-            if not shopping_list or not shopping_list_item:
-                response = {"message": "That shopping list or item is not yours or does not exist"}
-                return make_response(jsonify(response)), 404
-
-            # Check if item belongs to its owner's list
-            if shopping_list.user_id == user_id:
-                response = jsonify({
-                    'id': shopping_list_item.id,
-                    'name': shopping_list_item.name,
-                    'quantity': shopping_list_item.quantity,
-                    'unit_price': shopping_list_item.unit_price,
-                    'date_created': shopping_list_item.date_created,
-                    'date_modified': shopping_list_item.date_modified
-                })
-                response.status_code = 200
-                return response
+        user_id = g.user_id
+
+        # Retrieve a shopping list item using it's id, with the user's access to its list
+        shopping_list_item, level = load_item(user_id, list_id, item_id)
+
+        if not shopping_list_item or not level:
+            response = {"message": "That shopping list or item is not yours or does not exist"}
+            return make_response(jsonify(response)), 404
+
+        response = jsonify({
+            'id': shopping_list_item.id,
+            'name': shopping_list_item.name,
+            'quantity': shopping_list_item.quantity,
+            'unit_price': shopping_list_item.unit_price,
+            'date_created': shopping_list_item.date_created,
+            'date_modified': shopping_list_item.date_modified
+        })
+        response.status_code = 200
+        return response
 
     @staticmethod
+    @validate(path=ITEM_PATH)
     def put(list_id, item_id):
         """
         Updates a specific item
         """
-        user_id = my_dec.check_token()
+        user_id = g.user_id
 
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-                int(item_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        # retrieve a shopping list item using it's id, with the user's access to its list
+        shopping_list_item, level = load_item(user_id, list_id, item_id)
 
-            # retrieve a shopping list item using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-            shopping_list_item = \
-                ShoppingListItem.query.filter_by(id=item_id, list_id=list_id).first()
+        if not shopping_list_item or level != WRITE:
+            response = {"message": "That shopping list or item is not yours or does not exist"}
+            return make_response(jsonify(response)), 404
 
-            if not shopping_list or not shopping_list_item:
-                response = {"message": "That shopping list or item is not yours or does not exist"}
-                return make_response(jsonify(response)), 404
+        try:
+            data = load_body(ITEM_UPDATE_BODY)
+        except ValidationError as error:
+            return error.response()
 
-            name = str(request.data.get('name', '')) if str(request.data.get('name', '')) \
-                else shopping_list_item.name
-            quantity = float(request.data.get('quantity', '')) if \
-                float(request.data.get('quantity', 0.0)) else shopping_list_item.quantity
-            unit_price = float(request.data.get('unit_price', '')) if \
-                float(request.data.get('unit_price', 0.0)) else shopping_list_item.unit_price
-
-            if name and quantity and unit_price:
-                if not re.match("^[a-zA-Z0-9 _]*$", name):
-                    response = {
-                        'message': 'The item name cannot contain special characters. '
-                                   'Only underscores'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                if (quantity < 0) or (unit_price < 0):
-                    response = {
-                        'message': 'The values should be positive numbers'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                s_list_item = ShoppingListItem.query.filter_by(list_id=list_id).all()
-
-                for l_item in s_list_item:
-                    # Check if item name exists
-                    if str(item_id) != str(l_item.id) and name.lower() == l_item.name.lower():
-                        response = {"message": "Item already exists"}
-                        return make_response(jsonify(response)), 401
-
-                # Check if item belongs to its owner's list
-                if shopping_list.user_id == user_id:
-
-                    shopping_list_item.name = name
-                    shopping_list_item.quantity = quantity
-                    shopping_list_item.unit_price = unit_price
-                    shopping_list_item.save()
-
-                    response = jsonify({
-                        'id': shopping_list_item.id,
-                        'name': shopping_list_item.name,
-                        'quantity': shopping_list_item.quantity,
-                        'unit_price': shopping_list_item.unit_price,
-                        'date_created': shopping_list_item.date_created,
-                        'date_modified': shopping_list_item.date_modified
-                    })
-                    response.status_code = 200
-                    return response
+        name = data['name'] or shopping_list_item.name
+        quantity = data['quantity'] or shopping_list_item.quantity
+        unit_price = data['unit_price'] or shopping_list_item.unit_price
+
+        if name and quantity and unit_price:
+            shopping_list_item.name = name
+            shopping_list_item.quantity = quantity
+            shopping_list_item.unit_price = unit_price
+            try:
+                shopping_list_item.save()
+            except IntegrityError:
+                db.session.rollback()
+                response = {"message": "Item already exists"}
+                return make_response(jsonify(response)), 401
+
+            response = jsonify({
+                'id': shopping_list_item.id,
+                'name': shopping_list_item.name,
+                'quantity': shopping_list_item.quantity,
+                'unit_price': shopping_list_item.unit_price,
+                'date_created': shopping_list_item.date_created,
+                'date_modified': shopping_list_item.date_modified
+            })
+            response.status_code = 200
+            return response
 
     @staticmethod
+    @validate(path=ITEM_PATH)
     def delete(list_id, item_id):
         """
         Deletes a specific item
         """
-        user_id = my_dec.check_token()
+        user_id = g.user_id
 
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                list_id = int(list_id)
-                item_id = int(item_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        # retrieve a shopping list item using it's id, with the user's access to its list
+        shopping_list_item, level = load_item(user_id, list_id, item_id)
 
-            # retrieve a shopping list item using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-            shopping_list_item = \
-                ShoppingListItem.query.filter_by(id=item_id, list_id=list_id).first()
-
-            if not shopping_list or not shopping_list_item:
-                response = {"message": "That shopping list or item is not yours or does not exist"}
-                return make_response(jsonify(response)), 404
+        if not shopping_list_item or level != WRITE:
+            response = {"message": "That shopping list or item is not yours or does not exist"}
+            return make_response(jsonify(response)), 404
 
-            if shopping_list.user_id == user_id:
-                shopping_list_item.delete()
-                response = {"message": "Item {} deleted successfully".format(shopping_list_item.id)}
-                return make_response(jsonify(response)), 200
+        shopping_list_item.delete()
+        response = {"message": "Item {} deleted successfully".format(shopping_list_item.id)}
+        return make_response(jsonify(response)), 200
 
 
 item_ops = ItemOps.as_view('item_ops')  # pylint: disable=invalid-name
@@ -0,0 +1,152 @@
+"""
+Outbound mail queue.
+Request handlers write emails to the outbox table and return straight away.
+A background worker delivers them in batches over a single SMTP connection.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask_mail import Message
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class MailWorker(object):
+    """
+    Delivers queued emails with retries and exponential backoff
+    """
+
+    def __init__(self, mail, db):
+        self.mail = mail
+        self.db = db
+        self.app = None
+        self.batch_size = 50
+        self.max_attempts = 5
+        self.retry_backoff = 30
+        self.poll_interval = 30
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the worker from the application settings
+        """
+        self.app = app
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', self.batch_size)
+        self.max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_backoff = app.config.get('MAIL_RETRY_BACKOFF', self.retry_backoff)
+        self.poll_interval = app.config.get('MAIL_POLL_INTERVAL', self.poll_interval)
+        app.extensions['mail_worker'] = self
+
+    def enqueue(self, recipient, subject, html):
+        """
+        Write an email to the outbox and wake the worker
+        """
+        from .models import OutboxEmail
+
+        email = OutboxEmail(recipient=recipient, subject=subject, html=html)
+        email.save()
+        self._wake.set()
+
+        return email
+
+    def deliver_pending(self, batch_size=None):
+        """
+        Deliver one batch of due emails over a single SMTP connection.
+        Returns the number of emails that were sent.
+        """
+        from .models import OutboxEmail
+
+        now = datetime.utcnow()
+        # Rows claimed by another worker are skipped on databases that support it
+        emails = OutboxEmail.query. \
+            filter(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now). \
+            order_by(OutboxEmail.next_attempt_at.asc()). \
+            limit(batch_size or self.batch_size). \
+            with_for_update(skip_locked=True).all()
+
+        if not emails:
+            self.db.session.commit()
+            return 0
+
+        sent = 0
+        try:
+            with self.mail.connect() as connection:
+                for email in emails:
+                    try:
+                        connection.send(Message(recipients=[email.recipient],
+                                                subject=email.subject,
+                                                html=email.html))
+                    except Exception as error:  # pylint: disable=broad-except
+                        self._schedule_retry(email, error)
+                    else:
+                        email.status = 'sent'
+                        email.attempts += 1
+                        email.date_sent = datetime.utcnow()
+                        sent += 1
+        except Exception as error:  # pylint: disable=broad-except
+            # The connection could not be opened or was dropped mid batch
+            for email in emails:
+                if email.status == 'pending' and email.next_attempt_at <= now:
+                    self._schedule_retry(email, error)
+
+        self.db.session.commit()
+        return sent
+
+    def deliver_all(self):
+        """
+        Deliver batches until no due emails are left
+        """
+        total = 0
+        while True:
+            sent = self.deliver_pending()
+            total += sent
+            if not sent:
+                return total
+
+    def start(self):
+        """
+        Start the background delivery thread once per process
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._thread = threading.Thread(target=self.run, name='mail-worker')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self):
+        """
+        Delivery loop. Runs in the background thread or from manage.py.
+        The emails already due are delivered before the first wait.
+        """
+        app = self.app
+        while True:
+            with app.app_context():
+                try:
+                    self.deliver_all()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Delivering queued emails failed')
+                    self.db.session.rollback()
+                finally:
+                    self.db.session.remove()
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _schedule_retry(self, email, error):
+        """
+        Back off exponentially, giving up after the maximum number of attempts
+        """
+        email.attempts += 1
+        email.last_error = str(error)[:255]
+
+        if email.attempts >= self.max_attempts:
+            email.status = 'failed'
+            logger.error('Giving up on email %s to %s: %s', email.id, email.recipient, error)
+            return
+
+        delay = self.retry_backoff * 2 ** (email.attempts - 1)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
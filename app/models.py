@@ -1,8 +1,15 @@
 """
 Database models
 """
-from app import db
-from flask_bcrypt import Bcrypt
+import hashlib
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db, token_cache, friend_cache, list_events, password_hasher
+from app.cache import FriendSets
+from app.search import searchable
 
 
 class User(db.Model):
@@ -24,19 +31,43 @@ class User(db.Model):
     shopping_lists = db.relationship(
         'ShoppingList', order_by='ShoppingList.id', cascade="all, delete-orphan")
 
+    # Emails are unique regardless of case
+    __table_args__ = (
+        db.Index('uq_users_lower_email', db.func.lower(email), unique=True),
+    )
+
     def __init__(self, username, email, password):
         """
         Initialize the user with a username and a password
         """
         self.username = username
         self.email = email
-        self.password = Bcrypt().generate_password_hash(password).decode()
+        self.password = password_hasher.generate_password_hash(password)
 
     def password_is_valid(self, password):
         """
         Checks the password against it's hash to validates the user's password
         """
-        return Bcrypt().check_password_hash(self.password, password)
+        return password_hasher.check_password_hash(self.password, password)
+
+    def password_needs_rehash(self):
+        """
+        Checks whether the password was hashed with a different work factor
+        than the one currently configured
+        """
+        try:
+            rounds = int(self.password.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+
+        return rounds != password_hasher.rounds
+
+    def rehash_password(self, password):
+        """
+        Hash the password again with the configured work factor
+        """
+        self.password = password_hasher.generate_password_hash(password)
+        self.save()
 
     def save(self):
         """
@@ -45,13 +76,17 @@ class User(db.Model):
         """
         db.session.add(self)
         db.session.commit()
+        # The cached admin flag may have changed
+        token_cache.invalidate_user(self.id)
 
     def delete(self):
         """
         Deletes a user
         """
+        user_id = self.id
         db.session.delete(self)
         db.session.commit()
+        token_cache.invalidate_user(user_id)
 
     def __repr__(self):
         """
@@ -79,6 +114,14 @@ class ShoppingList(db.Model):
     shared_lists = db.relationship(
         'SharedList', order_by='SharedList.id', cascade="all, delete-orphan")
 
+    # A user's list names are unique regardless of case
+    __table_args__ = (
+        db.Index('uq_shopping_lists_user_id_lower_name', user_id, db.func.lower(name),
+                 unique=True),
+        db.Index('ix_shopping_lists_user_id_name', 'user_id', 'name'),
+        db.Index('ix_shopping_lists_user_id_date_modified', 'user_id', 'date_modified'),
+    )
+
     def __init__(self, user_id, name, description):
         """
         Initialize the shopping list with its creator
@@ -125,6 +168,14 @@ class ShoppingListItem(db.Model):
     date_modified = db.Column(db.DateTime, default=db.func.current_timestamp(),
                               onupdate=db.func.current_timestamp())
 
+    # Item names are unique within a list regardless of case
+    __table_args__ = (
+        db.Index('uq_shopping_list_items_list_id_lower_name', list_id, db.func.lower(name),
+                 unique=True),
+        db.Index('ix_shopping_list_items_list_id_name', 'list_id', 'name'),
+        db.Index('ix_shopping_list_items_list_id_date_modified', 'list_id', 'date_modified'),
+    )
+
     def __init__(self, list_id, name, quantity, unit_price):
         """
         Initialize the shopping list item
@@ -157,7 +208,8 @@ class ShoppingListItem(db.Model):
 
 class PasswordReset(db.Model):
     """
-    This class defines the password resets table
+    This class defines the password resets table.
+    Only a SHA-256 digest of the reset token is stored.
     """
 
     __tablename__ = 'password_resets'
@@ -165,15 +217,51 @@ class PasswordReset(db.Model):
     # Define the columns of the users table, starting with the primary key
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(256), nullable=False, unique=True)
-    token = db.Column(db.String(256), nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
 
-    def __init__(self, email, token):
+    def __init__(self, email, token, expires_at):
         """
         Initialize the table
         """
         self.email = email
-        self.token = token
+        self.token_hash = self.hash_token(token)
+        self.expires_at = expires_at
+
+    @staticmethod
+    def hash_token(token):
+        """
+        Return the fixed width digest stored for a token
+        """
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def find_valid(token):
+        """
+        Look up an unexpired reset by its token
+        """
+        return PasswordReset.query. \
+            filter(PasswordReset.token_hash == PasswordReset.hash_token(token),
+                   PasswordReset.expires_at > datetime.utcnow()).first()
+
+    @staticmethod
+    def sweep_expired(batch_size=1000):
+        """
+        Delete expired resets in batches and return how many were removed
+        """
+        removed = 0
+        while True:
+            expired_ids = [row.id for row in db.session.query(PasswordReset.id).
+                           filter(PasswordReset.expires_at <= datetime.utcnow()).
+                           limit(batch_size)]
+            if not expired_ids:
+                return removed
+
+            PasswordReset.query.filter(PasswordReset.id.in_(expired_ids)). \
+                delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(expired_ids)
 
     def save(self):
         """
@@ -184,7 +272,7 @@ class PasswordReset(db.Model):
 
     def delete(self):
         """
-        Deletes a given shopping list item
+        Deletes a given password reset
         """
         db.session.delete(self)
         db.session.commit()
@@ -193,30 +281,158 @@ class PasswordReset(db.Model):
         """
         Return a representation of a reset instance
         """
-        return "<PasswordReset: {}>".format(self.token)
+        return "<PasswordReset: {}>".format(self.email)
 
 
 class Friend(db.Model):
     """
-    This class represents the friends table
+    This class represents the friends table.
+    Each friendship is stored once, as the ordered pair of its users,
+    so any relationship check is a single probe of the unique pair index.
     """
 
     __tablename__ = 'friends'
+    __table_args__ = (
+        db.Index('uq_friends_low_id_high_id', 'low_id', 'high_id', unique=True),
+        db.Index('ix_friends_high_id', 'high_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user1 = db.Column(db.Integer)
-    user2 = db.Column(db.Integer)
+    low_id = db.Column(db.Integer, nullable=False)
+    high_id = db.Column(db.Integer, nullable=False)
+    requested_by = db.Column(db.Integer, nullable=False)
     accepted = db.Column(db.Boolean, nullable=False, default=False)
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(db.DateTime, default=db.func.current_timestamp(),
                               onupdate=db.func.current_timestamp())
 
-    def __init__(self, user1, user2):
+    def __init__(self, requested_by, requested_to):
         """
-        Initialize friend
+        Initialize a friend request
         """
-        self.user1 = user1
-        self.user2 = user2
+        self.low_id, self.high_id = Friend.pair(requested_by, requested_to)
+        self.requested_by = requested_by
+
+    @staticmethod
+    def pair(user_id, other_id):
+        """
+        The (low_id, high_id) pair of two users
+        """
+        return min(user_id, other_id), max(user_id, other_id)
+
+    @staticmethod
+    def between(user_id, other_id):
+        """
+        Look up the friendship or request between two users
+        """
+        low_id, high_id = Friend.pair(user_id, other_id)
+        return Friend.query.filter_by(low_id=low_id, high_id=high_id).first()
+
+    @staticmethod
+    def other_user(user_id):
+        """
+        Join condition matching the users on the other side of a user's friendships
+        """
+        return db.or_(db.and_(Friend.low_id == user_id, Friend.high_id == User.id),
+                      db.and_(Friend.high_id == user_id, Friend.low_id == User.id))
+
+    @staticmethod
+    def sets_for(user_id):
+        """
+        The FriendSets of a user, from the friend cache when possible
+        """
+        entry = friend_cache.get(user_id)
+        if entry is not None:
+            return entry
+
+        version = friend_cache.version()
+        friends, requests, sent = set(), set(), set()
+        rows = db.session.query(Friend.low_id, Friend.high_id, Friend.requested_by,
+                                Friend.accepted). \
+            filter(db.or_(Friend.low_id == user_id, Friend.high_id == user_id))
+        for low_id, high_id, requested_by, accepted in rows:
+            other_id = high_id if low_id == user_id else low_id
+            if accepted:
+                friends.add(other_id)
+            elif requested_by == user_id:
+                sent.add(other_id)
+            else:
+                requests.add(other_id)
+
+        entry = FriendSets(frozenset(friends), frozenset(requests), frozenset(sent))
+        friend_cache.set(user_id, entry, version)
+        return entry
+
+    @staticmethod
+    def accepted_pairs():
+        """
+        The (low_id, high_id) pairs of every accepted friendship, streamed
+        """
+        return db.session.query(Friend.low_id, Friend.high_id). \
+            filter(Friend.accepted).yield_per(10000)
+
+    @staticmethod
+    def requests_from(user_id, requester_ids):
+        """
+        Query of the pending requests sent to a user by some users
+        """
+        return Friend.query. \
+            filter(db.or_(db.and_(Friend.low_id == user_id, Friend.high_id.in_(requester_ids)),
+                          db.and_(Friend.high_id == user_id, Friend.low_id.in_(requester_ids))),
+                   Friend.requested_by.in_(requester_ids),
+                   Friend.accepted == db.false())
+
+    @staticmethod
+    def accept_requests(user_id, requester_ids):
+        """
+        Accept the requests sent to a user by some users in a single UPDATE.
+        Returns the number of requests accepted.
+        """
+        count = Friend.requests_from(user_id, requester_ids). \
+            update({Friend.accepted: True}, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def reject_requests(user_id, requester_ids):
+        """
+        Delete the requests sent to a user by some users in a single DELETE.
+        Returns the number of requests rejected.
+        """
+        count = Friend.requests_from(user_id, requester_ids). \
+            delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def mutual_counts(user_id, other_ids):
+        """
+        Count the friends each of other_ids has in common with a user,
+        in one grouped query. Users with none are left out.
+        """
+        friend_ids = Friend.sets_for(user_id).friends
+        if not friend_ids or not other_ids:
+            return {}
+
+        # Each of their friendships with one of the user's friends, from either side
+        low_side = db.select([Friend.low_id.label('other_id')]). \
+            where(db.and_(Friend.accepted, Friend.low_id.in_(other_ids),
+                          Friend.high_id.in_(friend_ids)))
+        high_side = db.select([Friend.high_id.label('other_id')]). \
+            where(db.and_(Friend.accepted, Friend.high_id.in_(other_ids),
+                          Friend.low_id.in_(friend_ids)))
+        shared = db.union_all(low_side, high_side).alias('shared')
+
+        rows = db.session.query(shared.c.other_id, db.func.count()). \
+            group_by(shared.c.other_id)
+        return dict(rows)
+
+    @staticmethod
+    def are_friends(user_id, other_id):
+        """
+        Whether two users are friends
+        """
+        return other_id in Friend.sets_for(user_id).friends
 
     def save(self):
         """
@@ -236,7 +452,7 @@ class Friend(db.Model):
         """
         Return a representation of a friend instance
         """
-        return "<Friend: {}>".format(self.user1)
+        return "<Friend: {} {}>".format(self.low_id, self.high_id)
 
 
 class SharedList(db.Model):
@@ -245,6 +461,13 @@ class SharedList(db.Model):
     """
 
     __tablename__ = 'shared_lists'
+    __table_args__ = (
+        db.Index('uq_shared_lists_list_id_user2', 'list_id', 'user2', unique=True),
+        db.Index('ix_shared_lists_user1_list_id', 'user1', 'list_id'),
+        db.Index('ix_shared_lists_user2_list_id', 'user2', 'list_id'),
+        db.Index('ix_shared_lists_user1_date_modified', 'user1', 'date_modified'),
+        db.Index('ix_shared_lists_user2_date_modified', 'user2', 'date_modified'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     list_id = db.Column(db.Integer, db.ForeignKey(ShoppingList.id))
@@ -262,6 +485,76 @@ class SharedList(db.Model):
         self.user1 = user1
         self.user2 = user2
 
+    @staticmethod
+    def share_with(list_id, user_id, friend_ids):
+        """
+        Share a list with those of some users who are friends of the sharer, in one transaction.
+        Returns the set of ids it was shared with and the set it had already been shared with.
+        Friendships are checked in the database, as the friend cache of this process can be
+        behind the changes made by others.
+        """
+        def shared_with():
+            """
+            The ids among friend_ids the list is currently shared with
+            """
+            return set(user2 for (user2,) in db.session.query(SharedList.user2).
+                       filter(SharedList.list_id == list_id, SharedList.user2.in_(friend_ids)))
+
+        already_shared = shared_with()
+        new_ids = [friend_id for friend_id in friend_ids if friend_id not in already_shared]
+        if not new_ids:
+            return set(), already_shared
+
+        # One INSERT ... SELECT of the users who are friends and have no share yet
+        befriended = db.session.query(Friend.id). \
+            filter(Friend.accepted == db.true(),
+                   db.or_(db.and_(Friend.low_id == user_id, Friend.high_id == User.id),
+                          db.and_(Friend.low_id == User.id, Friend.high_id == user_id))).exists()
+        existing = db.session.query(SharedList.id). \
+            filter(SharedList.list_id == list_id, SharedList.user2 == User.id).exists()
+        rows = db.select([db.literal(list_id), db.literal(user_id), User.id]). \
+            where(db.and_(User.id.in_(new_ids), befriended, ~existing))
+        columns = ['list_id', 'user1', 'user2']
+
+        if db.session.connection().dialect.name == 'postgresql':
+            # Users a concurrent share took first are skipped by the unique index
+            # and only the rows inserted here are returned
+            statement = postgresql.insert(SharedList.__table__). \
+                from_select(columns, rows). \
+                on_conflict_do_nothing(index_elements=['list_id', 'user2']). \
+                returning(SharedList.__table__.c.user2)
+            shared = set(user2 for (user2,) in db.session.execute(statement))
+        else:
+            try:
+                db.session.execute(SharedList.__table__.insert().from_select(columns, rows))
+            except IntegrityError:
+                # A concurrent share took one of the users first, so start again
+                db.session.rollback()
+                return SharedList.share_with(list_id, user_id, friend_ids)
+            # The other databases let one writer in at a time, so the new rows are ours
+            shared = shared_with() - already_shared
+
+        already_shared = shared_with() - shared
+        db.session.commit()
+        return shared, already_shared
+
+    @staticmethod
+    def unshare_all(list_id, user_id):
+        """
+        Stop sharing a list with everyone a user shared it with in a single DELETE.
+        Returns the number of shares removed.
+        """
+        shares = SharedList.query.filter_by(list_id=list_id, user1=user_id)
+        # Bulk deletes are not flushed, so their tombstones are written here
+        db.session.add_all(Tombstone.for_shares(shares.with_entities(
+            SharedList.id, SharedList.list_id, SharedList.user1, SharedList.user2)))
+        count = shares.delete(synchronize_session=False)
+        if count:
+            # and the live streams are told here
+            list_events.queue(db.session, list_id, 'access', {})
+        db.session.commit()
+        return count
+
     def save(self):
         """
         Save a shared list
@@ -281,3 +574,280 @@ class SharedList(db.Model):
         Return a representation of a shared list instance
         """
         return "<SharedList: {}>".format(self.list_id)
+
+
+class Tombstone(db.Model):
+    """
+    This class represents the tombstones table.
+    A row tells a user's clients that a list, an item or a share they could
+    see was deleted, so that sync can remove it from their copy.
+    """
+
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        db.Index('ix_tombstones_user_id_date_deleted', 'user_id', 'date_deleted'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    list_id = db.Column(db.Integer, nullable=False)
+    date_deleted = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __init__(self, user_id, kind, object_id, list_id):
+        """
+        Initialize a tombstone for one user
+        """
+        self.user_id = user_id
+        self.kind = kind
+        self.object_id = object_id
+        self.list_id = list_id
+
+    @staticmethod
+    def viewers(session, list_ids):
+        """
+        Map each list id to the owner and the users it is shared with, in one query
+        """
+        rows = session.execute(db.union_all(
+            db.select([ShoppingList.id, ShoppingList.user_id]).
+            where(ShoppingList.id.in_(list_ids)),
+            db.select([SharedList.list_id, SharedList.user2]).
+            where(SharedList.list_id.in_(list_ids))))
+
+        viewers = {}
+        for list_id, user_id in rows:
+            viewers.setdefault(list_id, set()).add(user_id)
+        return viewers
+
+    @staticmethod
+    def for_shares(shares):
+        """
+        The tombstones of shares being deleted.
+        The recipient loses the list and the sharer the share.
+        """
+        tombstones = []
+        for share in shares:
+            tombstones.append(Tombstone(share.user2, 'list', share.list_id, share.list_id))
+            tombstones.append(Tombstone(share.user1, 'share', share.id, share.list_id))
+        return tombstones
+
+    @staticmethod
+    def sweep_expired(before, batch_size=1000):
+        """
+        Delete the tombstones older than a date in batches and return how many were removed
+        """
+        removed = 0
+        while True:
+            expired_ids = [row.id for row in db.session.query(Tombstone.id).
+                           filter(Tombstone.date_deleted < before).
+                           limit(batch_size)]
+            if not expired_ids:
+                return removed
+
+            Tombstone.query.filter(Tombstone.id.in_(expired_ids)). \
+                delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(expired_ids)
+
+    def __repr__(self):
+        """
+        Return a representation of a tombstone
+        """
+        return "<Tombstone: {} {}>".format(self.kind, self.object_id)
+
+
+class OutboxEmail(db.Model):
+    """
+    This class represents the outbox_emails table.
+    Emails are written here by the request handlers and delivered by the mail worker.
+    """
+
+    __tablename__ = 'outbox_emails'
+    __table_args__ = (
+        db.Index('ix_outbox_emails_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(256), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    last_error = db.Column(db.String(255))
+    date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
+    date_sent = db.Column(db.DateTime)
+
+    def __init__(self, recipient, subject, html):
+        """
+        Initialize a pending email
+        """
+        self.recipient = recipient
+        self.subject = subject
+        self.html = html
+        self.status = 'pending'
+        self.attempts = 0
+        self.next_attempt_at = datetime.utcnow()
+
+    def save(self):
+        """
+        Save an email to the outbox
+        """
+        db.session.add(self)
+        db.session.commit()
+
+    def delete(self):
+        """
+        Deletes an email from the outbox
+        """
+        db.session.delete(self)
+        db.session.commit()
+
+    def __repr__(self):
+        """
+        Return a representation of an outbox email instance
+        """
+        return "<OutboxEmail: {}>".format(self.recipient)
+
+
+# Trigram search structures for the q parameter
+searchable(User.__table__, 'username')
+searchable(ShoppingList.__table__, 'name')
+searchable(ShoppingListItem.__table__, 'name')
+
+
+# Keep the friend cache in step with the friends table.
+# Entries are dropped when the changes are flushed, and again when they are
+# committed or rolled back, in case they were reloaded in between.
+@event.listens_for(Session, 'after_flush')
+def dummy_friends_flushed(session, _flush_context):
+    """
+    Drop the cached friends of the users whose friendships changed
+    """
+    user_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Friend):
+            user_ids.update((instance.low_id, instance.high_id))
+
+    if user_ids:
+        session.info.setdefault('friend_users', set()).update(user_ids)
+        friend_cache.invalidate_users(user_ids)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def dummy_friends_bulk_changed(context):
+    """
+    Drop all cached friends when friendships are changed in bulk
+    """
+    if context.mapper.class_ is Friend:
+        context.session.info['friend_users_all'] = True
+        friend_cache.invalidate_all()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def dummy_friends_settled(session):
+    """
+    Drop the cached friends again once their changes are committed or rolled back
+    """
+    user_ids = session.info.pop('friend_users', None)
+    if session.info.pop('friend_users_all', False):
+        friend_cache.invalidate_all()
+    elif user_ids:
+        friend_cache.invalidate_users(user_ids)
+
+
+def item_event_data(item):
+    """
+    The fields of an item sent with its live changes
+    """
+    return {
+        'id': item.id,
+        'list_id': item.list_id,
+        'name': item.name,
+        'quantity': item.quantity,
+        'unit_price': item.unit_price
+    }
+
+
+# Publish the changes to lists to their live streams once they are committed
+@event.listens_for(Session, 'after_flush')
+def dummy_list_events_flushed(session, _flush_context):
+    """
+    Hold the item and access changes of a flush until the session commits
+    """
+    for instance in session.new:
+        if isinstance(instance, ShoppingListItem):
+            list_events.queue(session, instance.list_id, 'item_created',
+                              item_event_data(instance))
+
+    for instance in session.dirty:
+        if isinstance(instance, ShoppingListItem) and session.is_modified(instance):
+            list_events.queue(session, instance.list_id, 'item_updated',
+                              item_event_data(instance))
+        elif isinstance(instance, SharedList):
+            list_events.queue(session, instance.list_id, 'access', {})
+
+    for instance in session.deleted:
+        if isinstance(instance, ShoppingListItem):
+            list_events.queue(session, instance.list_id, 'item_deleted',
+                              {'id': instance.id, 'list_id': instance.list_id})
+        elif isinstance(instance, SharedList):
+            list_events.queue(session, instance.list_id, 'access', {})
+        elif isinstance(instance, ShoppingList):
+            list_events.queue(session, instance.id, 'access', {})
+
+
+@event.listens_for(Session, 'after_commit')
+def dummy_list_events_committed(session):
+    """
+    Publish the changes held for the session
+    """
+    list_events.publish_queued(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def dummy_list_events_rolled_back(session):
+    """
+    Drop the changes that were rolled back
+    """
+    list_events.discard_queued(session)
+
+
+# Deletions leave tombstones for every user who could see the deleted rows
+@event.listens_for(Session, 'before_flush')
+def dummy_tombstones_flushing(session, _flush_context, _instances):
+    """
+    Add the tombstones of the lists, items and shares about to be deleted
+    """
+    deleted_lists = set()
+    deleted_items = []
+    deleted_shares = []
+    for instance in session.deleted:
+        if isinstance(instance, ShoppingList):
+            deleted_lists.add(instance.id)
+        elif isinstance(instance, ShoppingListItem):
+            deleted_items.append(instance)
+        elif isinstance(instance, SharedList):
+            deleted_shares.append(instance)
+
+    # The items and shares of a deleted list go with its own tombstone
+    deleted_items = [item for item in deleted_items if item.list_id not in deleted_lists]
+    deleted_shares = [share for share in deleted_shares if share.list_id not in deleted_lists]
+
+    tombstones = Tombstone.for_shares(deleted_shares)
+    list_ids = deleted_lists.union(item.list_id for item in deleted_items)
+    if list_ids:
+        with session.no_autoflush:
+            viewers = Tombstone.viewers(session, list_ids)
+        for list_id in deleted_lists:
+            tombstones.extend(Tombstone(user_id, 'list', list_id, list_id)
+                              for user_id in viewers.get(list_id, ()))
+        for item in deleted_items:
+            tombstones.extend(Tombstone(user_id, 'item', item.id, item.list_id)
+                              for user_id in viewers.get(item.list_id, ()))
+
+    if tombstones:
+        session.add_all(tombstones)
@@ -0,0 +1,275 @@
+"""
+Pagination of the list endpoints.
+Pages are requested either by number (?page=2&limit=10) or with the opaque
+cursor returned by the previous page (?cursor=...&limit=10). Cursor pages
+seek on the sort column and the id so deep pages cost the same as the first.
+Search results are ordered by their rank first and seek on it too.
+The total is fetched with the page in the same query. Clients can skip it with
+?total=false or ask for the planner's estimate with ?total=estimate.
+"""
+import base64
+import bisect
+import json
+from collections import namedtuple
+from flask import abort, current_app, request, url_for
+from sqlalchemy import and_, func, or_
+from .errors import ValidationError
+
+DEFAULT_MAX_PAGE_LIMIT = 100
+# Query parameters that select the page rather than the listing
+PAGE_PARAMETERS = ('limit', 'page', 'cursor', 'total', 'q')
+
+
+def encode_cursor(*values):
+    """
+    Encode the sort values and id of the last row on a page
+    """
+    raw = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def is_value(value, types):
+    """
+    Whether a decoded cursor value is one of types, booleans excluded
+    """
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor into its list of values.
+    Raises ValueError if it is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Malformed cursor')
+
+    if not isinstance(values, list) or len(values) not in (2, 3):
+        raise ValueError('Malformed cursor')
+
+    # Only values that encode_cursor can produce are ever compared in SQL
+    if not is_value(values[-2], (str, int)) or not is_value(values[-1], int) or \
+            (len(values) == 3 and not is_value(values[0], (int, float))):
+        raise ValueError('Malformed cursor')
+
+    return values
+
+
+# A page of results with links to its neighbours
+Page = namedtuple('Page', ['items', 'total', 'has_prev', 'has_next', 'previous_page',
+                           'next_page', 'next_cursor'])
+
+
+def page_url(**params):
+    """
+    Link to the current endpoint with different query parameters
+    """
+    values = dict(request.view_args or {})
+    values.update(params)
+    return url_for(request.endpoint, **values)
+
+
+def estimate_count(query):
+    """
+    The planner's row estimate for a query.
+    Returns None on databases other than PostgreSQL.
+    """
+    connection = query.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+
+    compiled = query.order_by(None).statement.compile(dialect=connection.dialect)
+    plan = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def page_limit(args):
+    """
+    The requested page size, capped at MAX_PAGE_LIMIT
+    """
+    max_limit = current_app.config.get('MAX_PAGE_LIMIT', DEFAULT_MAX_PAGE_LIMIT)
+    return max(1, min(args['limit'], max_limit))
+
+
+def invalid_cursor():
+    """
+    The error for a cursor that does not belong to the listing
+    """
+    return ValidationError('The cursor provided is not valid')
+
+
+def page_links(args, limit, page, cursor, next_cursor):
+    """
+    Return the (previous_page, next_page) links of a page.
+    There is a next page when next_cursor is set.
+    Links keep the search, the way the total was requested and any other
+    option of the listing that the request set.
+    """
+    next_page = 'None'
+    previous_page = 'None'
+
+    params = {'limit': limit}
+    if args.get('q'):
+        params['q'] = args['q']
+    if total_mode(args) != 'true':
+        params['total'] = args['total']
+    for name in args:
+        if name not in PAGE_PARAMETERS and name in request.args:
+            params[name] = args[name]
+
+    if cursor:
+        # Cursor pages only link forwards
+        if next_cursor:
+            next_page = page_url(cursor=next_cursor, **params)
+    else:
+        if next_cursor:
+            next_page = page_url(page=page + 1, **params)
+        if page > 1:
+            previous_page = page_url(page=page - 1, **params)
+
+    return previous_page, next_page
+
+
+def seek_condition(sort_column, id_column, cursor, rank=None):
+    """
+    The condition selecting the rows after the cursor of the previous page
+    """
+    value, last_id = cursor[-2:]
+    seek = or_(sort_column > value, and_(sort_column == value, id_column > last_id))
+    if rank is not None:
+        seek = or_(rank < cursor[0], and_(rank == cursor[0], seek))
+
+    return seek
+
+
+def total_mode(args):
+    """
+    How the total was requested: 'true', 'false' or 'estimate'
+    """
+    return args.get('total') or 'true'
+
+
+def total_column(query, id_column, cursor):
+    """
+    The total of the listing fetched as a column of each row of the page
+    """
+    if cursor:
+        # The seek condition must not change the total, so count in a subquery
+        counted = query.order_by(None).with_entities(func.count(id_column)).as_scalar()
+    else:
+        counted = func.count().over()
+
+    return counted.label('total')
+
+
+def empty_page_total(query, cursor):
+    """
+    The total when the page has no row to carry it
+    """
+    return query.order_by(None).count() if cursor else 0
+
+
+def page_cursor(row, sort_column, id_column, rank_value=None):
+    """
+    The cursor of the page following the one ending with row
+    """
+    values = [getattr(row, sort_column.key), getattr(row, id_column.key)]
+    if rank_value is not None:
+        values.insert(0, rank_value)
+
+    return encode_cursor(*values)
+
+
+def paginate(query, sort_column, id_column, args, rank=None):
+    """
+    Return a Page of a query ordered by (sort_column, id_column), or by
+    (rank descending, sort_column, id_column) for ranked search results.
+    args holds the validated limit, page, cursor, total and q query parameters.
+    """
+    limit = page_limit(args)
+    cursor = args.get('cursor')
+    page = args['page']
+
+    if cursor and len(cursor) != (3 if rank is not None else 2):
+        # A cursor from a ranked page used on an unranked one or the other way around
+        raise invalid_cursor()
+
+    total = estimate_count(query) if total_mode(args) == 'estimate' else None
+    count_with_page = total is None and total_mode(args) != 'false'
+
+    ordering = [sort_column.asc(), id_column.asc()]
+    if rank is not None:
+        ordering.insert(0, rank.desc())
+    ordered = query.order_by(*ordering)
+
+    if cursor:
+        ordered = ordered.filter(seek_condition(sort_column, id_column, cursor, rank))
+    elif page < 1:
+        abort(404)
+    else:
+        ordered = ordered.offset((page - 1) * limit)
+
+    if rank is not None:
+        ordered = ordered.add_columns(rank.label('rank'))
+    if count_with_page:
+        ordered = ordered.add_columns(total_column(query, id_column, cursor))
+
+    # One extra row tells whether there is a next page
+    rows = ordered.limit(limit + 1).all()
+    ranks = [row.rank for row in rows] if rank is not None else []
+    if count_with_page:
+        total = rows[0].total if rows else empty_page_total(query, cursor)
+    if rank is not None or count_with_page:
+        rows = [row[0] for row in rows]
+
+    items = rows[:limit]
+    has_next = len(rows) > limit
+
+    if not items and not cursor and page != 1:
+        abort(404)
+
+    next_cursor = None
+    if has_next:
+        next_cursor = page_cursor(items[-1], sort_column, id_column,
+                                  ranks[limit - 1] if ranks else None)
+
+    has_prev = not cursor and page > 1
+    previous_page, next_page = page_links(args, limit, page, cursor, next_cursor)
+
+    return Page(items, total, has_prev, has_next, previous_page, next_page, next_cursor)
+
+
+def paginate_ranked(ranked, args):
+    """
+    Return a Page of (rank, id) pairs that were ranked in memory, sorted by
+    rank descending and then id. The total is always the number of pairs.
+    """
+    limit = page_limit(args)
+    cursor = args.get('cursor')
+    page = args['page']
+
+    if cursor:
+        if len(cursor) != 2:
+            raise invalid_cursor()
+        keys = [(-rank, item_id) for rank, item_id in ranked]
+        start = bisect.bisect_right(keys, (-cursor[0], cursor[1]))
+    else:
+        if page < 1:
+            abort(404)
+        start = (page - 1) * limit
+
+    items = ranked[start:start + limit]
+    has_next = start + limit < len(ranked)
+
+    if not items and not cursor and page != 1:
+        abort(404)
+
+    next_cursor = encode_cursor(*items[-1]) if has_next else None
+    has_prev = not cursor and page > 1
+    previous_page, next_page = page_links(args, limit, page, cursor, next_cursor)
+
+    return Page(items, len(ranked), has_prev, has_next, previous_page, next_page, next_cursor)
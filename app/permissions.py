@@ -0,0 +1,199 @@
+"""
+Access to shopping lists.
+Owners can read and write their lists, users a list was shared with can read it.
+Each decision takes one query, is memoized for the rest of the request and,
+when ACCESS_CACHE_TTL is set, reused across requests for that many seconds.
+"""
+from collections import namedtuple
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db, access_cache
+from .models import SharedList, ShoppingList, ShoppingListItem
+
+READ = 'read'
+WRITE = 'write'
+
+# The access level of a user on a list, None for no access, and whether the
+# list has been shared by or with the user
+Decision = namedtuple('Decision', ['level', 'shared'])
+NO_ACCESS = Decision(None, False)
+
+
+def _access_columns(user_id):
+    """
+    Columns deciding a user's access to the list of the outer query
+    """
+    shared_with = db.session.query(SharedList.id). \
+        filter(SharedList.list_id == ShoppingList.id, SharedList.user2 == user_id).exists()
+    shared_by = db.session.query(SharedList.id). \
+        filter(SharedList.list_id == ShoppingList.id, SharedList.user1 == user_id).exists()
+    return ShoppingList.user_id, shared_with, shared_by
+
+
+def _decide(user_id, owner_id, shared_with, shared_by):
+    """
+    The decision for a user given a list's owner and its shares
+    """
+    if owner_id == user_id:
+        level = WRITE
+    elif shared_with:
+        level = READ
+    else:
+        level = None
+    return Decision(level, bool(shared_with or shared_by))
+
+
+def _memo():
+    """
+    The decisions memoized for the current request
+    """
+    if not has_request_context():
+        return {}
+    if 'list_access' not in g:
+        g.list_access = {}
+    return g.list_access
+
+
+def _remember(user_id, list_id, decision):
+    """
+    Memoize a decision for the request and cache it across requests
+    """
+    _memo()[(user_id, list_id)] = decision
+    access_cache.set(user_id, list_id, decision)
+
+
+def _recall(user_id, list_id):
+    """
+    Return a known decision or None
+    """
+    memo = _memo()
+    decision = memo.get((user_id, list_id))
+    if decision is not None:
+        return decision
+
+    cached = access_cache.get(user_id, list_id)
+    if cached is not None:
+        memo[(user_id, list_id)] = cached.decision
+        return cached.decision
+
+    return None
+
+
+def decide(user_id, list_id):
+    """
+    The Decision on a user's access to a list
+    """
+    decision = _recall(user_id, list_id)
+    if decision is not None:
+        return decision
+
+    row = db.session.query(*_access_columns(user_id)). \
+        filter(ShoppingList.id == list_id).first()
+    decision = _decide(user_id, *row) if row else NO_ACCESS
+
+    _remember(user_id, list_id, decision)
+    return decision
+
+
+def can_read(user_id, list_id):
+    """
+    Whether a user can see a list and its items
+    """
+    return decide(user_id, list_id).level in (READ, WRITE)
+
+
+def can_write(user_id, list_id):
+    """
+    Whether a user can change a list and its items
+    """
+    return decide(user_id, list_id).level == WRITE
+
+
+def can_read_shared(user_id, list_id):
+    """
+    Whether a user can see a list that has been shared by or with them
+    """
+    decision = decide(user_id, list_id)
+    return decision.level is not None and decision.shared
+
+
+def load_item(user_id, list_id, item_id):
+    """
+    Return (item, level) for an item of a list.
+    The item and the access decision are loaded together in one query, or only
+    the item when the decision is already known. item is None if it does not exist.
+    """
+    decision = _recall(user_id, list_id)
+    if decision is not None:
+        if decision.level is None:
+            return None, None
+        item = ShoppingListItem.query.filter_by(id=item_id, list_id=list_id).first()
+        return item, decision.level
+
+    row = db.session.query(ShoppingListItem, *_access_columns(user_id)). \
+        join(ShoppingList, ShoppingList.id == ShoppingListItem.list_id). \
+        filter(ShoppingListItem.id == item_id, ShoppingListItem.list_id == list_id).first()
+    if not row:
+        # The list may still exist, so nothing is learnt about the access
+        return None, None
+
+    decision = _decide(user_id, *row[1:])
+    _remember(user_id, list_id, decision)
+    return row[0], decision.level
+
+
+def forget_lists(list_ids):
+    """
+    Drop the memoized and cached decisions on some lists
+    """
+    access_cache.invalidate_lists(list_ids)
+    memo = _memo()
+    for key in [key for key in memo if key[1] in list_ids]:
+        del memo[key]
+
+
+# Decisions are dropped when lists are created or deleted and when shares change,
+# once when the change is flushed and again when it is committed or rolled back
+@event.listens_for(Session, 'after_flush')
+def dummy_lists_flushed(session, _flush_context):
+    """
+    Drop the decisions on the lists whose access changed
+    """
+    list_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, SharedList):
+            list_ids.add(instance.list_id)
+    for instance in list(session.new) + list(session.deleted):
+        if isinstance(instance, ShoppingList):
+            list_ids.add(instance.id)
+
+    if list_ids:
+        session.info.setdefault('access_lists', set()).update(list_ids)
+        forget_lists(list_ids)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def dummy_lists_bulk_changed(context):
+    """
+    Drop every decision when shares or lists are changed in bulk
+    """
+    if context.mapper.class_ in (SharedList, ShoppingList):
+        context.session.info['access_lists_all'] = True
+        access_cache.invalidate_all()
+        _memo().clear()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def dummy_lists_settled(session):
+    """
+    Drop the decisions again once the changes are committed or rolled back
+    """
+    list_ids = session.info.pop('access_lists', None)
+    if session.info.pop('access_lists_all', False):
+        access_cache.invalidate_all()
+        _memo().clear()
+    elif list_ids:
+        forget_lists(list_ids)
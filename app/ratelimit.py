@@ -0,0 +1,213 @@
+"""
+Rate limiting middleware using per route token bucket policies
+"""
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+import jwt
+
+
+class RatePolicy(object):
+    """
+    A token bucket policy for the requests matching a method, a path and
+    optionally a query parameter.
+    Clients are identified by their IP address or by the user of their access token.
+    It is built from one of the RATELIMIT_POLICIES settings, which hold the
+    name, path and rate per seconds of the policy, and optionally its burst,
+    methods, key ('ip' or 'user') and query parameter.
+    """
+
+    def __init__(self, settings):
+        self.name = settings['name']
+        self.path = re.compile(settings['path'])
+        self.methods = set(settings['methods']) if settings.get('methods') else None
+        self.refill_rate = float(settings['rate']) / settings['per']
+        self.capacity = settings.get('burst') or settings['rate']
+        self.key = settings.get('key', 'ip')
+        self.query = settings.get('query')
+
+    def matches(self, method, path, query_string):
+        """
+        Check whether a request falls under this policy
+        """
+        if self.methods and method not in self.methods:
+            return False
+        if not self.path.match(path):
+            return False
+        if self.query:
+            params = [param.split('=', 1) for param in query_string.split('&') if param]
+            return any(param[0] == self.query and len(param) > 1 and param[1]
+                       for param in params)
+        return True
+
+
+class MemoryBackend(object):
+    """
+    Token buckets kept in the memory of a single process
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, refill_rate, capacity):
+        """
+        Take a token from a bucket.
+        Returns whether the request is allowed and how many seconds to wait otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, _retry_after(tokens, refill_rate)
+
+
+class RedisBackend(object):
+    """
+    Token buckets shared by every worker through Redis
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[2])
+    local refill_rate = tonumber(ARGV[1])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - updated, 0) * refill_rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for a redis:// '
+                               'RATELIMIT_STORAGE_URL')
+
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key, refill_rate, capacity):
+        """
+        Take a token from a bucket atomically
+        """
+        allowed, tokens = self.script(keys=[self.prefix + key],
+                                      args=[refill_rate, capacity, time.time()])
+        tokens = float(tokens)
+
+        return bool(allowed), _retry_after(tokens, refill_rate)
+
+
+def _retry_after(tokens, refill_rate):
+    """
+    Seconds until the bucket holds a whole token again
+    """
+    if tokens >= 1:
+        return 0
+    return int(math.ceil((1 - tokens) / refill_rate))
+
+
+def backend_from_url(url):
+    """
+    Create the bucket storage named by RATELIMIT_STORAGE_URL
+    """
+    if not url or url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    raise ValueError('Unsupported RATELIMIT_STORAGE_URL: {}'.format(url))
+
+
+class RateLimitMiddleware(object):
+    """
+    Middleware class for rate limiting.
+    It sits outside PrefixMiddleware so policy paths include the /v1 prefix.
+    The number of trusted proxies and the token secret are read from config.
+    """
+
+    def __init__(self, app, policies, backend, config=None):
+        config = config or {}
+        self.app = app
+        self.policies = policies
+        self.backend = backend
+        self.proxy_count = config.get('RATELIMIT_PROXY_COUNT', 0)
+        self.secret = config.get('SECRET')
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        path = environ.get('PATH_INFO', '')
+        query_string = environ.get('QUERY_STRING', '')
+
+        for policy in self.policies:
+            if not policy.matches(method, path, query_string):
+                continue
+
+            key = '{}:{}'.format(policy.name, self.client_key(environ, policy.key))
+            allowed, retry_after = self.backend.consume(key, policy.refill_rate,
+                                                        policy.capacity)
+            if not allowed:
+                return self.too_many_requests(start_response, retry_after)
+
+        return self.app(environ, start_response)
+
+    def client_key(self, environ, key_type):
+        """
+        Identify the client by the user of its access token or by IP address.
+        Only the token's signature is checked, which is cheap, so every token of
+        a user shares one bucket. Requests without a valid token fall back to the address.
+        """
+        if key_type == 'user':
+            token = environ.get('HTTP_X_ACCESS_TOKEN')
+            if token and self.secret:
+                try:
+                    user_id = jwt.decode(token, self.secret).get('id')
+                except (jwt.InvalidTokenError, jwt.ExpiredSignatureError):
+                    user_id = None
+                if user_id is not None:
+                    return 'user:{}'.format(user_id)
+
+        address = environ.get('REMOTE_ADDR', '')
+        if self.proxy_count:
+            # The trusted proxies append the address they saw to X-Forwarded-For
+            forwarded = [ip.strip() for ip in
+                         environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+            if len(forwarded) >= self.proxy_count:
+                address = forwarded[-self.proxy_count]
+
+        return 'ip:' + address
+
+    @staticmethod
+    def too_many_requests(start_response, retry_after):
+        """
+        Reject the request with a 429 response
+        """
+        body = json.dumps({
+            'status': 429,
+            'message': 'Too many requests. Please try again in {} seconds.'.format(retry_after)
+        }).encode()
+        start_response('429 Too Many Requests', [('Content-Type', 'application/json'),
+                                                 ('Content-Length', str(len(body))),
+                                                 ('Retry-After', str(retry_after))])
+        return [body]
@@ -0,0 +1,131 @@
+"""
+Search for the q parameter of the list endpoints.
+PostgreSQL matches with trigram (pg_trgm) GIN indexes and ranks by similarity.
+SQLite matches with FTS5 trigram tables kept in sync by triggers and ranks by bm25.
+Terms shorter than a trigram fall back to a LIKE filter on the already narrowed rows.
+"""
+import sqlite3
+from sqlalchemy import DDL, Float, cast, event, func, literal_column, select, table, \
+    column as sql_column
+
+MIN_TRIGRAM_LENGTH = 3
+# FTS5 gained the trigram tokenizer in SQLite 3.34
+SQLITE_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+
+def _sqlite_trigram(_ddl, _target, bind, **_kwargs):
+    """
+    Only create the FTS tables when the SQLite library can tokenize trigrams
+    """
+    return bind.dialect.name == 'sqlite' and SQLITE_TRIGRAM
+
+
+def fts_table(table_name):
+    """
+    Name of the FTS5 table that indexes a table
+    """
+    return '{}_fts'.format(table_name)
+
+
+def trigram_index(table_name, column_name):
+    """
+    Name of the trigram index on a column
+    """
+    return 'ix_{}_{}_trgm'.format(table_name, column_name)
+
+
+def sqlite_statements(table_name, column_name):
+    """
+    Statements creating an external content FTS5 table and its sync triggers
+    """
+    fts = fts_table(table_name)
+    values = {'table': table_name, 'column': column_name, 'fts': fts}
+    return [
+        "CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', "
+        "content_rowid='id', tokenize='trigram')".format(**values),
+        "CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END".format(**values),
+        "CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        "END".format(**values),
+        "CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END".format(**values),
+    ]
+
+
+def postgresql_statements(table_name, column_name):
+    """
+    Statements creating a trigram GIN index
+    """
+    return [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)'.format(
+            trigram_index(table_name, column_name), table_name, column_name),
+    ]
+
+
+def searchable(target, column_name):
+    """
+    Create the search structures for a column whenever its table is created
+    """
+    table_name = target.name
+    for statement in sqlite_statements(table_name, column_name):
+        event.listen(target, 'after_create', DDL(statement).execute_if(callable_=_sqlite_trigram))
+    for statement in postgresql_statements(table_name, column_name):
+        event.listen(target, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+    # Triggers go with their table but the FTS table has to be dropped explicitly
+    event.listen(target, 'before_drop', DDL(
+        'DROP TABLE IF EXISTS {}'.format(fts_table(table_name))).execute_if(
+            callable_=_sqlite_trigram))
+
+
+def include_object(_obj, name, type_, reflected, _compare_to):
+    """
+    Keep autogenerated migrations from dropping the search structures,
+    which are created outside of the models' metadata
+    """
+    if reflected and type_ == 'table' and '_fts' in name:
+        return False
+    if reflected and type_ == 'index' and name.endswith('_trgm'):
+        return False
+    return True
+
+
+def like_pattern(term):
+    """
+    A LIKE pattern matching the term anywhere, with its wildcards escaped
+    """
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def search(query, column, term):
+    """
+    Narrow a query to the rows whose column contains the term.
+    Returns the query and a rank expression (higher is better), or None when
+    the matches are not ranked.
+    """
+    dialect = query.session.get_bind().dialect.name
+
+    if len(term) >= MIN_TRIGRAM_LENGTH:
+        if dialect == 'postgresql':
+            # ILIKE is answered from the trigram index
+            query = query.filter(column.ilike(like_pattern(term), escape='\\'))
+            # similarity() is a real. As a double the value stored in a cursor compares
+            # equal to the rank again, so the rows tied with a page's last row are not skipped.
+            return query, cast(func.similarity(column, term), Float)
+
+        if dialect == 'sqlite' and SQLITE_TRIGRAM:
+            fts = table(fts_table(column.table.name), sql_column(column.key))
+            phrase = '"{}"'.format(term.replace('"', '""'))
+            matches = select([literal_column('rowid').label('id'),
+                              literal_column('rank').label('rank')]). \
+                select_from(fts). \
+                where(literal_column(fts.name).op('MATCH')(phrase)).alias('matches')
+            query = query.join(matches, matches.c.id == column.table.c.id)
+            # bm25 scores are negative, with the best match lowest
+            return query, -matches.c.rank
+
+    return query.filter(column.ilike(like_pattern(term), escape='\\')), None
@@ -2,327 +2,318 @@
 Views for the share blueprint
 """
 from flask.views import MethodView
-from flask import request, jsonify, make_response
+from flask import jsonify, make_response, g
 from sqlalchemy import and_, or_
 from . import share_blueprint
-from ..models import Friend, SharedList, ShoppingList, ShoppingListItem
+from ..models import SharedList, ShoppingList, ShoppingListItem, User
 from ..decorators import MyDecorator
+from ..pagination import paginate
+from ..permissions import can_read, can_read_shared, can_write, forget_lists
+from ..search import search
+from ..validation import validate, ValidationError, Schema, Integer, IntegerList, PAGINATION
 my_dec = MyDecorator()
 
+MAX_SHARE_FRIENDS = 100
+# A list is shared with one friend_id or with several friend_ids at once
+SHARE_BODY = Schema(
+    Integer('list_id', required=True),
+    Integer('friend_id'),
+    IntegerList('friend_ids', max_length=MAX_SHARE_FRIENDS,
+                length_message='A list can be shared with at most {} friends at once'.format(
+                    MAX_SHARE_FRIENDS)),
+    type_message='The parameters provided should be integers',
+    required_message='The parameters provided should be integers',
+    required_status=401)
+UNSHARE_PATH = Schema(
+    Integer('list_id'),
+    type_message='Please ensure the parameter provided is correct')
+UNSHARE_BODY = Schema(
+    Integer('friend_id', required=True),
+    type_message='Please ensure the parameter provided is correct',
+    required_message='Please ensure the parameter provided is correct',
+    required_status=401)
+SHARED_LIST_PATH = Schema(
+    Integer('list_id'),
+    type_message='Please ensure the parameter provided is an integer')
+
 
 class ShareOps(MethodView):
     """
     Handles sharing and retrieving shared lists
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(body=SHARE_BODY)
     def post():
         """
         POST - Shares a list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                list_id = int(request.data.get('list_id', ''))
-                friend_id = int(request.data.get('friend_id', ''))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
+        user_id = g.user_id
+        list_id = g.data['list_id']
+        friend_id = g.data['friend_id']
+        friend_ids = g.data['friend_ids'] or ([friend_id] if friend_id else [])
+
+        if not friend_ids:
+            raise ValidationError(SHARE_BODY.required_message, SHARE_BODY.required_status)
+
+        if not can_write(user_id, list_id):
+            response = {'message': 'That shopping list in not yours or does not exist'}
+            return make_response(jsonify(response)), 404
+
+        # Friendships are checked by the INSERT, which skips the users who are not friends
+        shared, already_shared = SharedList.share_with(list_id, user_id, friend_ids)
+        if shared:
+            # The shares were inserted without the session, which would otherwise forget these
+            forget_lists([list_id])
+
+        results = []
+        for f_id in friend_ids:
+            if f_id in shared:
+                status = 'shared'
+            elif f_id in already_shared:
+                status = 'already_shared'
+            else:
+                status = 'not_friends'
+            results.append({'friend_id': f_id, 'status': status})
+
+        if not g.data['friend_ids']:
+            # A single friend_id keeps its original responses
+            status = results[0]['status']
+            if status == 'not_friends':
+                response = {'message': 'Lists can only be shared to friends'}
+                return make_response(jsonify(response)), 401
+            if status == 'already_shared':
+                response = {'message': 'That list has already been shared'}
                 return make_response(jsonify(response)), 401
 
-            if list_id and friend_id:
-                # Check if the users are already friends
-                friend = Friend.query. \
-                    filter(or_((and_(Friend.user1 == user_id, Friend.user2 == friend_id)),
-                               (and_(Friend.user1 == friend_id, Friend.user2 == user_id))),
-                           Friend.accepted).first()
-
-                if friend:
-                    # The users are friends
-                    check_shared = SharedList.query.\
-                        filter_by(user1=user_id, user2=friend_id, list_id=list_id).first()
-                    if check_shared:
-                        response = {'message': 'That list has already been shared'}
-                        return make_response(jsonify(response)), 401
-
-                    shared_list = SharedList(list_id, user_id, friend_id)
-                    shared_list.save()
-
-                    response = {'message': 'Shopping list shared successfully'}
-                    return make_response(jsonify(response)), 200
+            response = {'message': 'Shopping list shared successfully'}
+            return make_response(jsonify(response)), 200
 
-                response = {'message': 'Lists can only be shared to friends'}
-                return make_response(jsonify(response)), 401
+        # The outcome of each friend is in the results, even when none was shared
+        shared_count = len([result for result in results if result['status'] == 'shared'])
+        response = {
+            'message': 'Shopping list shared with {} of {} users'.format(
+                shared_count, len(friend_ids)),
+            'results': results
+        }
+        return make_response(jsonify(response)), 200
 
     @staticmethod
+    @validate(query=PAGINATION)
     def get():
         """
         GET - Retrieves all shared lists
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
-
+        user_id = g.user_id
+        search_query = g.args['q']
+
+        # Lists shared by or with the user, each once however many times it was shared
+        shared_with_user = SharedList.query. \
+            filter(SharedList.list_id == ShoppingList.id,
+                   or_(SharedList.user1 == user_id, SharedList.user2 == user_id))
+        shared = ShoppingList.query.filter(shared_with_user.exists())
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            shared, rank = search(shared, ShoppingList.name, search_query)
+
+        paginated_lists = paginate(shared, ShoppingList.name, ShoppingList.id, g.args,
+                                   rank=rank)
+        shared_lists = []
+
+        if not paginated_lists.items:
             if search_query:
-                shared_lists = []
-                search_output = []
-                # Get lists that match criteria
-                result = ShoppingList.query. \
-                    filter(ShoppingList.name.ilike('%' + search_query + '%')).all()
-
-                if result:
-                    for res in result:
-                        # Get ids of lists that have been shared
-                        output = SharedList.query. \
-                            filter(or_(SharedList.user1 == user_id, SharedList.user2 == user_id)).\
-                            filter_by(list_id=res.id).first()
-                        if output:
-                            search_output.append(output)
-
-                if not search_output:
-                    response = {'message': 'You have no shopping lists that match that criteria'}
-                    return make_response(jsonify(response)), 404
-
-                for list_out in search_output:
-                    # Get names of lists that have been shared
-                    sha_list = ShoppingList.query.filter_by(id=list_out.list_id).first()
-                    obj = {
-                        'id': sha_list.id,
-                        'name': sha_list.name
-                    }
-                    shared_lists.append(obj)
-
-                response = jsonify(shared_lists)
-                response.status_code = 200
-                return response
-
-            shared_lists = []
-            shared_lists_ids = []
-            shared_list = SharedList.query.\
-                filter(or_(SharedList.user1 == user_id, SharedList.user2 == user_id)).all()
-
-            if not shared_list:
+                response = {'message': 'You have no shopping lists that match that criteria'}
+            else:
                 response = {'message': 'You have no shared lists'}
-                return make_response(jsonify(response)), 404
+            return make_response(jsonify(response)), 404
+
+        for sha_list in paginated_lists.items:
+            obj = {
+                'id': sha_list.id,
+                'name': sha_list.name,
+                'description': sha_list.description,
+                'date_created': sha_list.date_created,
+                'date_modified': sha_list.date_modified
 
-            for s_list in shared_list:
-                shared_lists_ids.append(s_list.list_id)
-
-            total_lists = ShoppingList.query.filter(ShoppingList.id.in_(shared_lists_ids)).count()
-            paginated_lists = ShoppingList.query.filter(ShoppingList.id.in_(shared_lists_ids)).\
-                order_by(ShoppingList.name.asc()).paginate(page, limit)
-
-            for sha_list in paginated_lists.items:
-                obj = {
-                    'id': sha_list.id,
-                    'name': sha_list.name,
-                    'description': sha_list.description,
-                    'date_created': sha_list.date_created,
-                    'date_modified': sha_list.date_modified
-
-                }
-                shared_lists.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_lists.has_next:
-                next_page = '/shopping_lists/share' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_lists.has_prev:
-                previous_page = '/shopping_lists/share' + '?page=' + str(page - 1) + \
-                                '&limit=' + str(limit)
-
-            response = {
-                'total': total_lists,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'shared_lists': shared_lists
             }
+            shared_lists.append(obj)
 
-            return make_response(jsonify(response)), 200
+        response = {
+            'total': paginated_lists.total,
+            'previous_page': paginated_lists.previous_page,
+            'next_page': paginated_lists.next_page,
+            'next_cursor': paginated_lists.next_cursor,
+            'shared_lists': shared_lists
+        }
+
+        return make_response(jsonify(response)), 200
 
 
 class ShareMan(MethodView):
     """
     Handles shared list operations
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=UNSHARE_PATH, body=UNSHARE_BODY)
     def delete(list_id):
         """
         Stops sharing a list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-                friend_id = int(request.data.get('friend_id', ''))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'Please ensure the parameter provided is correct'}
-                return make_response(jsonify(response)), 401
+        user_id = g.user_id
+        friend_id = g.data['friend_id']
 
-            shopping_list = ShoppingList.query.filter_by(id=list_id).first()
+        shopping_list = ShoppingList.query.filter_by(id=list_id).first()
 
-            if not shopping_list:
-                response = {'message': 'That list does not exist'}
-                return make_response(jsonify(response)), 404
+        if not shopping_list:
+            response = {'message': 'That list does not exist'}
+            return make_response(jsonify(response)), 404
+
+        if list_id and shopping_list:
+            shared_list = SharedList.query.\
+                filter(or_(and_(SharedList.user1 == user_id, SharedList.user2 == friend_id),
+                           and_(SharedList.user1 == friend_id, SharedList.user2 == user_id)))\
+                .filter_by(list_id=list_id).first()
+
+            if shared_list:
+                shared_list.delete()
 
-            if list_id and shopping_list:
-                shared_list = SharedList.query.\
-                    filter(or_(and_(SharedList.user1 == user_id, SharedList.user2 == friend_id),
-                               and_(SharedList.user1 == friend_id, SharedList.user2 == user_id)))\
-                    .filter_by(list_id=list_id).first()
+                response = {'message': 'List sharing stopped successfully'}
+                return make_response(jsonify(response)), 200
 
-                if shared_list:
-                    shared_list.delete()
+            # Using their own id stops sharing the list with everyone
+            if friend_id == user_id and SharedList.unshare_all(list_id, user_id):
+                response = {'message': 'List sharing stopped successfully'}
+                return make_response(jsonify(response)), 200
 
-                    response = {'message': 'List sharing stopped successfully'}
-                    return make_response(jsonify(response)), 200
+            response = {'message': 'That list has not been shared'}
+            return make_response(jsonify(response)), 404
 
-                if friend_id == user_id:
-                    shared_list = SharedList.query.filter(SharedList.user1 == user_id).filter_by(list_id=list_id).all()
 
-                    if shared_list:
-                        for s_list in shared_list:
-                            s_list.delete()
+class ShareMembers(MethodView):
+    """
+    Shows who a list is shared with
+    """
+    decorators = [my_dec.token_required]
+
+    @staticmethod
+    @validate(path=SHARED_LIST_PATH, query=PAGINATION)
+    def get(list_id):
+        """
+        Retrieves the users a shopping list is shared with
+        """
+        user_id = g.user_id
+
+        # The owner and the users the list is shared with can see each other
+        if not can_read(user_id, list_id):
+            response = {'message': 'That list does not exist'}
+            return make_response(jsonify(response)), 404
+
+        search_query = g.args['q']
 
-                        response = {'message': 'List sharing stopped successfully'}
-                        return make_response(jsonify(response)), 200
+        members = User.query.join(SharedList, SharedList.user2 == User.id). \
+            filter(SharedList.list_id == list_id)
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            members, rank = search(members, User.username, search_query)
 
+        paginated_users = paginate(members, User.username, User.id, g.args, rank=rank)
+        results = []
+
+        if not paginated_users.items:
+            if search_query:
+                response = {'message': 'The list is not shared with anyone with that username'}
+            else:
                 response = {'message': 'That list has not been shared'}
-                return make_response(jsonify(response)), 404
+            return make_response(jsonify(response)), 404
+
+        for user in paginated_users.items:
+            obj = {
+                'id': user.id,
+                'username': user.username
+            }
+            results.append(obj)
+
+        response = {
+            'total': paginated_users.total,
+            'previous_page': paginated_users.previous_page,
+            'next_page': paginated_users.next_page,
+            'next_cursor': paginated_users.next_cursor,
+            'members': results
+        }
+
+        return make_response(jsonify(response)), 200
 
 
 class ShareItems(MethodView):
     """
     Shows items in a shared list
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=SHARED_LIST_PATH, query=PAGINATION)
     def get(list_id):
         """
         Retrieves all items in shared shopping list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'Please ensure the parameter provided is an integer'}
-                return make_response(jsonify(response)), 401
+        user_id = g.user_id
 
-            # Ensure that the list has been shared to that user
-            check_shared = SharedList.query.\
-                filter(and_(SharedList.list_id == list_id,
-                            or_(SharedList.user1 == user_id, SharedList.user2 == user_id))).first()
-
-            if not check_shared:
-                response = {'message': 'You do not have permission to view items on that list'}
-                return make_response(jsonify(response)), 403
-
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        # Ensure that the list has been shared to that user
+        if not can_read_shared(user_id, list_id):
+            response = {'message': 'You do not have permission to view items on that list'}
+            return make_response(jsonify(response)), 403
+
+        search_query = g.args['q']
+
+        shopping_list_items = ShoppingListItem.query.filter_by(list_id=list_id)
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            shopping_list_items, rank = search(shopping_list_items, ShoppingListItem.name,
+                                               search_query)
 
+        paginated_items = paginate(shopping_list_items, ShoppingListItem.name,
+                                   ShoppingListItem.id, g.args, rank=rank)
+        results = []
+
+        if not paginated_items.items:
             if search_query:
-                # if parameter q is specified
-                shopping_list_items = ShoppingListItem.query. \
-                    filter(ShoppingListItem.name.ilike('%' + search_query + '%')). \
-                    filter_by(list_id=list_id).all()
-                output = []
-
-                if not shopping_list_items:
-                    response = {'message': 'The list has no items matching that criteria'}
-                    return make_response(jsonify(response)), 404
-
-                for list_item in shopping_list_items:
-                    obj = {
-                        'id': list_item.id,
-                        'name': list_item.name,
-                        'quantity': list_item.quantity,
-                        'unit_price': list_item.unit_price,
-                        'date_created': list_item.date_created,
-                        'date_modified': list_item.date_modified
-                    }
-                    output.append(obj)
-                response = jsonify(output)
-                response.status_code = 200
-                return response
-
-            total_items = ShoppingListItem.query.filter_by(list_id=list_id).count()
-            paginated_items = ShoppingListItem.query.filter_by(list_id=list_id). \
-                order_by(ShoppingListItem.name.asc()).paginate(page, limit)
-            results = []
-
-            if not paginated_items.items:
-                response = {'message': 'That list has no items'}
+                response = {'message': 'The list has no items matching that criteria'}
                 return make_response(jsonify(response)), 404
 
-            for shopping_list_item in paginated_items.items:
-                obj = {
-                    'id': shopping_list_item.id,
-                    'name': shopping_list_item.name,
-                    'quantity': shopping_list_item.quantity,
-                    'unit_price': shopping_list_item.unit_price,
-                    'date_created': shopping_list_item.date_created,
-                    'date_modified': shopping_list_item.date_modified
-                }
-                results.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_items.has_next:
-                next_page = '/shopping_lists/share/<list_id>/items' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_items.has_prev:
-                previous_page = '/shopping_lists/share/<list_id>/items' + '?page=' + str(page - 1) + \
-                                '&limit=' + str(limit)
-
-            response = {
-                'total': total_items,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'shared_list_items': results
+            response = {'message': 'That list has no items'}
+            return make_response(jsonify(response)), 404
+
+        for shopping_list_item in paginated_items.items:
+            obj = {
+                'id': shopping_list_item.id,
+                'name': shopping_list_item.name,
+                'quantity': shopping_list_item.quantity,
+                'unit_price': shopping_list_item.unit_price,
+                'date_created': shopping_list_item.date_created,
+                'date_modified': shopping_list_item.date_modified
             }
+            results.append(obj)
 
-            return make_response(jsonify(response)), 200
+        response = {
+            'total': paginated_items.total,
+            'previous_page': paginated_items.previous_page,
+            'next_page': paginated_items.next_page,
+            'next_cursor': paginated_items.next_cursor,
+            'shared_list_items': results
+        }
+
+        return make_response(jsonify(response)), 200
 
 
 share_ops = ShareOps.as_view('share_ops')  # pylint: disable=invalid-name
 share_man = ShareMan.as_view('share_man')  # pylint: disable=invalid-name
+share_members = ShareMembers.as_view('share_members')  # pylint: disable=invalid-name
 share_items_ops = ShareItems.as_view('share_items_ops')  # pylint: disable=invalid-name
 
 # Define rules
@@ -330,5 +321,7 @@ share_blueprint.add_url_rule('/shopping_lists/share',
                              view_func=share_ops, methods=['POST', 'GET'])
 share_blueprint.add_url_rule('/shopping_lists/share/<list_id>',
                              view_func=share_man, methods=['DELETE'])
+share_blueprint.add_url_rule('/shopping_lists/share/<list_id>/members',
+                             view_func=share_members, methods=['GET'])
 share_blueprint.add_url_rule('/shopping_lists/share/<list_id>/items',
                              view_func=share_items_ops, methods=['GET'])
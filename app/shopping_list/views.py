@@ -1,184 +1,183 @@
 """
 Views for the shopping list blueprint
 """
-import re
+import time
 from flask.views import MethodView
-from flask import request, jsonify, make_response
-from sqlalchemy import func
+from flask import jsonify, make_response, g, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from app import db, list_events
 from . import shopping_list_blueprint
-from ..models import ShoppingList
+from ..models import ShoppingList, SharedList
 from ..decorators import MyDecorator
+from ..events import format_event
+from ..pagination import paginate
+from ..permissions import can_read, forget_lists
+from ..search import search
+from ..validation import validate, load_body, ValidationError, Schema, Integer, String, \
+    Name, PAGINATION
 my_dec = MyDecorator()
 
+LIST_PATH = Schema(
+    Integer('list_id'),
+    type_message='The parameter provided should be an integer')
+LIST_BODY = Schema(
+    Name('name', 'list name', required=True),
+    String('description', default=''),
+    required_message='Shopping list name not provided.')
+LIST_UPDATE_BODY = Schema(
+    Name('name', 'list name'),
+    String('description'))
+
 
 class SListOps(MethodView):
     """
     Handles shopping list creation and retrieval
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(body=LIST_BODY)
     def post():
         """
         Creates shopping lists
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            name = str(request.data.get('name', ''))
-            description = str(request.data.get('description', ''))
-
-            if name:
-                if not re.match("^[a-zA-Z0-9 _]*$", name):
-                    response = {
-                        'message': 'The list name cannot contain special characters. '
-                                   'Only underscores'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                s_list = ShoppingList.query. \
-                    filter(func.lower(ShoppingList.name) == name.lower(),
-                           ShoppingList.user_id == user_id).first()
-
-                if not s_list:
-                    # There is no list so we'll try to create it
-                    shopping_list = ShoppingList(user_id=user_id,
-                                                 name=name, description=description)
-                    shopping_list.save()
-
-                    response = jsonify({
-                        'id': shopping_list.id,
-                        'name': shopping_list.name,
-                        'description': shopping_list.description,
-                        'date_created': shopping_list.date_created,
-                        'date_modified': shopping_list.date_modified
-                    })
-                    response.status_code = 201
-                    return response
-
-                response = {'message': 'That shopping list already exists.'}
-                return make_response(jsonify(response)), 401
-
-            response = {'message': 'Shopping list name not provided.'}
-            return make_response(jsonify(response)), 400
+        user_id = g.user_id
+        name = g.data['name']
+        description = g.data['description']
+
+        shopping_list = ShoppingList(user_id=user_id, name=name, description=description)
+        try:
+            shopping_list.save()
+        except IntegrityError:
+            # The unique index on (user_id, lower(name)) rejected the list
+            db.session.rollback()
+            response = {'message': 'That shopping list already exists.'}
+            return make_response(jsonify(response)), 401
+
+        response = jsonify({
+            'id': shopping_list.id,
+            'name': shopping_list.name,
+            'description': shopping_list.description,
+            'date_created': shopping_list.date_created,
+            'date_modified': shopping_list.date_modified
+        })
+        response.status_code = 201
+        return response
 
     @staticmethod
+    @validate(query=PAGINATION)
     def get():
         """
         Retrieves shopping lists
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            search_query = request.args.get("q")
-            try:
-                limit = int(request.args.get('limit', 10))
-                page = int(request.args.get('page', 1))
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameters provided should be integers'}
-                return make_response(jsonify(response)), 401
+        user_id = g.user_id
+        search_query = g.args['q']
 
-            if search_query:
-                # if parameter q is specified
-                shopping_lists = ShoppingList.query. \
-                    filter(ShoppingList.name.ilike('%' + search_query + '%')). \
-                    filter_by(user_id=user_id).all()
-                output = []
-
-                if not shopping_lists:
-                    response = {'message': 'You do not have shopping lists matching that criteria'}
-                    return make_response(jsonify(response)), 404
-
-                for s_list in shopping_lists:
-                    obj = {
-                        'id': s_list.id,
-                        'name': s_list.name,
-                        'description': s_list.description,
-                        'date_created': s_list.date_created,
-                        'date_modified': s_list.date_modified
-                    }
-                    output.append(obj)
-                response = jsonify(output)
-                response.status_code = 200
-                return response
+        shopping_lists = ShoppingList.query.filter_by(user_id=user_id)
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            shopping_lists, rank = search(shopping_lists, ShoppingList.name, search_query)
 
-            total_lists = ShoppingList.query.filter_by(user_id=user_id).count()
-            paginated_lists = ShoppingList.query.filter_by(user_id=user_id). \
-                order_by(ShoppingList.name.asc()).paginate(page, limit)
-            results = []
+        paginated_lists = paginate(shopping_lists, ShoppingList.name, ShoppingList.id, g.args,
+                                   rank=rank)
+        results = []
 
-            if not paginated_lists.items:
+        if not paginated_lists.items:
+            if search_query:
+                response = {'message': 'You do not have shopping lists matching that criteria'}
+            else:
                 response = {'message': 'You have no shopping lists'}
-                return make_response(jsonify(response)), 404
-
-            for shopping_list in paginated_lists.items:
-                obj = {
-                    'id': shopping_list.id,
-                    'name': shopping_list.name,
-                    'description': shopping_list.description,
-                    'date_created': shopping_list.date_created,
-                    'date_modified': shopping_list.date_modified
-                }
-                results.append(obj)
-
-            next_page = 'None'
-            previous_page = 'None'
-
-            if paginated_lists.has_next:
-                next_page = '/shopping_lists' + '?page=' + str(page + 1) + \
-                            '&limit=' + str(limit)
-            if paginated_lists.has_prev:
-                previous_page = '/shopping_lists' + '?page=' + str(page - 1) + \
-                            '&limit=' + str(limit)
-
-            response = {
-                'total': total_lists,
-                'previous_page': previous_page,
-                'next_page': next_page,
-                'shopping_lists': results
+            return make_response(jsonify(response)), 404
+
+        for shopping_list in paginated_lists.items:
+            obj = {
+                'id': shopping_list.id,
+                'name': shopping_list.name,
+                'description': shopping_list.description,
+                'date_created': shopping_list.date_created,
+                'date_modified': shopping_list.date_modified
             }
+            results.append(obj)
 
-            return make_response(jsonify(response)), 200
+        response = {
+            'total': paginated_lists.total,
+            'previous_page': paginated_lists.previous_page,
+            'next_page': paginated_lists.next_page,
+            'next_cursor': paginated_lists.next_cursor,
+            'shopping_lists': results
+        }
+
+        return make_response(jsonify(response)), 200
 
 
 class SListMan(MethodView):
     """
     Handles shopping list manipulation operations
     """
+    decorators = [my_dec.token_required]
+
     @staticmethod
+    @validate(path=LIST_PATH)
     def get(list_id):
         """
         Retrieves a specific shopping list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameter provided should be an integer'}
-                return make_response(jsonify(response)), 401
-
-            # retrieve a shopping list using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-
-            if not shopping_list:
-                response = {"message": "That shopping list is not yours or does not exist"}
-                return make_response(jsonify(response)), 404
+        user_id = g.user_id
+
+        # retrieve a shopping list using it's id
+        shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
+
+        if not shopping_list:
+            response = {"message": "That shopping list is not yours or does not exist"}
+            return make_response(jsonify(response)), 404
+
+        if shopping_list.user_id == user_id:
+            response = jsonify({
+                'id': shopping_list.id,
+                'name': shopping_list.name,
+                'description': shopping_list.description,
+                'date_created': shopping_list.date_created,
+                'date_modified': shopping_list.date_modified
+            })
+            response.status_code = 200
+            return response
+
+    @staticmethod
+    @validate(path=LIST_PATH)
+    def put(list_id):
+        """
+        Updates a specific shopping list
+        """
+        user_id = g.user_id
+
+        # retrieve a shopping list using it's id
+        shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
+
+        if not shopping_list:
+            response = {"message": "That shopping list is not yours or does not exist"}
+            return make_response(jsonify(response)), 404
+
+        try:
+            data = load_body(LIST_UPDATE_BODY)
+        except ValidationError as error:
+            return error.response()
+
+        name = data['name'] or shopping_list.name
+        description = data['description'] or shopping_list.description
 
+        if name:
+            # Check if user is owner
             if shopping_list.user_id == user_id:
+                shopping_list.name = name
+                shopping_list.description = description
+                try:
+                    shopping_list.save()
+                except IntegrityError:
+                    db.session.rollback()
+                    response = {"message": "Shopping list already exists"}
+                    return make_response(jsonify(response)), 401
+
                 response = jsonify({
                     'id': shopping_list.id,
                     'name': shopping_list.name,
@@ -190,110 +189,167 @@ class SListMan(MethodView):
                 return response
 
     @staticmethod
-    def put(list_id):
+    @validate(path=LIST_PATH)
+    def delete(list_id):
         """
-        Updates a specific shopping list
+        Deletes a specific shopping list
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameter provided should be an integer'}
-                return make_response(jsonify(response)), 401
-
-            # retrieve a shopping list using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-
-            if not shopping_list:
-                response = {"message": "That shopping list is not yours or does not exist"}
-                return make_response(jsonify(response)), 404
-
-            name = str(request.data.get('name', '')) if str(request.data.get('name', '')) \
-                else shopping_list.name
-            description = str(request.data.get('description', '')) if \
-                str(request.data.get('description', '')) else shopping_list.description
-
-            if name:
-                if not re.match("^[a-zA-Z0-9 _]*$", name):
-                    response = {
-                        'message': 'The list name cannot contain special characters. '
-                                   'Only underscores'
-                    }
-                    return make_response(jsonify(response)), 400
-
-                s_lists = ShoppingList.query.filter_by(user_id=user_id).all()
-
-                for s_list in s_lists:
-                    # Check if name exists
-                    if str(list_id) != str(s_list.id) and name.lower() == s_list.name.lower():
-                        response = {"message": "Shopping list already exists"}
-                        return make_response(jsonify(response)), 401
-
-                # Check if user is owner
-                if shopping_list.user_id == user_id:
-                    shopping_list.name = name
-                    shopping_list.description = description
-                    shopping_list.save()
+        user_id = g.user_id
+
+        # retrieve a shopping list using it's id
+        shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
+
+        if not shopping_list:
+            response = {
+                "message": "That shopping list is not yours or does not exist"
+            }
+            return make_response(jsonify(response)), 404
+
+        if shopping_list.user_id == user_id:
+            shopping_list.delete()
+            response = {
+                "message": "Shopping list {} deleted successfully".format(shopping_list.id)
+            }
+            return make_response(jsonify(response)), 200
+
 
-                    response = jsonify({
-                        'id': shopping_list.id,
-                        'name': shopping_list.name,
-                        'description': shopping_list.description,
-                        'date_created': shopping_list.date_created,
-                        'date_modified': shopping_list.date_modified
-                    })
-                    response.status_code = 200
-                    return response
+class AllLists(MethodView):
+    """
+    Handles retrieval of the lists a user owns together with those shared with them
+    """
+    decorators = [my_dec.token_required]
 
     @staticmethod
-    def delete(list_id):
+    @validate(query=PAGINATION)
+    def get():
         """
-        Deletes a specific shopping list
+        Retrieves owned and shared shopping lists in one listing
+        """
+        user_id = g.user_id
+        search_query = g.args['q']
+
+        # The ids of both kinds of lists are combined in the database, each side using its index
+        accessible = db.union_all(
+            db.select([ShoppingList.id]).where(ShoppingList.user_id == user_id),
+            db.select([SharedList.list_id]).where(SharedList.user2 == user_id))
+        shopping_lists = ShoppingList.query.filter(ShoppingList.id.in_(accessible))
+        rank = None
+        if search_query:
+            # if parameter q is specified
+            shopping_lists, rank = search(shopping_lists, ShoppingList.name, search_query)
+
+        paginated_lists = paginate(shopping_lists, ShoppingList.name, ShoppingList.id, g.args,
+                                   rank=rank)
+        results = []
+
+        if not paginated_lists.items:
+            if search_query:
+                response = {'message': 'You do not have shopping lists matching that criteria'}
+            else:
+                response = {'message': 'You have no shopping lists'}
+            return make_response(jsonify(response)), 404
+
+        for shopping_list in paginated_lists.items:
+            obj = {
+                'id': shopping_list.id,
+                'name': shopping_list.name,
+                'description': shopping_list.description,
+                'role': 'owner' if shopping_list.user_id == user_id else 'shared',
+                'date_created': shopping_list.date_created,
+                'date_modified': shopping_list.date_modified
+            }
+            results.append(obj)
+
+        response = {
+            'total': paginated_lists.total,
+            'previous_page': paginated_lists.previous_page,
+            'next_page': paginated_lists.next_page,
+            'next_cursor': paginated_lists.next_cursor,
+            'shopping_lists': results
+        }
+
+        return make_response(jsonify(response)), 200
+
+
+def stream_changes(subscription):
+    """
+    Stream the changes to a list until the client leaves, loses access, falls
+    behind or the stream reaches its maximum age
+    """
+    # No connection is held while waiting for changes
+    db.session.close()
+    yield 'retry: 3000\n\n'
+
+    deadline = time.time() + list_events.max_seconds
+    while time.time() < deadline:
+        message = subscription.get(list_events.keepalive)
+        if subscription.overflowed:
+            yield format_event('reload', {'list_id': subscription.list_id})
+            return
+        if message is None:
+            yield ': keepalive\n\n'
+            continue
+
+        if message['event'] == 'access':
+            # The list was unshared or deleted, so check the access again
+            forget_lists([subscription.list_id])
+            readable = can_read(subscription.user_id, subscription.list_id)
+            db.session.close()
+            if not readable:
+                yield format_event('revoked', {'list_id': subscription.list_id})
+                return
+            continue
+
+        yield format_event(message['event'], message['data'])
+
+
+class SListEvents(MethodView):
+    """
+    Streams the changes to a shopping list as Server-Sent Events
+    """
+    decorators = [my_dec.token_required]
+
+    @staticmethod
+    @validate(path=LIST_PATH)
+    def get(list_id):
         """
-        user_id = my_dec.check_token()
-
-        if user_id == 'Missing':
-            return jsonify({'message': 'You cannot access that page without a token.'}), 401
-        elif user_id == 'Invalid':
-            return jsonify({'message': 'Your token is either expired or invalid.'}), 401
-        else:
-            try:
-                int(list_id)
-            except (ValueError, TypeError):
-                # An error occurred, therefore return a string message containing the error
-                response = {'message': 'The parameter provided should be an integer'}
-                return make_response(jsonify(response)), 401
-
-            # retrieve a shopping list using it's id
-            shopping_list = ShoppingList.query.filter_by(id=list_id, user_id=user_id).first()
-
-            if not shopping_list:
-                response = {
-                    "message": "That shopping list is not yours or does not exist"
-                }
-                return make_response(jsonify(response)), 404
+        Streams item changes to a list the user owns or that is shared with them
+        """
+        user_id = g.user_id
 
-            if shopping_list.user_id == user_id:
-                shopping_list.delete()
-                response = {
-                    "message": "Shopping list {} deleted successfully".format(shopping_list.id)
-                }
-                return make_response(jsonify(response)), 200
+        if not can_read(user_id, list_id):
+            response = {'message': 'That shopping list is not yours or does not exist'}
+            return make_response(jsonify(response)), 404
+
+        subscription = list_events.subscribe(user_id, list_id)
+        if subscription is None:
+            response = make_response(jsonify({'message': 'Too many live streams. '
+                                                         'Please try again shortly.'}))
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            return response
+
+        response = Response(stream_with_context(stream_changes(subscription)),
+                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Proxies must pass the events on as they come
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.call_on_close(lambda: list_events.unsubscribe(subscription))
+        return response
 
 
 s_list_ops = SListOps.as_view('s_list_ops')  # pylint: disable=invalid-name
 s_list_man = SListMan.as_view('s_list_man')  # pylint: disable=invalid-name
+all_lists = AllLists.as_view('all_lists')  # pylint: disable=invalid-name
+s_list_events = SListEvents.as_view('s_list_events')  # pylint: disable=invalid-name
 
 
 # Define rules
 shopping_list_blueprint.add_url_rule('/shopping_lists',
                                      view_func=s_list_ops, methods=['POST', 'GET'])
+shopping_list_blueprint.add_url_rule('/shopping_lists/all',
+                                     view_func=all_lists, methods=['GET'])
 shopping_list_blueprint.add_url_rule('/shopping_lists/<list_id>',
                                      view_func=s_list_man, methods=['GET', 'PUT', 'DELETE'])
+shopping_list_blueprint.add_url_rule('/shopping_lists/<list_id>/events',
+                                     view_func=s_list_events, methods=['GET'])
@@ -0,0 +1,9 @@
+"""
+Initialize blueprint
+"""
+from flask import Blueprint
+
+# This instance of a Blueprint that represents the sync blueprint
+sync_blueprint = Blueprint('sync_bp', __name__)  # pylint: disable=invalid-name
+
+from . import views  # noqa
@@ -0,0 +1,189 @@
+"""
+Views for the sync blueprint.
+Clients keep a copy of their lists and ask for what changed since their last
+sync with the token it returned. Changes are found with the date_modified
+indexes and deletions with the tombstones left for each user.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+from flask.views import MethodView
+from flask import current_app, jsonify, make_response, g
+from app import db
+from . import sync_blueprint
+from ..models import ShoppingList, ShoppingListItem, SharedList, Tombstone
+from ..decorators import MyDecorator
+from ..validation import validate, ValidationError, Field, Schema
+my_dec = MyDecorator()
+
+TOKEN_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def encode_token(moment):
+    """
+    Encode the database time a sync was taken at
+    """
+    raw = json.dumps([1, moment.strftime(TOKEN_FORMAT)]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_token(token):
+    """
+    Decode a token created by encode_token into its time.
+    Raises ValueError if it is malformed.
+    """
+    try:
+        version, moment = json.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        if version != 1:
+            raise ValueError('Unknown sync token version')
+        return datetime.strptime(moment, TOKEN_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError('Malformed sync token')
+
+
+def database_now():
+    """
+    The database's current time as a naive timestamp, like the date columns.
+    PostgreSQL returns it with a time zone, SQLite without one.
+    """
+    now = db.session.query(db.func.current_timestamp()).scalar()
+    return now.replace(tzinfo=None)
+
+
+class SyncToken(Field):
+    """
+    An opaque sync token
+    """
+
+    def convert(self, value):
+        try:
+            return decode_token(value)
+        except ValueError:
+            raise ValidationError('The sync token provided is not valid')
+
+
+SYNC_QUERY = Schema(SyncToken('since'))
+
+
+def list_json(shopping_list, user_id):
+    """
+    The fields of a list sent to a user
+    """
+    return {
+        'id': shopping_list.id,
+        'name': shopping_list.name,
+        'description': shopping_list.description,
+        'role': 'owner' if shopping_list.user_id == user_id else 'shared',
+        'date_created': shopping_list.date_created,
+        'date_modified': shopping_list.date_modified
+    }
+
+
+def item_json(item):
+    """
+    The fields of an item sent to a user
+    """
+    return {
+        'id': item.id,
+        'list_id': item.list_id,
+        'name': item.name,
+        'quantity': item.quantity,
+        'unit_price': item.unit_price,
+        'date_created': item.date_created,
+        'date_modified': item.date_modified
+    }
+
+
+def share_json(share):
+    """
+    The fields of a share sent to a user
+    """
+    return {
+        'id': share.id,
+        'list_id': share.list_id,
+        'shared_by': share.user1,
+        'shared_with': share.user2,
+        'date_created': share.date_created
+    }
+
+
+class Sync(MethodView):
+    """
+    Handles delta sync of the lists, items and shares a user can see
+    """
+    decorators = [my_dec.token_required]
+
+    @staticmethod
+    @validate(query=SYNC_QUERY)
+    def get():
+        """
+        Retrieves everything a user can see, or only what changed since a token
+        """
+        user_id = g.user_id
+        since = g.args['since']
+
+        # The new token is taken before reading so changes made meanwhile come next time
+        now = database_now()
+
+        if since is not None:
+            retention = timedelta(days=current_app.config.get('SYNC_TOMBSTONE_DAYS', 30))
+            if since < now - retention:
+                response = {'message': 'That sync token has expired. Sync again without it.'}
+                return make_response(jsonify(response)), 410
+            # Transactions still open when the last token was taken commit with older times
+            since -= timedelta(seconds=current_app.config.get('SYNC_OVERLAP_SECONDS', 5))
+
+        owned = db.select([ShoppingList.id]).where(ShoppingList.user_id == user_id)
+        shared = db.select([SharedList.list_id]).where(SharedList.user2 == user_id)
+        accessible = db.union_all(owned, shared)
+
+        shopping_lists = ShoppingList.query
+        items = ShoppingListItem.query
+        shares = SharedList.query. \
+            filter(db.or_(SharedList.user1 == user_id, SharedList.user2 == user_id))
+        deleted = []
+
+        if since is None:
+            shopping_lists = shopping_lists.filter(ShoppingList.id.in_(accessible))
+            items = items.filter(ShoppingListItem.list_id.in_(accessible))
+        else:
+            # Lists shared since the token are sent whole, however old their items are
+            newly_shared = shared.where(SharedList.date_modified >= since)
+            shopping_lists = shopping_lists.filter(db.or_(
+                db.and_(ShoppingList.user_id == user_id, ShoppingList.date_modified >= since),
+                db.and_(ShoppingList.id.in_(shared), ShoppingList.date_modified >= since),
+                ShoppingList.id.in_(newly_shared)))
+            items = items.filter(db.or_(
+                db.and_(ShoppingListItem.list_id.in_(accessible),
+                        ShoppingListItem.date_modified >= since),
+                ShoppingListItem.list_id.in_(newly_shared)))
+            shares = shares.filter(SharedList.date_modified >= since)
+
+            tombstones = Tombstone.query. \
+                filter(Tombstone.user_id == user_id, Tombstone.date_deleted >= since). \
+                order_by(Tombstone.date_deleted.asc(), Tombstone.id.asc())
+            for tombstone in tombstones:
+                deleted.append({
+                    'type': tombstone.kind,
+                    'id': tombstone.object_id,
+                    'list_id': tombstone.list_id
+                })
+
+        response = {
+            'token': encode_token(now),
+            'full': since is None,
+            'shopping_lists': [list_json(shopping_list, user_id)
+                               for shopping_list in shopping_lists.order_by(ShoppingList.id)],
+            'items': [item_json(item) for item in items.order_by(ShoppingListItem.id)],
+            'shares': [share_json(share) for share in shares.order_by(SharedList.id)],
+            'deleted': deleted
+        }
+
+        return make_response(jsonify(response)), 200
+
+
+sync_view = Sync.as_view('sync_view')  # pylint: disable=invalid-name
+
+# Define rules
+sync_blueprint.add_url_rule('/sync', view_func=sync_view, methods=['GET'])
@@ -0,0 +1,266 @@
+"""
+Declarative request validation.
+Each endpoint declares its path, query and body fields once. Patterns are
+compiled at import time and the view receives already converted values.
+"""
+import re
+from functools import wraps
+from flask import request, g
+from .errors import ValidationError
+from .pagination import decode_cursor
+
+NAME_PATTERN = re.compile(r'^[a-zA-Z0-9 _]*$')
+EMAIL_PATTERN = re.compile(
+    r"(^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$)")
+
+
+class Field(object):
+    """
+    A named request field.
+    Missing and empty values are replaced by the default.
+    """
+
+    def __init__(self, name, required=False, default=None):
+        self.name = name
+        self.required = required
+        self.default = default
+
+    def convert(self, value):
+        """
+        Convert a raw value. Raises ValueError or TypeError on bad input.
+        """
+        return value
+
+    def check(self, value):  # pylint: disable=unused-argument
+        """
+        Check a converted value. Returns an error message or None.
+        Fields without constraints accept every value.
+        """
+        return None
+
+
+class String(Field):
+    """
+    A string field with an optional pattern and minimum length
+    """
+
+    def __init__(self, name, pattern=None, pattern_message=None,
+                 min_length=None, length_message=None, **kwargs):
+        Field.__init__(self, name, **kwargs)
+        self.pattern = pattern
+        self.pattern_message = pattern_message
+        self.min_length = min_length
+        self.length_message = length_message
+
+    def convert(self, value):
+        return str(value)
+
+    def check(self, value):
+        if self.pattern is not None and not self.pattern.match(value):
+            return self.pattern_message
+        if self.min_length is not None and len(value) < self.min_length:
+            return self.length_message
+        return None
+
+
+class Name(String):
+    """
+    A name made of letters, numbers, spaces and underscores
+    """
+
+    def __init__(self, name, label, **kwargs):
+        String.__init__(self, name, pattern=NAME_PATTERN,
+                        pattern_message='The {} cannot contain special characters. '
+                                        'Only underscores'.format(label), **kwargs)
+
+
+class Email(String):
+    """
+    An email address
+    """
+
+    def __init__(self, name, **kwargs):
+        String.__init__(self, name, pattern=EMAIL_PATTERN,
+                        pattern_message='The email is not valid', **kwargs)
+
+
+class Choice(String):
+    """
+    A string field that must be one of a fixed set of values
+    """
+
+    def __init__(self, name, choices, **kwargs):
+        String.__init__(self, name, **kwargs)
+        self.choices = choices
+
+    def check(self, value):
+        if value not in self.choices:
+            return 'The {} should be one of: {}'.format(self.name, ', '.join(self.choices))
+        return None
+
+
+class Integer(Field):
+    """
+    An integer field
+    """
+
+    def convert(self, value):
+        return int(value)
+
+
+class IntegerList(Field):
+    """
+    A list of distinct integers, sent as a JSON array or a comma separated string
+    """
+
+    def __init__(self, name, max_length=None, length_message=None, **kwargs):
+        Field.__init__(self, name, **kwargs)
+        self.max_length = max_length
+        self.length_message = length_message
+
+    def convert(self, value):
+        if isinstance(value, str):
+            value = value.split(',')
+        if not isinstance(value, list):
+            raise TypeError('Expected a list')
+
+        values = []
+        for item in value:
+            if isinstance(item, bool):
+                raise TypeError('Expected an integer')
+            item = int(item)
+            if item not in values:
+                values.append(item)
+        return values
+
+    def check(self, value):
+        if self.max_length is not None and len(value) > self.max_length:
+            return self.length_message
+        return None
+
+
+class Cursor(Field):
+    """
+    An opaque pagination cursor
+    """
+
+    def convert(self, value):
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise ValidationError('The cursor provided is not valid')
+
+
+class Float(Field):
+    """
+    A floating point field with an optional lower bound
+    """
+
+    def __init__(self, name, min_value=None, range_message=None, **kwargs):
+        Field.__init__(self, name, **kwargs)
+        self.min_value = min_value
+        self.range_message = range_message
+
+    def convert(self, value):
+        return float(value)
+
+    def check(self, value):
+        if self.min_value is not None and value < self.min_value:
+            return self.range_message
+        return None
+
+
+class Schema(object):
+    """
+    An ordered set of fields.
+    Values are converted first, then required fields are checked and
+    finally each field runs its own checks in declaration order.
+    """
+
+    def __init__(self, *fields, **options):
+        self.fields = fields
+        self.type_message = options.get('type_message')
+        self.type_status = options.get('type_status', 401)
+        self.required_message = options.get('required_message')
+        self.required_status = options.get('required_status', 400)
+
+    def load(self, source):
+        """
+        Return the converted values of a mapping or raise ValidationError
+        """
+        values = {}
+
+        for field in self.fields:
+            raw = source.get(field.name)
+            if raw is None or raw == '':
+                values[field.name] = field.default
+                continue
+
+            try:
+                values[field.name] = field.convert(raw)
+            except (ValueError, TypeError):
+                raise ValidationError(self.type_message, self.type_status)
+
+        for field in self.fields:
+            if field.required and not values[field.name]:
+                raise ValidationError(self.required_message, self.required_status)
+
+        for field in self.fields:
+            if values[field.name] is not None:
+                message = field.check(values[field.name])
+                if message:
+                    raise ValidationError(message)
+
+        return values
+
+
+# Shared query string schema of the listing endpoints
+PAGINATION = Schema(
+    Integer('limit', default=10),
+    Integer('page', default=1),
+    Cursor('cursor'),
+    Choice('total', ('true', 'false', 'estimate'), default='true'),
+    String('q'),
+    type_message='The parameters provided should be integers')
+
+
+def load_body(schema):
+    """
+    Load the request body with a schema and store the values on g.data.
+    Used by views that must look up a resource before checking the body.
+    """
+    data = request.data if hasattr(request.data, 'get') else {}
+    g.data = schema.load(data)
+    return g.data
+
+
+def validate(path=None, query=None, body=None):
+    """
+    Decorator that validates a view's input before it runs.
+    Path values are passed to the view converted, the query string is
+    stored on g.args and the body on g.data. Validation errors raised by the
+    view itself are turned into responses too.
+    """
+    def decorator(func):
+        """
+        Wrap the view
+        """
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            """
+            Load every declared part of the request
+            """
+            try:
+                if path is not None:
+                    kwargs.update(path.load(kwargs))
+                if query is not None:
+                    g.args = query.load(request.args)
+                if body is not None:
+                    load_body(body)
+                return func(*args, **kwargs)
+            except ValidationError as error:
+                return error.response()
+
+        return decorated
+
+    return decorator
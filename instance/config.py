@@ -19,7 +19,67 @@ class Config(object):
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.getenv('DEFAULT_SENDER')
+    # Queued emails are delivered by a background thread in each process
+    MAIL_WORKER_ENABLED = os.getenv('MAIL_WORKER_ENABLED', 'true').lower() == 'true'
+    MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 50))
+    MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+    MAIL_RETRY_BACKOFF = int(os.getenv('MAIL_RETRY_BACKOFF', 30))
+    MAIL_POLL_INTERVAL = int(os.getenv('MAIL_POLL_INTERVAL', 30))
     APP_URL = os.getenv('APP_URL')
+    # bcrypt work factor. Use `python manage.py calibrate_bcrypt` to pick one for a host
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    # Verified access tokens are cached to skip the users table lookup
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+    TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+    # Number of users whose friend and request ids are cached by each process
+    FRIEND_CACHE_SIZE = int(os.getenv('FRIEND_CACHE_SIZE', 10000))
+    # Seconds a user's friends are reused. Changes made in other worker processes
+    # can take that long to show up
+    FRIEND_CACHE_TTL = int(os.getenv('FRIEND_CACHE_TTL', 60))
+    # Seconds between rebuilds of the in-memory graph behind friend suggestions
+    FRIEND_GRAPH_TTL = int(os.getenv('FRIEND_GRAPH_TTL', 300))
+    # The graph is rebuilt by a background thread so requests never wait for it
+    FRIEND_GRAPH_BACKGROUND = True
+    # Seconds list access decisions are reused across requests, 0 to check every request.
+    # Revoked shares can stay readable that long in the other worker processes.
+    ACCESS_CACHE_TTL = int(os.getenv('ACCESS_CACHE_TTL', 0))
+    ACCESS_CACHE_SIZE = int(os.getenv('ACCESS_CACHE_SIZE', 10000))
+    # Live list changes. Use a redis:// broker url to stream the changes of every worker
+    LIST_EVENTS_BROKER_URL = os.getenv('LIST_EVENTS_BROKER_URL', 'memory://')
+    # Threads of each gunicorn worker, also read by the Procfile
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 32))
+    # Each stream holds one of those threads for up to LIST_EVENTS_MAX_SECONDS. A quarter of
+    # them at most stream, which leaves three quarters for the rest of the API
+    LIST_EVENTS_MAX_SUBSCRIBERS = int(os.getenv('LIST_EVENTS_MAX_SUBSCRIBERS', WEB_THREADS // 4))
+    LIST_EVENTS_QUEUE_SIZE = int(os.getenv('LIST_EVENTS_QUEUE_SIZE', 100))
+    LIST_EVENTS_KEEPALIVE = int(os.getenv('LIST_EVENTS_KEEPALIVE', 15))
+    # Streams end after this many seconds and browsers reconnect on their own
+    LIST_EVENTS_MAX_SECONDS = int(os.getenv('LIST_EVENTS_MAX_SECONDS', 300))
+    # /sync re-sends the changes made this many seconds before a token, which covers
+    # transactions that were still open when it was taken and second resolution timestamps
+    SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', 5))
+    # Tombstones are kept this long, older sync tokens must sync again from scratch
+    SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', 30))
+    # Password hashing runs in a 'thread' or 'process' pool with a bounded queue
+    PASSWORD_POOL = os.getenv('PASSWORD_POOL', 'thread')
+    PASSWORD_POOL_SIZE = int(os.getenv('PASSWORD_POOL_SIZE', 2))
+    PASSWORD_QUEUE_SIZE = int(os.getenv('PASSWORD_QUEUE_SIZE', 16))
+    PASSWORD_TIMEOUT = float(os.getenv('PASSWORD_TIMEOUT', 5))
+    # Largest page the list endpoints return, whatever limit is requested
+    MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', 100))
+    # Token bucket rate limits. Use a redis:// storage url to share them between workers
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_PROXY_COUNT = int(os.getenv('RATELIMIT_PROXY_COUNT', 0))
+    RATELIMIT_POLICIES = [
+        {'name': 'login', 'methods': ['POST'], 'path': r'^/v1/auth/login$',
+         'rate': 10, 'per': 60, 'burst': 5, 'key': 'ip'},
+        {'name': 'account', 'methods': ['POST'], 'path': r'^/v1/auth/(register|reset)$',
+         'rate': 5, 'per': 300, 'burst': 5, 'key': 'ip'},
+        {'name': 'search', 'methods': ['GET'], 'query': 'q',
+         'path': r'^/v1/(shopping_lists|users|friends|admin/users)(/|$)',
+         'rate': 60, 'per': 60, 'burst': 20, 'key': 'user'},
+    ]
 
 
 class DevelopmentConfig(Config):
@@ -27,6 +87,7 @@ class DevelopmentConfig(Config):
     Development configurations
     """
     DEBUG = True
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 10))
 
 
 class TestingConfig(Config):
@@ -36,6 +97,14 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL')
     DEBUG = True
+    # The lowest cost bcrypt accepts keeps the test suite fast
+    BCRYPT_LOG_ROUNDS = 4
+    # Tests deliver queued emails explicitly
+    MAIL_WORKER_ENABLED = False
+    RATELIMIT_ENABLED = False
+    # Suggestions reflect each change straight away
+    FRIEND_GRAPH_TTL = 0
+    FRIEND_GRAPH_BACKGROUND = False
 
 
 class StagingConfig(Config):
@@ -51,6 +120,8 @@ class ProductionConfig(Config):
     """
     DEBUG = False
     TESTING = False
+    # Heroku's router appends the client address to X-Forwarded-For
+    RATELIMIT_PROXY_COUNT = int(os.getenv('RATELIMIT_PROXY_COUNT', 1))
 
 app_config = {
     'development': DevelopmentConfig,
@@ -2,15 +2,22 @@
 Handles database migrations
 """
 import os
+import random
+import time
 import unittest
+from datetime import datetime, timedelta
+import bcrypt
 # class for handling a set of commands
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from app import db, create_app
+from app import db, create_app, mail_worker
+from app.graph import FriendGraph
+from app.models import Friend, PasswordReset, Tombstone
+from app.search import include_object
 
 # initialize the app with all its configurations
 app = create_app(config_name=os.getenv('APP_SETTINGS'))
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, include_object=include_object)
 # create an instance of class that will handle our commands
 manager = Manager(app)
 
@@ -33,5 +40,133 @@ def test():
     return 1
 
 
+# Usage: python manage.py calibrate_bcrypt --target 250
+@manager.option('-t', '--target', dest='target', default=250, type=float,
+                help='Target hashing time in milliseconds')
+@manager.option('-s', '--samples', dest='samples', default=3, type=int,
+                help='Number of hashes timed for each cost')
+def calibrate_bcrypt(target, samples):
+    """
+    Benchmarks bcrypt on this host and suggests a BCRYPT_LOG_ROUNDS value
+    """
+    suggested = 4
+    password = b'calibration password'
+
+    for rounds in range(4, 32):
+        timings = []
+        for _ in range(max(samples, 1)):
+            start = time.time()
+            bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+            timings.append((time.time() - start) * 1000)
+        elapsed = min(timings)
+
+        print('cost {:2d}: {:8.1f} ms'.format(rounds, elapsed))
+        if elapsed > target:
+            break
+        suggested = rounds
+
+    print('Suggested BCRYPT_LOG_ROUNDS for a {:.0f} ms target: {}'.format(target, suggested))
+    print('Currently configured: {}'.format(app.config.get('BCRYPT_LOG_ROUNDS')))
+    return 0
+
+
+# Usage: python manage.py send_mail [--once]
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='Deliver the due emails and exit')
+def send_mail(once):
+    """
+    Delivers queued emails, either once or continuously
+    """
+    if once:
+        print('Sent {} emails'.format(mail_worker.deliver_all()))
+        return 0
+
+    mail_worker.run()
+
+
+# Usage: python manage.py sweep_resets --batch-size 1000
+@manager.option('-b', '--batch-size', dest='batch_size', default=1000, type=int,
+                help='Number of rows deleted per statement')
+def sweep_resets(batch_size):
+    """
+    Deletes expired password reset tokens
+    """
+    print('Deleted {} expired password resets'.format(
+        PasswordReset.sweep_expired(batch_size=batch_size)))
+    return 0
+
+
+# Usage: python manage.py sweep_tombstones --batch-size 1000
+@manager.option('-b', '--batch-size', dest='batch_size', default=1000, type=int,
+                help='Number of rows deleted per statement')
+def sweep_tombstones(batch_size):
+    """
+    Deletes the tombstones older than SYNC_TOMBSTONE_DAYS
+    """
+    before = datetime.utcnow() - timedelta(days=app.config['SYNC_TOMBSTONE_DAYS'])
+    print('Deleted {} expired tombstones'.format(
+        Tombstone.sweep_expired(before, batch_size=batch_size)))
+    return 0
+
+
+# Usage: python manage.py benchmark_suggestions --users 100000 --friends 150 [--database]
+@manager.option('-u', '--users', dest='users', default=100000, type=int,
+                help='Number of users in the generated graph')
+@manager.option('-f', '--friends', dest='friends', default=150, type=int,
+                help='Average number of friends of a user')
+@manager.option('-s', '--samples', dest='samples', default=200, type=int,
+                help='Number of users whose suggestions are timed')
+@manager.option('-d', '--database', dest='database', action='store_true', default=False,
+                help='Also time a build from the friends table of the database')
+def benchmark_suggestions(users, friends, samples, database):
+    """
+    Times building the friend graph and the suggestions on a random graph of the given size
+    """
+    def random_pairs():
+        """
+        Each user befriends half their friends, the other half befriend them
+        """
+        rng = random.Random(0)
+        for user_id in range(1, users + 1):
+            for _ in range(friends // 2):
+                friend_id = rng.randint(1, users)
+                if friend_id != user_id:
+                    yield user_id, friend_id
+
+    graph = FriendGraph()
+    graph.load(random_pairs())
+    stats = graph.stats()
+    print('Built a graph of {} users and {} friendships in {:.1f} s, using {:.0f} MB'.format(
+        stats['users'], stats['friendships'], stats['build_seconds'],
+        stats['memory_bytes'] / 1024.0 / 1024))
+
+    timings = []
+    for user_id in random.Random(1).sample(range(1, users + 1), min(samples, users)):
+        start = time.time()
+        graph.suggestions(user_id, graph.friends(user_id))
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+
+    def percentile(fraction):
+        """
+        Timing below which a fraction of the samples fall
+        """
+        return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+    if database:
+        # What each worker's background rebuild costs every FRIEND_GRAPH_TTL seconds
+        with app.app_context():
+            database_graph = FriendGraph()
+            database_graph.load(Friend.accepted_pairs())
+            stats = database_graph.stats()
+        print('Built the graph of {} friendships in the database in {:.1f} s'.format(
+            stats['friendships'], stats['build_seconds']))
+
+    print('Suggestions for {} users: p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, '
+          'max {:.1f} ms'.format(len(timings), percentile(0.5), percentile(0.95),
+                                 percentile(0.99), timings[-1]))
+    return 0
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,47 @@
+"""tombstones and date_modified indexes for delta sync
+
+Revision ID: a6d2e8f41c73
+Revises: f3a7c5e81b26
+Create Date: 2026-10-17 17:04:52.913406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2e8f41c73'
+down_revision = 'f3a7c5e81b26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstones',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('kind', sa.String(length=10), nullable=False),
+                    sa.Column('object_id', sa.Integer(), nullable=False),
+                    sa.Column('list_id', sa.Integer(), nullable=False),
+                    sa.Column('date_deleted', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_tombstones_user_id_date_deleted', 'tombstones',
+                    ['user_id', 'date_deleted'], unique=False)
+    op.create_index('ix_shopping_lists_user_id_date_modified', 'shopping_lists',
+                    ['user_id', 'date_modified'], unique=False)
+    op.create_index('ix_shopping_list_items_list_id_date_modified', 'shopping_list_items',
+                    ['list_id', 'date_modified'], unique=False)
+    op.create_index('ix_shared_lists_user1_date_modified', 'shared_lists',
+                    ['user1', 'date_modified'], unique=False)
+    op.create_index('ix_shared_lists_user2_date_modified', 'shared_lists',
+                    ['user2', 'date_modified'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shared_lists_user2_date_modified', table_name='shared_lists')
+    op.drop_index('ix_shared_lists_user1_date_modified', table_name='shared_lists')
+    op.drop_index('ix_shopping_list_items_list_id_date_modified',
+                  table_name='shopping_list_items')
+    op.drop_index('ix_shopping_lists_user_id_date_modified', table_name='shopping_lists')
+    op.drop_index('ix_tombstones_user_id_date_deleted', table_name='tombstones')
+    op.drop_table('tombstones')
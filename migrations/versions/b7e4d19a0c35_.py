@@ -0,0 +1,38 @@
+"""store hashed password reset tokens with an expiry
+
+Revision ID: b7e4d19a0c35
+Revises: 3f9c2a7d1b64
+Create Date: 2026-10-17 10:03:17.664120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d19a0c35'
+down_revision = '3f9c2a7d1b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Outstanding tokens cannot be converted to digests in SQL, so they are dropped.
+    # They expire within an hour anyway.
+    op.execute('DELETE FROM password_resets')
+    with op.batch_alter_table('password_resets') as batch_op:
+        batch_op.add_column(sa.Column('token_hash', sa.String(length=64), nullable=False))
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=False))
+        batch_op.drop_column('token')
+        batch_op.create_unique_constraint('uq_password_resets_token_hash', ['token_hash'])
+        batch_op.create_index('ix_password_resets_expires_at', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.execute('DELETE FROM password_resets')
+    with op.batch_alter_table('password_resets') as batch_op:
+        batch_op.drop_index('ix_password_resets_expires_at')
+        batch_op.drop_constraint('uq_password_resets_token_hash', type_='unique')
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('token_hash')
+        batch_op.add_column(sa.Column('token', sa.String(length=256), nullable=False))
@@ -0,0 +1,32 @@
+"""case insensitive unique names and emails
+
+Revision ID: c41d8e2f9a57
+Revises: b7e4d19a0c35
+Create Date: 2026-10-17 11:26:05.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e2f9a57'
+down_revision = 'b7e4d19a0c35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fails if rows already differ only by case. Rename or merge them before upgrading.
+    op.create_index('uq_users_lower_email', 'users',
+                    [sa.text('lower(email)')], unique=True)
+    op.create_index('uq_shopping_lists_user_id_lower_name', 'shopping_lists',
+                    ['user_id', sa.text('lower(name)')], unique=True)
+    op.create_index('uq_shopping_list_items_list_id_lower_name', 'shopping_list_items',
+                    ['list_id', sa.text('lower(name)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_shopping_list_items_list_id_lower_name', table_name='shopping_list_items')
+    op.drop_index('uq_shopping_lists_user_id_lower_name', table_name='shopping_lists')
+    op.drop_index('uq_users_lower_email', table_name='users')
@@ -0,0 +1,32 @@
+"""unique shares of a list per user, replacing the index on list_id
+
+Revision ID: d2f6b3a9e174
+Revises: a6d2e8f41c73
+Create Date: 2026-10-18 09:12:41.370526
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6b3a9e174'
+down_revision = 'a6d2e8f41c73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent shares could store a list twice for a user. Keep the oldest.
+    op.execute('DELETE FROM shared_lists WHERE EXISTS ('
+               'SELECT 1 FROM shared_lists other '
+               'WHERE other.list_id = shared_lists.list_id '
+               'AND other.user2 = shared_lists.user2 AND other.id < shared_lists.id)')
+    op.create_index('uq_shared_lists_list_id_user2', 'shared_lists', ['list_id', 'user2'],
+                    unique=True)
+    # The unique index leads with list_id, so it serves the lookups by list too
+    op.drop_index('ix_shared_lists_list_id', table_name='shared_lists')
+
+
+def downgrade():
+    op.create_index('ix_shared_lists_list_id', 'shared_lists', ['list_id'])
+    op.drop_index('uq_shared_lists_list_id_user2', table_name='shared_lists')
@@ -0,0 +1,49 @@
+"""indexes for the foreign keys and listing queries
+
+Revision ID: d8a3f61c2e90
+Revises: c41d8e2f9a57
+Create Date: 2026-10-17 12:08:44.902163
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a3f61c2e90'
+down_revision = 'c41d8e2f9a57'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # Sorted pages of a user's lists and of a list's items
+    ('ix_shopping_lists_user_id_name', 'shopping_lists', ['user_id', 'name']),
+    ('ix_shopping_list_items_list_id_name', 'shopping_list_items', ['list_id', 'name']),
+    # Lists shared by or with a user, and the shares of a list
+    ('ix_shared_lists_list_id', 'shared_lists', ['list_id']),
+    ('ix_shared_lists_user1_list_id', 'shared_lists', ['user1', 'list_id']),
+    ('ix_shared_lists_user2_list_id', 'shared_lists', ['user2', 'list_id']),
+    # Friendships looked up from either side
+    ('ix_friends_user1_user2', 'friends', ['user1', 'user2']),
+    ('ix_friends_user2_user1', 'friends', ['user2', 'user1']),
+]
+
+
+def end_transaction():
+    """
+    CREATE and DROP INDEX CONCURRENTLY cannot run inside a transaction block.
+    Tables stay writable while the indexes are built on PostgreSQL.
+    """
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('COMMIT')
+
+
+def upgrade():
+    end_transaction()
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    end_transaction()
+    for name, table, _columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
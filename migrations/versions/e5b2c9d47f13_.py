@@ -0,0 +1,74 @@
+"""trigram search on list, item and user names
+
+Revision ID: e5b2c9d47f13
+Revises: d8a3f61c2e90
+Create Date: 2026-10-17 13:41:20.557018
+
+"""
+import sqlite3
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c9d47f13'
+down_revision = 'd8a3f61c2e90'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = [
+    ('users', 'username'),
+    ('shopping_lists', 'name'),
+    ('shopping_list_items', 'name'),
+]
+
+
+def sqlite_upgrade(table, column):
+    fts = '{}_fts'.format(table)
+    values = {'table': table, 'column': column, 'fts': fts}
+    op.execute("CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', "
+               "content_rowid='id', tokenize='trigram')".format(**values))
+    op.execute("CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+               "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); "
+               "END".format(**values))
+    op.execute("CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+               "INSERT INTO {fts}({fts}, rowid, {column}) "
+               "VALUES ('delete', old.id, old.{column}); END".format(**values))
+    op.execute("CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+               "INSERT INTO {fts}({fts}, rowid, {column}) "
+               "VALUES ('delete', old.id, old.{column}); "
+               "INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); "
+               "END".format(**values))
+    # Index the existing rows
+    op.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(**values))
+
+
+def sqlite_downgrade(table):
+    fts = '{}_fts'.format(table)
+    for suffix in ('ai', 'ad', 'au'):
+        op.execute('DROP TRIGGER IF EXISTS {}_{}'.format(fts, suffix))
+    op.execute('DROP TABLE IF EXISTS {}'.format(fts))
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # Build the indexes without blocking writes, outside a transaction
+        op.execute('COMMIT')
+        for table, column in SEARCHABLE:
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{0}_{1}_trgm '
+                       'ON {0} USING gin ({1} gin_trgm_ops)'.format(table, column))
+    elif dialect == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+        for table, column in SEARCHABLE:
+            sqlite_upgrade(table, column)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('COMMIT')
+        for table, column in SEARCHABLE:
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_{}_{}_trgm'.format(table, column))
+    elif dialect == 'sqlite':
+        for table, _column in SEARCHABLE:
+            sqlite_downgrade(table)
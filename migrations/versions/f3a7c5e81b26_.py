@@ -0,0 +1,65 @@
+"""store friendships as ordered user pairs
+
+Revision ID: f3a7c5e81b26
+Revises: e5b2c9d47f13
+Create Date: 2026-10-17 15:12:36.204817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c5e81b26'
+down_revision = 'e5b2c9d47f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_friends_user2_user1', table_name='friends')
+    op.drop_index('ix_friends_user1_user2', table_name='friends')
+    with op.batch_alter_table('friends') as batch_op:
+        batch_op.add_column(sa.Column('low_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('high_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('requested_by', sa.Integer(), nullable=True))
+
+    # The request was always sent by user1
+    op.execute('UPDATE friends SET '
+               'low_id = CASE WHEN user1 < user2 THEN user1 ELSE user2 END, '
+               'high_id = CASE WHEN user1 < user2 THEN user2 ELSE user1 END, '
+               'requested_by = user1')
+    # Requests sent both ways at once left two rows for a pair.
+    # Keep the accepted one, or else the oldest.
+    op.execute('DELETE FROM friends WHERE EXISTS ('
+               'SELECT 1 FROM friends other '
+               'WHERE other.low_id = friends.low_id AND other.high_id = friends.high_id '
+               'AND ((other.accepted AND NOT friends.accepted) OR '
+               '(other.accepted = friends.accepted AND other.id < friends.id)))')
+
+    with op.batch_alter_table('friends') as batch_op:
+        batch_op.alter_column('low_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('high_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('requested_by', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('user2')
+        batch_op.drop_column('user1')
+    op.create_index('uq_friends_low_id_high_id', 'friends', ['low_id', 'high_id'], unique=True)
+    op.create_index('ix_friends_high_id', 'friends', ['high_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friends_high_id', table_name='friends')
+    op.drop_index('uq_friends_low_id_high_id', table_name='friends')
+    with op.batch_alter_table('friends') as batch_op:
+        batch_op.add_column(sa.Column('user1', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('user2', sa.Integer(), nullable=True))
+
+    op.execute('UPDATE friends SET user1 = requested_by, '
+               'user2 = CASE WHEN requested_by = low_id THEN high_id ELSE low_id END')
+
+    with op.batch_alter_table('friends') as batch_op:
+        batch_op.drop_column('requested_by')
+        batch_op.drop_column('high_id')
+        batch_op.drop_column('low_id')
+    op.create_index('ix_friends_user1_user2', 'friends', ['user1', 'user2'], unique=False)
+    op.create_index('ix_friends_user2_user1', 'friends', ['user2', 'user1'], unique=False)
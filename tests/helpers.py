@@ -0,0 +1,26 @@
+"""
+Helpers shared by the test cases
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+
+@contextmanager
+def count_queries():
+    """
+    Record each statement sent to the database while the block runs
+    """
+    statements = []
+
+    def count_statement(*_args):
+        """
+        Record a statement about to be executed
+        """
+        statements.append(_args[2])
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
@@ -3,6 +3,7 @@ Tests for admin
 """
 import json
 from flask_testing import TestCase
+from sqlalchemy import event
 from app import create_app, db
 
 
@@ -269,3 +270,70 @@ class AuthTestCase(TestCase):
         res = self.client.get('/v1/admin/users?page=1&limit=2',
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 404)
+
+    def test_get_cache_stats(self):
+        """
+        Test that an admin can see the token cache counters
+        """
+        access_token = self.login_user(self.admin)
+
+        self.client.get('/v1/admin/users', headers={'x-access-token': access_token})
+        res = self.client.get('/v1/admin/stats', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 200)
+
+        stats = json.loads(res.data.decode())['token_cache']
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+
+        stats = json.loads(res.data.decode())['friend_cache']
+        self.assertIn('hit_ratio', stats)
+        self.assertIn('memory_bytes', stats)
+
+    def test_get_cache_stats_without_rights(self):
+        """
+        Try to get the cache counters without admin rights
+        """
+        access_token = self.login_user(self.user2)
+
+        res = self.client.get('/v1/admin/stats', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 403)
+
+    def test_deleted_user_token_rejected(self):
+        """
+        Test that a cached token stops working once its user is deleted
+        """
+        admin_token = self.login_user(self.admin)
+        access_token = self.login_user(self.user2)
+
+        # Use the token so that it gets cached
+        res = self.client.get('/v1/shopping_lists', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+        self.client.delete('/v1/admin/users/3', headers={'x-access-token': admin_token})
+
+        res = self.client.get('/v1/shopping_lists', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 401)
+
+    def test_get_user_single_query(self):
+        """
+        Test that a cached admin token only costs the query for the requested user
+        """
+        access_token = self.login_user(self.admin)
+        self.client.get('/v1/admin/users/2', headers={'x-access-token': access_token})
+
+        statements = []
+
+        def count_statement(*_args):
+            """
+            Record each statement sent to the database
+            """
+            statements.append(_args[2])
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            res = self.client.get('/v1/admin/users/2', headers={'x-access-token': access_token})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
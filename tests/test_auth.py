@@ -2,8 +2,10 @@
 Tests for authentication
 """
 import json
+from datetime import datetime, timedelta
 from flask_testing import TestCase
-from app import create_app, db
+from app import create_app, db, password_hasher
+from app.models import User, PasswordReset
 
 
 class AuthTestCase(TestCase):
@@ -164,6 +166,48 @@ class AuthTestCase(TestCase):
         # and an error status code 401(Unauthorized)
         self.assertEqual(res.status_code, 401)
 
+    def test_login_hashing_pool_full(self):
+        """
+        Test that logins are turned away when the hashing pool is saturated
+        """
+        self.create_user(self.user1)
+        # Take every slot of the queue
+        for _ in range(password_hasher.stats()['capacity']):
+            password_hasher._slots.acquire()  # pylint: disable=protected-access
+
+        res = self.client.post('/v1/auth/login', data=self.user1)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(password_hasher.stats()['rejected'], 1)
+
+    def test_login_rehashes_password(self):
+        """
+        Test that logging in upgrades a hash made with another work factor
+        """
+        self.create_user(self.user1)
+        password_hasher.rounds = 5
+
+        res = self.client.post('/v1/auth/login', data=self.user1)
+        self.assertEqual(res.status_code, 200)
+
+        user = User.query.filter_by(email=self.user1['email']).first()
+        self.assertTrue(user.password.startswith('$2b$05$'))
+        self.assertFalse(user.password_needs_rehash())
+
+        res = self.client.post('/v1/auth/login', data=self.user1)
+        self.assertEqual(res.status_code, 200)
+
+    def test_profile_update_keeps_password(self):
+        """
+        Test that updating a profile without a password keeps the old one
+        """
+        access_token = self.login_user(self.user1)
+
+        self.client.put('/v1/users/2', headers={'x-access-token': access_token},
+                        data={'username': 'test_user'})
+        res = self.client.post('/v1/auth/login', data=self.user1)
+        self.assertEqual(res.status_code, 200)
+
     def test_password_reset_email(self):
         """
         Use invalid email
@@ -217,6 +261,56 @@ class AuthTestCase(TestCase):
         self.assertEqual(login_res.status_code, 200)
         self.assertTrue(result['access_token'])
 
+    def test_reset_token_single_use(self):
+        """
+        Test that a reset token stops working once it has been used
+        """
+        self.create_user(self.user1)
+
+        res = self.client.post('/v1/auth/reset', data={'email': 'user1@gmail.com'})
+        token = json.loads(res.data.decode())['pass_reset_token']
+
+        self.client.put('/v1/auth/password/' + token, data={'password': 'pass123'})
+        reset_res = self.client.put('/v1/auth/password/' + token, data={'password': 'pass456'})
+        self.assertEqual(reset_res.status_code, 400)
+
+    def test_new_reset_token_replaces_old(self):
+        """
+        Test that requesting a new token invalidates the previous one
+        """
+        self.create_user(self.user1)
+
+        self.client.post('/v1/auth/reset', data={'email': 'user1@gmail.com'})
+        PasswordReset.query.first().token_hash = PasswordReset.hash_token('old_token')
+        db.session.commit()
+        self.assertIsNotNone(PasswordReset.find_valid('old_token'))
+
+        self.client.post('/v1/auth/reset', data={'email': 'user1@gmail.com'})
+        self.assertEqual(PasswordReset.query.count(), 1)
+        self.assertIsNone(PasswordReset.find_valid('old_token'))
+
+    def test_sweep_expired_resets(self):
+        """
+        Test that expired reset tokens are swept in batches and stop working
+        """
+        self.create_user(self.user1)
+        self.create_user(self.user2)
+
+        tokens = []
+        for user in (self.user1, self.user2):
+            res = self.client.post('/v1/auth/reset', data={'email': user['email']})
+            tokens.append(json.loads(res.data.decode())['pass_reset_token'])
+
+        PasswordReset.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+
+        reset_res = self.client.put('/v1/auth/password/' + tokens[0],
+                                    data={'password': 'pass123'})
+        self.assertEqual(reset_res.status_code, 400)
+
+        self.assertEqual(PasswordReset.sweep_expired(batch_size=1), 2)
+        self.assertEqual(PasswordReset.query.count(), 0)
+
     def test_wrong_pass_reset_token(self):
         """
         Attempt to use wrong token
@@ -380,6 +474,22 @@ class AuthTestCase(TestCase):
                               data=self.user2)
         self.assertEqual(res.status_code, 401)
 
+    def test_email_exists_other_case_up_prof(self):
+        """
+        Use an email that already exists with different letter case
+        """
+        self.create_user(self.user1)
+        # Stored before addresses were validated
+        User(username='User2', email='User2@Gmail.com', password='password').save()
+        access_token = self.login_user(self.user1)
+
+        res = self.client.put('/v1/users/2', headers={'x-access-token': access_token},
+                              data={'email': 'user2@gmail.com'})
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client.get('/v1/users/2', headers={'x-access-token': access_token})
+        self.assertEqual(json.loads(res.data.decode())['email'], self.user1['email'])
+
     def test_profile_edit_id_format(self):
         """
         Test that id format is correct when editing
@@ -459,10 +569,25 @@ class AuthTestCase(TestCase):
         Try to search user that exists
         """
         self.create_user(self.user1)
+        self.create_user(self.user2)
         access_token = self.login_user(self.user1)
 
         res = self.client.get('/v1/users?q=us', headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data.decode())
+        # The caller is left out of the results and of the total
+        self.assertEqual(data['total'], 1)
+        self.assertEqual([user['id'] for user in data['users']], [3])
+
+    def test_search_only_self(self):
+        """
+        Try to search for a term only the caller matches
+        """
+        self.create_user(self.user1)
+        access_token = self.login_user(self.user1)
+
+        res = self.client.get('/v1/users?q=us', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
 
     def test_delete_profile_id_format(self):
         """
@@ -484,6 +609,26 @@ class AuthTestCase(TestCase):
         res = self.client.delete('/v1/users/2', headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
 
+    def test_profile_of_user_deleted_elsewhere(self):
+        """
+        Use a cached token of a user deleted behind the application's back
+        """
+        self.create_user(self.user1)
+        access_token = self.login_user(self.user1)
+        # A first request caches the token
+        res = self.client.get('/v1/users/2', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 200)
+        db.session.execute('DELETE FROM users WHERE id = 2')
+        db.session.commit()
+
+        res = self.client.put('/v1/users/2', headers={'x-access-token': access_token},
+                              data={'username': 'test_user'})
+        self.assertEqual(res.status_code, 401)
+        self.assertIn('expired or invalid', json.loads(res.data.decode())['message'])
+
+        res = self.client.delete('/v1/users/2', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 401)
+
     def test_delete_profile_token_correct(self):
         """
         Test whether token is correct
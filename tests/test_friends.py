@@ -2,8 +2,13 @@
 Tests for friend system
 """
 import json
+import threading
+import time
 from flask_testing import TestCase
-from app import create_app, db
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, friend_cache, friend_graph
+from app.cache import FriendSets
+from app.models import Friend
 
 
 class FriendTestCase(TestCase):
@@ -205,6 +210,39 @@ class FriendTestCase(TestCase):
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 404)
 
+    def test_accept_own_request(self):
+        """
+        Try to accept a friend request you sent
+        """
+        self.send_user2_request()
+        access_token = self.login_user(self.user1)
+
+        res = self.client.put('/v1/friends/3',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+    def test_friendship_stored_once(self):
+        """
+        Test that a pair of users has a single friendship whichever of them asks
+        """
+        access_token = self.send_user2_request()
+
+        # Request back the user who sent the request
+        res = self.client.post('/v1/friends',
+                               headers={'x-access-token': access_token},
+                               data={'friend_id': 2})
+        self.assertEqual(res.status_code, 401)
+
+        friend = Friend.query.one()
+        self.assertEqual((friend.low_id, friend.high_id, friend.requested_by), (2, 3, 2))
+        self.assertEqual(Friend.between(3, 2).id, friend.id)
+
+        # The unique pair index rejects a second row for the pair
+        db.session.add(Friend(requested_by=3, requested_to=2))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
     def test_to_send_request_to_friend(self):
         """
         Try to send a friend request to a user you're friends with
@@ -232,6 +270,226 @@ class FriendTestCase(TestCase):
                                data={'friend_id': 2})
         self.assertEqual(res.status_code, 401)
 
+    def test_friends_cache_invalidated(self):
+        """
+        Test that cached friends follow accepted and removed friendships
+        """
+        access_token = self.send_user2_request()
+        user1_token = self.login_user(self.user1)
+
+        res = self.client.post('/v1/friends', headers={'x-access-token': user1_token},
+                               data={'friend_id': 3})
+        self.assertEqual(json.loads(res.data.decode())['message'], 'Friend request already sent')
+
+        # Served from the cache until a friendship of the user changes
+        hits = friend_cache.stats()['hits']
+        self.client.post('/v1/friends', headers={'x-access-token': user1_token},
+                         data={'friend_id': 3})
+        self.assertEqual(friend_cache.stats()['hits'], hits + 1)
+
+        self.client.put('/v1/friends/2', headers={'x-access-token': access_token})
+        res = self.client.post('/v1/friends', headers={'x-access-token': user1_token},
+                               data={'friend_id': 3})
+        self.assertEqual(json.loads(res.data.decode())['message'], 'You are already friends')
+
+        self.client.delete('/v1/friends/3', headers={'x-access-token': user1_token})
+        res = self.client.post('/v1/friends', headers={'x-access-token': access_token},
+                               data={'friend_id': 2})
+        self.assertEqual(res.status_code, 200)
+
+    def test_friends_cache_expires(self):
+        """
+        Test that cached friends stop being served after the ttl, as other
+        processes do not see the changes made here
+        """
+        access_token = self.login_user(self.user1)
+        user1_id = 2
+
+        # A friendship made in another process that has not reached this one
+        friend_cache.ttl = 0.05
+        friend_cache.set(user1_id, FriendSets(frozenset([3]), frozenset(), frozenset()),
+                         friend_cache.version())
+        res = self.client.post('/v1/friends', headers={'x-access-token': access_token},
+                               data={'friend_id': 3})
+        self.assertEqual(json.loads(res.data.decode())['message'], 'You are already friends')
+        # The listing reads the friends table, so it is never stale
+        res = self.client.get('/v1/friends', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+        time.sleep(0.1)
+        res = self.client.post('/v1/friends', headers={'x-access-token': access_token},
+                               data={'friend_id': 3})
+        self.assertEqual(res.status_code, 200)
+
+    def test_friend_suggestions(self):
+        """
+        Test that friends of friends are suggested by number of mutual friends
+        """
+        user3 = {'username': 'User3', 'email': 'user3@gmail.com', 'password': 'password'}
+        user4 = {'username': 'User4', 'email': 'user4@gmail.com', 'password': 'password'}
+        self.client.post('/v1/auth/register', data=user3)
+        self.client.post('/v1/auth/register', data=user4)
+
+        # User1 is friends with User2 and User3, who are both friends with User4
+        for sender, receiver_id in ((self.user1, 3), (self.user1, 4), (user4, 3), (user4, 4)):
+            self.client.post('/v1/friends', headers={'x-access-token': self.login_user(sender)},
+                             data={'friend_id': receiver_id})
+        for receiver, sender_id in ((self.user2, 2), (user3, 2), (self.user2, 5), (user3, 5)):
+            self.client.put('/v1/friends/{}'.format(sender_id),
+                            headers={'x-access-token': self.login_user(receiver)})
+
+        access_token = self.login_user(self.user2)
+        res = self.client.get('/v1/friends/suggestions', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 200)
+        suggestions = json.loads(res.data.decode())['suggestions']
+        self.assertEqual([(user['username'], user['mutual_friends']) for user in suggestions],
+                         [('User3', 2)])
+
+        access_token = self.login_user(self.user1)
+        res = self.client.get('/v1/friends/suggestions', headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['suggestions'][0]['username'], 'User4')
+        self.assertEqual(data['suggestions'][0]['mutual_friends'], 2)
+
+        # Users who already have a pending request are not suggested
+        self.client.post('/v1/friends', headers={'x-access-token': access_token},
+                         data={'friend_id': 5})
+        res = self.client.get('/v1/friends/suggestions', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+    def test_friend_suggestions_pages(self):
+        """
+        Test that suggestions are paginated with page numbers and cursors
+        """
+        access_token = self.login_user(self.user1)
+        user1_id = 2
+
+        # Friends of friends from the graph without going through the endpoints
+        friend_graph.load([(3, 4), (3, 5), (3, 6)])
+        friend_graph.ttl = 300
+        friend_cache.set(user1_id, FriendSets(frozenset([3]), frozenset(), frozenset()),
+                         friend_cache.version())
+
+        res = self.client.get('/v1/friends/suggestions?limit=2',
+                              headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['total'], 3)
+        self.assertIn('page=2', data['next_page'])
+
+        res = self.client.get('/v1/friends/suggestions?limit=2&cursor=' + data['next_cursor'],
+                              headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['next_page'], 'None')
+
+    def test_friend_graph_built_in_background(self):
+        """
+        Test that suggestions do not wait for the graph to be built
+        """
+        access_token = self.login_user(self.user1)
+        user1_id = 2
+        friend_cache.set(user1_id, FriendSets(frozenset([3]), frozenset(), frozenset()),
+                         friend_cache.version())
+        friend_graph.background = True
+        friend_graph.ttl = 300
+        loaded = threading.Event()
+
+        def slow_pairs():
+            """
+            Friendships that take until the test lets them through to load
+            """
+            loaded.wait(5)
+            yield 3, 4
+
+        friend_graph.refresh(slow_pairs)
+        res = self.client.get('/v1/friends/suggestions', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '10')
+
+        loaded.set()
+        friend_graph._thread.join(5)  # pylint: disable=protected-access
+        res = self.client.get('/v1/friends/suggestions', headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(friend_graph.stats()['builds'], 1)
+
+    def test_answer_requests_in_bulk(self):
+        """
+        Test that several friend requests can be accepted or rejected at once
+        """
+        user3 = {'username': 'User3', 'email': 'user3@gmail.com', 'password': 'password'}
+        user4 = {'username': 'User4', 'email': 'user4@gmail.com', 'password': 'password'}
+        self.client.post('/v1/auth/register', data=user3)
+        self.client.post('/v1/auth/register', data=user4)
+        for sender in (self.user1, user3, user4):
+            self.client.post('/v1/friends', headers={'x-access-token': self.login_user(sender)},
+                             data={'friend_id': 3})
+        access_token = self.login_user(self.user2)
+        headers = {'x-access-token': access_token}
+
+        res = self.client.put('/v1/friends/requests', headers=headers,
+                              data=json.dumps({'friend_ids': [2, 4, 2]}),
+                              content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data.decode())['count'], 2)
+
+        res = self.client.put('/v1/friends/requests', headers=headers,
+                              data={'friend_ids': '5', 'action': 'reject'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data.decode())['count'], 1)
+
+        res = self.client.get('/v1/friends', headers=headers)
+        friends = json.loads(res.data.decode())['friends']
+        self.assertEqual([friend['id'] for friend in friends], [2, 4])
+        res = self.client.get('/v1/friends/requests', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+        # Answered requests cannot be answered again
+        res = self.client.put('/v1/friends/requests', headers=headers,
+                              data={'friend_ids': '2,4,5'})
+        self.assertEqual(res.status_code, 404)
+
+    def test_answer_requests_in_bulk_params(self):
+        """
+        Use the wrong friend ids format
+        """
+        access_token = self.send_user2_request()
+        headers = {'x-access-token': access_token}
+
+        res = self.client.put('/v1/friends/requests', headers=headers,
+                              data={'friend_ids': 'one,two'})
+        self.assertEqual(res.status_code, 401)
+        res = self.client.put('/v1/friends/requests', headers=headers, data={})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.put('/v1/friends/requests', headers=headers,
+                              data={'friend_ids': '2', 'action': 'ignore'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_friends_with_mutual_count(self):
+        """
+        Test that listings can include the number of mutual friends
+        """
+        user3 = {'username': 'User3', 'email': 'user3@gmail.com', 'password': 'password'}
+        self.client.post('/v1/auth/register', data=user3)
+
+        # User1, User2 and User3 are all friends with each other
+        for sender, receiver_id in ((self.user1, 3), (self.user1, 4), (self.user2, 4)):
+            self.client.post('/v1/friends', headers={'x-access-token': self.login_user(sender)},
+                             data={'friend_id': receiver_id})
+        self.client.put('/v1/friends/requests', data={'friend_ids': '2'},
+                        headers={'x-access-token': self.login_user(self.user2)})
+        self.client.put('/v1/friends/requests', data={'friend_ids': '2,3'},
+                        headers={'x-access-token': self.login_user(user3)})
+
+        headers = {'x-access-token': self.login_user(self.user1)}
+        res = self.client.get('/v1/friends?mutual=true&limit=1', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['friends'][0]['mutual_friends'], 1)
+        self.assertIn('mutual=true', data['next_page'])
+
+        res = self.client.get('/v1/friends', headers=headers)
+        self.assertNotIn('mutual_friends', json.loads(res.data.decode())['friends'][0])
+
     def test_get_friends_when_none(self):
         """
         Test user can get all their friends
@@ -314,6 +572,8 @@ class FriendTestCase(TestCase):
 
         res = self.client.get('/v1/friends?q=user', headers={'x-access-token': access_token}, )
         self.assertEqual(res.status_code, 200)
+        friends = json.loads(res.data.decode())['friends']
+        self.assertEqual([friend['username'] for friend in friends], ['User1'])
 
     def test_remove_friend(self):
         """
@@ -393,6 +653,13 @@ class FriendTestCase(TestCase):
         res = self.client.get('/v1/friends/requests?q=us',
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
+        # The request is listed under the user who sent it
+        requests = json.loads(res.data.decode())['friend_requests']
+        self.assertEqual([request['username'] for request in requests], ['User1'])
+
+        res = self.client.get('/v1/friends/requests?q=user2',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
 
     def test_get_friend_requests_when_none(self):
         """
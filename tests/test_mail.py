@@ -0,0 +1,189 @@
+"""
+Tests for the outbound mail queue
+"""
+import socket
+import socketserver
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+from flask_testing import TestCase
+from app import create_app, db, mail, mail_worker
+from app.models import OutboxEmail
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP conversation that records every delivered message
+    """
+
+    def reply(self, line):
+        """
+        Send a reply line to the client
+        """
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        """
+        Handle one SMTP session
+        """
+        self.server.connections += 1
+        self.reply('220 localhost stand-in')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line[:4].upper()
+
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline().decode()
+                    if data_line.rstrip('\r\n') == '.':
+                        break
+                    data.append(data_line)
+                self.server.messages.append(''.join(data))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Local SMTP server used instead of a real mail server
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+        self.connections = 0
+
+
+def unused_port():
+    """
+    Return a local port nothing is listening on
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class MailQueueTestCase(TestCase):
+    """
+    Tests for queueing and delivering emails
+    """
+
+    def create_app(self):
+        """
+        Instantiate app instance
+        """
+        app = create_app(config_name="testing")
+        return app
+
+    def setUp(self):
+        """
+        Set up test variables and point the app at the local SMTP stand-in
+        """
+        self.smtp = SMTPStandIn()
+        thread = threading.Thread(target=self.smtp.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=self.smtp.server_address[1],
+                               MAIL_USE_SSL=False, MAIL_USE_TLS=False, MAIL_USERNAME=None,
+                               MAIL_SUPPRESS_SEND=False,
+                               MAIL_DEFAULT_SENDER='noreply@shoppinglist.test')
+        mail.init_app(self.app)
+
+        self.user1 = {
+            'username': 'User1',
+            'email': 'user1@gmail.com',
+            'password': 'password'
+        }
+
+        db.create_all()
+        self.client.post('/v1/auth/register', data=self.user1)
+
+    def tearDown(self):
+        """
+        Delete all initialized variables
+        """
+        self.smtp.shutdown()
+        self.smtp.server_close()
+        db.session.remove()
+        db.drop_all()
+
+    def test_reset_email_is_queued(self):
+        """
+        Test that the reset endpoint only writes the email to the outbox
+        """
+        res = self.client.post('/v1/auth/reset', data={'email': self.user1['email']})
+        self.assertEqual(res.status_code, 200)
+
+        email = OutboxEmail.query.filter_by(recipient=self.user1['email']).first()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(self.smtp.connections, 0)
+
+    def test_deliver_batch_over_one_connection(self):
+        """
+        Test that a batch of emails is delivered over a single connection
+        """
+        for _ in range(3):
+            self.client.post('/v1/auth/reset', data={'email': self.user1['email']})
+
+        self.assertEqual(mail_worker.deliver_all(), 3)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertIn('Reset Password', self.smtp.messages[0])
+        self.assertEqual(OutboxEmail.query.filter_by(status='sent').count(), 3)
+
+    def test_worker_delivers_before_waiting(self):
+        """
+        Test that the delivery loop sends the emails already due as soon as it starts
+        """
+        self.client.post('/v1/auth/reset', data={'email': self.user1['email']})
+        mail_worker.poll_interval = 60
+
+        # Stop the loop at its first wait
+        with mock.patch.object(mail_worker, '_wake') as wake:
+            wake.wait.side_effect = KeyboardInterrupt
+            with self.assertRaises(KeyboardInterrupt):
+                mail_worker.run()
+
+        self.assertEqual(len(self.smtp.messages), 1)
+        wake.wait.assert_called_once_with(60)
+
+    def test_retry_with_backoff(self):
+        """
+        Test that failed deliveries are retried later and eventually given up on
+        """
+        self.app.config['MAIL_PORT'] = unused_port()
+        mail.init_app(self.app)
+        self.client.post('/v1/auth/reset', data={'email': self.user1['email']})
+
+        self.assertEqual(mail_worker.deliver_pending(), 0)
+        email = OutboxEmail.query.first()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(email.attempts, 1)
+        self.assertTrue(email.last_error)
+
+        # Not due yet, so nothing is attempted
+        self.assertEqual(mail_worker.deliver_pending(), 0)
+        self.assertEqual(OutboxEmail.query.first().attempts, 1)
+
+        email = OutboxEmail.query.first()
+        email.attempts = mail_worker.max_attempts - 1
+        email.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        mail_worker.deliver_pending()
+        self.assertEqual(OutboxEmail.query.first().status, 'failed')
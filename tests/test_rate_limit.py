@@ -0,0 +1,104 @@
+"""
+Tests for rate limiting
+"""
+import json
+from flask_testing import TestCase
+from app import create_app, db
+from app.ratelimit import RateLimitMiddleware, RatePolicy, MemoryBackend
+
+
+class RateLimitTestCase(TestCase):
+    """
+    Tests for the token bucket rate limiting middleware
+    """
+
+    def create_app(self):
+        """
+        Instantiate app instance with tight limits
+        """
+        app = create_app(config_name="testing")
+        app.wsgi_app = RateLimitMiddleware(
+            app.wsgi_app,
+            policies=[
+                RatePolicy({'name': 'login', 'path': r'^/v1/auth/login$', 'rate': 2,
+                            'per': 60, 'methods': ['POST'], 'key': 'ip'}),
+                RatePolicy({'name': 'search', 'path': r'^/v1/shopping_lists$', 'rate': 2,
+                            'per': 60, 'methods': ['GET'], 'key': 'user', 'query': 'q'})
+            ],
+            backend=MemoryBackend(),
+            config=app.config)
+        return app
+
+    def setUp(self):
+        """
+        Set up test variables
+        """
+        self.user1 = {
+            'username': 'User1',
+            'email': 'user1@gmail.com',
+            'password': 'password'
+        }
+
+        db.create_all()
+        self.client.post('/v1/auth/register', data=self.user1)
+
+    def tearDown(self):
+        """
+        Delete all initialized variables
+        """
+        db.session.remove()
+        db.drop_all()
+
+    def test_login_limited_per_ip(self):
+        """
+        Test that logins beyond the burst are rejected with Retry-After
+        """
+        for _ in range(2):
+            res = self.client.post('/v1/auth/login', data=self.user1)
+            self.assertEqual(res.status_code, 200)
+
+        res = self.client.post('/v1/auth/login', data=self.user1)
+        self.assertEqual(res.status_code, 429)
+        self.assertGreaterEqual(int(res.headers['Retry-After']), 1)
+
+        # Another address has its own bucket
+        res = self.client.post('/v1/auth/login', data=self.user1,
+                               environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_search_limited_per_user(self):
+        """
+        Test that only search requests count against the search policy
+        """
+        login_res = self.client.post('/v1/auth/login', data=self.user1)
+        access_token = json.loads(login_res.data.decode())['access_token']
+        headers = {'x-access-token': access_token}
+
+        for _ in range(2):
+            res = self.client.get('/v1/shopping_lists?q=milk', headers=headers)
+            self.assertEqual(res.status_code, 404)
+
+        res = self.client.get('/v1/shopping_lists?q=milk', headers=headers)
+        self.assertEqual(res.status_code, 429)
+
+        res = self.client.get('/v1/shopping_lists', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+        # Logging in again does not give the user a new bucket
+        login_res = self.client.post('/v1/auth/login', data=self.user1)
+        access_token = json.loads(login_res.data.decode())['access_token']
+        res = self.client.get('/v1/shopping_lists?q=milk',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 429)
+
+    def test_search_invalid_token_limited_per_ip(self):
+        """
+        Test that requests with tokens that do not verify share the address's bucket
+        """
+        for token in ('wrong_token', 'another_wrong_token'):
+            res = self.client.get('/v1/shopping_lists?q=milk', headers={'x-access-token': token})
+            self.assertEqual(res.status_code, 401)
+
+        res = self.client.get('/v1/shopping_lists?q=milk',
+                              headers={'x-access-token': 'yet_another_token'})
+        self.assertEqual(res.status_code, 429)
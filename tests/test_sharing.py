@@ -3,7 +3,10 @@ Tests for sharing system
 """
 import json
 from flask_testing import TestCase
-from app import create_app, db
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, access_cache
+from app.models import SharedList
+from tests.helpers import count_queries
 
 
 class ShareTestCase(TestCase):
@@ -165,6 +168,97 @@ class ShareTestCase(TestCase):
                                data={'friend_id': 'one', 'list_id': 'one'})
         self.assertEqual(res.status_code, 401)
 
+    def test_share_list_with_many_friends(self):
+        """
+        Test that a list can be shared with several friends in one request
+        """
+        user3 = {'username': 'User3', 'email': 'user3@gmail.com', 'password': 'password'}
+        self.client.post('/v1/auth/register', data=user3)
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+        self.client.post('/v1/friends', headers=headers, data={'friend_id': 4})
+        self.client.put('/v1/friends/2', headers={'x-access-token': self.login_user(user3)})
+        self.share_list()
+
+        res = self.client.post('/v1/shopping_lists/share', headers=headers,
+                               data=json.dumps({'list_id': 1, 'friend_ids': [3, 4, 368]}),
+                               content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['results'], [
+            {'friend_id': 3, 'status': 'already_shared'},
+            {'friend_id': 4, 'status': 'shared'},
+            {'friend_id': 368, 'status': 'not_friends'}])
+
+        # The new recipient can read the list straight away
+        res = self.client.get('/v1/shopping_lists/share/1/items',
+                              headers={'x-access-token': self.login_user(user3)})
+        self.assertEqual(res.status_code, 200)
+
+        # Nothing is left to share, and friend ids can be sent as a comma separated string
+        res = self.client.post('/v1/shopping_lists/share', headers=headers,
+                               data={'list_id': 1, 'friend_ids': '3,4,368'})
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['message'], 'Shopping list shared with 0 of 3 users')
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['already_shared', 'already_shared', 'not_friends'])
+
+    def test_share_with_friend_removed_elsewhere(self):
+        """
+        Test that sharing checks the friendship in the database rather than the friend cache
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+        self.client.get('/v1/friends', headers=headers)
+
+        # Unfriended by another process, whose change this one's cache does not see
+        db.session.execute('DELETE FROM friends')
+        db.session.commit()
+
+        res = self.client.post('/v1/shopping_lists/share', headers=headers,
+                               data={'list_id': 1, 'friend_id': 3})
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(json.loads(res.data.decode())['message'],
+                         'Lists can only be shared to friends')
+
+    def test_share_stored_once(self):
+        """
+        Test that a list is shared with a user at most once
+        """
+        self.share_list()
+
+        # The unique index rejects a second row, whoever shares it
+        db.session.add(SharedList(list_id=1, user1=3, user2=3))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+        # Users who do not exist are reported, not shared with
+        self.assertEqual(SharedList.share_with(1, 2, [3, 368]), (set(), {3}))
+
+    def test_share_list_not_owned(self):
+        """
+        Try to share a list that belongs to another user
+        """
+        access_token = self.login_user(self.user2)
+
+        res = self.client.post('/v1/shopping_lists/share',
+                               headers={'x-access-token': access_token},
+                               data={'list_id': 1, 'friend_ids': '2'})
+        self.assertEqual(res.status_code, 404)
+
+    def test_share_without_friends(self):
+        """
+        Try to share a list without saying who with
+        """
+        access_token = self.login_user(self.user1)
+
+        res = self.client.post('/v1/shopping_lists/share',
+                               headers={'x-access-token': access_token},
+                               data={'list_id': 1})
+        self.assertEqual(res.status_code, 401)
+
     def test_get_shared_lists_when_none(self):
         """
         Try to get shared lists when none have been shared
@@ -237,6 +331,132 @@ class ShareTestCase(TestCase):
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
 
+    def test_search_shared_lists_single_query(self):
+        """
+        Test that searching shared lists takes one query however many lists match
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+        self.share_list()
+        self.client.post('/v1/shopping_lists/share', headers=headers,
+                         data={'list_id': 2, 'friend_id': 3})
+
+        # A matching list of another user that has not been shared
+        other_token = self.login_user(self.user2)
+        for name in ('Test list of user 2', 'Test list of user 2 again'):
+            self.client.post('/v1/shopping_lists', headers={'x-access-token': other_token},
+                             data={'name': name, 'description': 'Test description'})
+
+        with count_queries() as statements:
+            res = self.client.get('/v1/shopping_lists/share?q=list', headers=headers)
+
+        data = json.loads(res.data.decode())
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(sorted(s_list['name'] for s_list in data['shared_lists']),
+                         ['List 2', 'Test shopping list'])
+
+    def test_get_all_accessible_lists(self):
+        """
+        Test that owned and shared lists come back together in one query
+        """
+        self.share_list()
+        access_token = self.login_user(self.user2)
+        headers = {'x-access-token': access_token}
+        self.client.post('/v1/shopping_lists', headers=headers,
+                         data={'name': 'My list', 'description': 'Test description'})
+
+        with count_queries() as statements:
+            res = self.client.get('/v1/shopping_lists/all', headers=headers)
+
+        data = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([(s_list['name'], s_list['role']) for s_list in data['shopping_lists']],
+                         [('My list', 'owner'), ('Test shopping list', 'shared')])
+
+        # The lists shared by their owner are only listed once
+        access_token = self.login_user(self.user1)
+        res = self.client.get('/v1/shopping_lists/all', headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual([s_list['role'] for s_list in data['shopping_lists']],
+                         ['owner', 'owner'])
+
+    def test_get_list_members(self):
+        """
+        Test that the owner and the recipients of a list can see who it is shared with
+        """
+        self.share_list()
+
+        for user in (self.user1, self.user2):
+            res = self.client.get('/v1/shopping_lists/share/1/members',
+                                  headers={'x-access-token': self.login_user(user)})
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data.decode())
+            self.assertEqual(data['members'], [{'id': 3, 'username': 'User2'}])
+
+        access_token = self.login_user(self.user1)
+        res = self.client.get('/v1/shopping_lists/share/2/members',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+        # Lists of other users are not revealed
+        access_token = self.login_user(self.user2)
+        res = self.client.get('/v1/shopping_lists/share/2/members',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+    def test_unshare_with_everyone(self):
+        """
+        Test that a list stops being shared with everyone in a single DELETE
+        """
+        self.share_list()
+        access_token = self.login_user(self.user1)
+
+        with count_queries() as statements:
+            res = self.client.delete('/v1/shopping_lists/share/1', data={'friend_id': 2},
+                                     headers={'x-access-token': access_token})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len([statement for statement in statements
+                              if statement.startswith('DELETE')]), 1)
+
+        res = self.client.get('/v1/shopping_lists/share/1/items',
+                              headers={'x-access-token': self.login_user(self.user2)})
+        self.assertEqual(res.status_code, 403)
+
+        # Nothing is left to unshare
+        res = self.client.delete('/v1/shopping_lists/share/1', data={'friend_id': 2},
+                                 headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+    def test_stream_ends_when_unshared(self):
+        """
+        Test that a shared list's live stream ends as soon as it stops being shared
+        """
+        self.share_list()
+        owner_headers = {'x-access-token': self.login_user(self.user1)}
+        headers = {'x-access-token': self.login_user(self.user2)}
+
+        # Stopping sharing with the user and stopping sharing with everyone
+        for friend_id in (3, 2):
+            res = self.client.get('/v1/shopping_lists/1/events', headers=headers,
+                                  buffered=False)
+            self.assertEqual(res.status_code, 200)
+            stream = iter(res.response)
+            next(stream)
+
+            self.client.delete('/v1/shopping_lists/share/1', data={'friend_id': friend_id},
+                               headers=owner_headers)
+            self.assertTrue(next(stream).startswith(b'event: revoked'))
+            self.assertEqual(list(stream), [])
+            res.close()
+            self.share_list()
+
+        res = self.client.get('/v1/shopping_lists/2/events', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
     def test_get_shared_list_items(self):
         """
         Test whether a user can get items in a shared list
@@ -249,6 +469,46 @@ class ShareTestCase(TestCase):
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
 
+    def test_shared_list_items_read_only(self):
+        """
+        Test that a list's items can be read but not changed by the users it is shared with
+        """
+        self.share_list()
+        access_token = self.login_user(self.user2)
+        headers = {'x-access-token': access_token}
+
+        res = self.client.get('/v1/shopping_lists/1/items', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get('/v1/shopping_lists/1/items/1', headers=headers)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client.put('/v1/shopping_lists/1/items/1', headers=headers,
+                              data={'name': 'Potatoes'})
+        self.assertEqual(res.status_code, 404)
+        res = self.client.post('/v1/shopping_lists/1/items', headers=headers,
+                               data={'name': 'Potatoes', 'quantity': 2, 'unit_price': 5})
+        self.assertEqual(res.status_code, 404)
+
+    def test_cached_access_revoked(self):
+        """
+        Test that cached access to a list ends as soon as it stops being shared
+        """
+        access_cache.ttl = 60
+        self.share_list()
+        access_token = self.login_user(self.user2)
+        headers = {'x-access-token': access_token}
+
+        res = self.client.get('/v1/shopping_lists/share/1/items', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get('/v1/shopping_lists/share/1/items', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(access_cache.stats()['hits'], 1)
+
+        self.client.delete('/v1/shopping_lists/share/1', data={'friend_id': 3},
+                           headers={'x-access-token': self.login_user(self.user1)})
+        res = self.client.get('/v1/shopping_lists/share/1/items', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
     def test_get_shared_list_items_token_correct(self):
         """
         Test whether token is correct
@@ -3,7 +3,8 @@ Test cases for shopping list items
 """
 import json
 from flask_testing import TestCase
-from app import create_app, db
+from app import create_app, db, list_events
+from tests.helpers import count_queries
 
 
 class ShoppingListTestCase(TestCase):
@@ -266,6 +267,28 @@ class ShoppingListTestCase(TestCase):
                               headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 200)
 
+    def test_paginated_items_links(self):
+        """
+        Test that page links point at the list being paged
+        """
+        self.create_item()
+        access_token = self.login_user(self.user1)
+        self.client.post('/v1/shopping_lists/1/items',
+                         headers={'x-access-token': access_token},
+                         data=self.shopping_list_item2)
+
+        res = self.client.get('/v1/shopping_lists/1/items?page=1&limit=1',
+                              headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['shopping_list_items'][0]['name'], 'Broccoli')
+        self.assertTrue(data['next_page'].startswith('/v1/shopping_lists/1/items?'))
+        self.assertIn('page=2', data['next_page'])
+
+        res = self.client.get(data['next_page'], headers={'x-access-token': access_token})
+        data = json.loads(res.data.decode())
+        self.assertEqual(data['shopping_list_items'][0]['name'], 'Tomatoes')
+        self.assertIn('page=1', data['previous_page'])
+
     def test_list_and_item_id_format(self):
         """
         Test whether list and item ids are both ints
@@ -289,6 +312,38 @@ class ShoppingListTestCase(TestCase):
         # Assert that the shopping list item is actually returned given its ID
         self.assertEqual(result.status_code, 200)
 
+    def test_get_item_single_query(self):
+        """
+        Test that an item and the access to its list are loaded in one query
+        """
+        res = self.create_item()
+        access_token = self.login_user(self.user1)
+        item_id = json.loads(res.data.decode())['id']
+        headers = {'x-access-token': access_token}
+        # Cache the token
+        self.client.get('/v1/shopping_lists', headers=headers)
+
+        with count_queries() as statements:
+            res = self.client.get('/v1/shopping_lists/1/items/{}'.format(item_id),
+                                  headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+
+    def test_get_items_of_another_users_list(self):
+        """
+        Try to get the items of a list that is not yours
+        """
+        self.create_item()
+        access_token = self.login_user(self.user2)
+
+        res = self.client.get('/v1/shopping_lists/1/items',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+        res = self.client.get('/v1/shopping_lists/1/items/1',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
     def test_get_item_token_correct(self):
         """
         Test token is correct
@@ -401,6 +456,32 @@ class ShoppingListTestCase(TestCase):
                              data=self.shopping_list_item_special)
         self.assertEqual(rv.status_code, 400)
 
+    def test_item_edit_params_format(self):
+        """
+        Try to edit with values that are not numbers or are negative
+        """
+        self.create_item()
+        access_token = self.login_user(self.user1)
+
+        rv = self.client.put('/v1/shopping_lists/1/items/1',
+                             headers={'x-access-token': access_token},
+                             data={"quantity": "two"})
+        self.assertEqual(rv.status_code, 401)
+
+        rv = self.client.put('/v1/shopping_lists/1/items/1',
+                             headers={'x-access-token': access_token},
+                             data={"unit_price": -5})
+        self.assertEqual(rv.status_code, 400)
+
+        # Fields that are left out keep their current values
+        rv = self.client.put('/v1/shopping_lists/1/items/1',
+                             headers={'x-access-token': access_token},
+                             data={"quantity": 3})
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode())
+        self.assertEqual(data['name'], 'Tomatoes')
+        self.assertEqual(data['quantity'], 3)
+
     def test_edit_name_exists(self):
         """
         Try to use name of item that already exists
@@ -481,3 +562,61 @@ class ShoppingListTestCase(TestCase):
         res = self.client.delete('/v1/shopping_lists/1/items/563',
                                  headers={'x-access-token': access_token})
         self.assertEqual(res.status_code, 404)
+
+    def test_item_events_streamed(self):
+        """
+        Test that item changes are streamed to the list's subscribers once committed
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        res = self.client.get('/v1/shopping_lists/1/events', headers=headers, buffered=False)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        stream = iter(res.response)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+
+        self.client.post('/v1/shopping_lists/1/items', headers=headers,
+                         data=self.shopping_list_item)
+        self.client.put('/v1/shopping_lists/1/items/1', headers=headers,
+                        data={'quantity': 10})
+        self.client.delete('/v1/shopping_lists/1/items/1', headers=headers)
+        # Changes to other lists are not streamed
+        self.client.post('/v1/shopping_lists/2/items',
+                         headers={'x-access-token': self.login_user(self.user2)},
+                         data=dict(self.shopping_list_item, list_id=2))
+
+        events = [next(stream).decode().split('\n') for _ in range(3)]
+        res.close()
+
+        self.assertEqual([lines[0] for lines in events],
+                         ['event: item_created', 'event: item_updated', 'event: item_deleted'])
+        self.assertEqual(json.loads(events[1][1][len('data: '):]),
+                         {'id': 1, 'list_id': 1, 'name': 'Tomatoes', 'quantity': 10,
+                          'unit_price': 5})
+        self.assertEqual(list_events.subscriber_count(), 0)
+
+    def test_item_events_other_list(self):
+        """
+        Try to stream the changes to another user's list
+        """
+        access_token = self.login_user(self.user1)
+
+        res = self.client.get('/v1/shopping_lists/2/events',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 404)
+
+    def test_item_events_capacity(self):
+        """
+        Test that streams are refused once the process streams to its maximum
+        """
+        # Most of the worker's threads are left for the other requests
+        self.assertEqual(list_events.max_subscribers, self.app.config['WEB_THREADS'] // 4)
+
+        access_token = self.login_user(self.user1)
+        list_events.max_subscribers = 0
+
+        res = self.client.get('/v1/shopping_lists/1/events',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '5')
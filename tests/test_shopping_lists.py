@@ -1,9 +1,11 @@
 """
 Test cases for shopping lists
 """
+import base64
 import json
 from flask_testing import TestCase
 from app import create_app, db
+from tests.helpers import count_queries
 
 
 class ShoppingListTestCase(TestCase):
@@ -221,6 +223,69 @@ class ShoppingListTestCase(TestCase):
         )
         self.assertEqual(res.status_code, 200)
 
+    def test_search_lists_paginated(self):
+        """
+        Try page through the lists matching a search term
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        for name in ('Groceries', 'Grocery run', 'Hardware', 'Old groceries'):
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        res = self.client.get('/v1/shopping_lists?q=grocer&limit=2', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(len(data['shopping_lists']), 2)
+        self.assertIn('q=grocer', data['next_page'])
+
+        res = self.client.get('/v1/shopping_lists?q=grocer&limit=2&cursor=' +
+                              data['next_cursor'], headers=headers)
+        page_two = json.loads(res.data.decode())
+        names = [s_list['name'] for s_list in data['shopping_lists'] + page_two['shopping_lists']]
+        self.assertEqual(sorted(names), ['Groceries', 'Grocery run', 'Old groceries'])
+
+        # Terms shorter than a trigram still match
+        res = self.client.get('/v1/shopping_lists?q=ha', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual([s_list['name'] for s_list in data['shopping_lists']], ['Hardware'])
+
+        # Renamed lists are found by their new name
+        list_id = data['shopping_lists'][0]['id']
+        self.client.put('/v1/shopping_lists/{}'.format(list_id), headers=headers,
+                        data={'name': 'Tools'})
+        res = self.client.get('/v1/shopping_lists?q=tools', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get('/v1/shopping_lists?q=hardware', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+    def test_search_tied_ranks_paginated(self):
+        """
+        Test that cursor pages of a search keep the matches tied on rank
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        # Names of the same length match the term equally well
+        names = ['Milk one', 'Milk two', 'Milk six', 'Milk ten']
+        for name in names:
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        found = []
+        url = '/v1/shopping_lists?q=milk&limit=1'
+        res = self.client.get(url, headers=headers)
+        while True:
+            data = json.loads(res.data.decode())
+            found.extend(s_list['name'] for s_list in data['shopping_lists'])
+            if data['next_page'] == 'None':
+                break
+            res = self.client.get(url + '&cursor=' + data['next_cursor'], headers=headers)
+
+        self.assertEqual(sorted(found), sorted(names))
+
     def test_get_paginated_lists(self):
         """
         Try get paginated lists
@@ -235,6 +300,126 @@ class ShoppingListTestCase(TestCase):
         )
         self.assertEqual(res.status_code, 200)
 
+    def test_get_lists_with_cursor(self):
+        """
+        Try walk through lists with the cursor of each page
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        for name in ('Bakery', 'Groceries', 'Aquarium', 'Clothes'):
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        res = self.client.get('/v1/shopping_lists?page=1&limit=3', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual([s_list['name'] for s_list in data['shopping_lists']],
+                         ['Aquarium', 'Bakery', 'Clothes'])
+        self.assertEqual(data['total'], 4)
+        self.assertTrue(data['next_page'].startswith('/v1/shopping_lists?'))
+
+        res = self.client.get('/v1/shopping_lists?limit=3&cursor=' + data['next_cursor'],
+                              headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([s_list['name'] for s_list in data['shopping_lists']], ['Groceries'])
+        self.assertEqual(data['next_page'], 'None')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_lists_single_query(self):
+        """
+        Test that a page and its total are fetched in one query
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        for name in ('Bakery', 'Groceries', 'Clothes'):
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        with count_queries() as statements:
+            res = self.client.get('/v1/shopping_lists?limit=2', headers=headers)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(json.loads(res.data.decode())['total'], 3)
+
+    def test_get_lists_total_options(self):
+        """
+        Test that the total can be skipped or estimated
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        for name in ('Bakery', 'Groceries', 'Clothes'):
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        res = self.client.get('/v1/shopping_lists?limit=2&total=false', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertIsNone(data['total'])
+        self.assertIn('total=false', data['next_page'])
+
+        # The cursor page still reports the total of the whole listing
+        res = self.client.get('/v1/shopping_lists?limit=2&cursor=' + data['next_cursor'],
+                              headers=headers)
+        self.assertEqual(json.loads(res.data.decode())['total'], 3)
+
+        # Databases without an estimate fall back to the exact total
+        res = self.client.get('/v1/shopping_lists?total=estimate', headers=headers)
+        self.assertEqual(json.loads(res.data.decode())['total'], 3)
+
+        res = self.client.get('/v1/shopping_lists?total=maybe', headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_lists_with_invalid_cursor(self):
+        """
+        Try get lists with a cursor that was not issued by the API
+        """
+        access_token = self.login_user(self.user1)
+
+        res = self.client.get('/v1/shopping_lists?cursor=not-a-cursor',
+                              headers={'x-access-token': access_token})
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_lists_with_crafted_cursor(self):
+        """
+        Try get lists with well formed cursors holding values the API never issues
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+        self.client.post('/v1/shopping_lists', headers=headers,
+                         data={'name': 'Groceries', 'description': 'Description'})
+
+        for url, values in (('/v1/shopping_lists', [{'a': 1}, 1]),
+                            ('/v1/shopping_lists', [[1, 2], 1]),
+                            ('/v1/shopping_lists', [True, 1]),
+                            ('/v1/shopping_lists', ['Groceries', None]),
+                            ('/v1/shopping_lists?q=grocer', ['0.5', 'Groceries', 1]),
+                            ('/v1/shopping_lists?q=grocer', [True, 'Groceries', 1])):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+            separator = '&' if '?' in url else '?'
+            res = self.client.get(url + separator + 'cursor=' + cursor, headers=headers)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(json.loads(res.data.decode())['message'],
+                             'The cursor provided is not valid')
+
+    def test_pagination_limit_is_capped(self):
+        """
+        Try get more lists per page than the server allows
+        """
+        self.app.config['MAX_PAGE_LIMIT'] = 2
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        for name in ('Bakery', 'Groceries', 'Clothes'):
+            self.client.post('/v1/shopping_lists', headers=headers,
+                             data={'name': name, 'description': 'Description'})
+
+        res = self.client.get('/v1/shopping_lists?limit=1000', headers=headers)
+        data = json.loads(res.data.decode())
+        self.assertEqual(len(data['shopping_lists']), 2)
+        self.assertIn('limit=2', data['next_page'])
+
     def test_get_paginated_lists_when_none(self):
         """
         Try get paginated lists when user has no lists
@@ -414,6 +599,34 @@ class ShoppingListTestCase(TestCase):
                              data={'name': 'Groceries'})
         self.assertEqual(rv.status_code, 401)
 
+    def test_names_unique_regardless_of_case(self):
+        """
+        Try to reuse a list name with different letter case
+        """
+        access_token = self.login_user(self.user1)
+        headers = {'x-access-token': access_token}
+
+        self.create_shopping_list()
+
+        rv = self.client.post('/v1/shopping_lists', headers=headers, data={'name': 'GROCERIES'})
+        self.assertEqual(rv.status_code, 401)
+
+        rv = self.client.post('/v1/shopping_lists', headers=headers, data={'name': 'Movies'})
+        results = json.loads(rv.data.decode())
+
+        rv = self.client.put('/v1/shopping_lists/{}'.format(results['id']),
+                             headers=headers, data={'name': 'groceries'})
+        self.assertEqual(rv.status_code, 401)
+
+        rv = self.client.get('/v1/shopping_lists/{}'.format(results['id']), headers=headers)
+        self.assertEqual(json.loads(rv.data.decode())['name'], 'Movies')
+
+        # Other users can still use the name
+        user2_token = self.login_user(self.user2)
+        rv = self.client.post('/v1/shopping_lists', headers={'x-access-token': user2_token},
+                              data={'name': 'groceries'})
+        self.assertEqual(rv.status_code, 201)
+
     def test_shopping_list_deletion(self):
         """
         Test API can delete an existing shopping list. (DELETE request)
@@ -0,0 +1,229 @@
+"""
+Tests for delta sync
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from flask_testing import TestCase
+from app import create_app, db
+from app.models import Tombstone
+from app.sync.views import encode_token
+
+
+class SyncTestCase(TestCase):
+    """
+    Tests for syncing lists, items and shares
+    """
+
+    def create_app(self):
+        """
+        Instantiate app instance
+        """
+        app = create_app(config_name="testing")
+        return app
+
+    def setUp(self):
+        """
+        Set up test variables
+        """
+        self.user1 = {
+            'username': 'User1',
+            'email': 'user1@gmail.com',
+            'password': 'password'
+        }
+        self.user2 = {
+            'username': 'User2',
+            'email': 'user2@gmail.com',
+            'password': 'password'
+        }
+
+        db.create_all()
+        self.client.post('/v1/auth/register', data=self.user1)
+        self.client.post('/v1/auth/register', data=self.user2)
+
+        # User1 has a list with two items and is friends with User2
+        headers = {'x-access-token': self.login_user(self.user1)}
+        self.client.post('/v1/shopping_lists', headers=headers,
+                         data={'name': 'Groceries', 'description': 'Description'})
+        self.client.post('/v1/shopping_lists/1/items', headers=headers,
+                         data={'name': 'Tomatoes', 'quantity': 20, 'unit_price': 5})
+        self.client.post('/v1/shopping_lists/1/items', headers=headers,
+                         data={'name': 'Broccoli', 'quantity': 20, 'unit_price': 5})
+        self.client.post('/v1/friends', headers=headers, data={'friend_id': 3})
+        self.client.put('/v1/friends/2', headers={'x-access-token': self.login_user(self.user2)})
+
+    def tearDown(self):
+        """
+        Delete all initialized variables
+        """
+        db.session.remove()
+        db.drop_all()
+
+    def login_user(self, user):
+        """
+        Helper function to login user
+        """
+        login_res = self.client.post('/v1/auth/login', data=user)
+        access_token = json.loads(login_res.data.decode())['access_token']
+
+        return access_token
+
+    def sync(self, user, token=None):
+        """
+        Helper function to sync and return the response data
+        """
+        url = '/v1/sync?since={}'.format(token) if token else '/v1/sync'
+        res = self.client.get(url, headers={'x-access-token': self.login_user(user)})
+        self.assertEqual(res.status_code, 200)
+
+        return json.loads(res.data.decode())
+
+    @staticmethod
+    def age_rows():
+        """
+        Helper function to date every existing change an hour back
+        """
+        an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        for table in ('shopping_lists', 'shopping_list_items', 'shared_lists'):
+            db.session.execute('UPDATE {} SET date_modified = :moment'.format(table),
+                               {'moment': an_hour_ago})
+        db.session.execute('UPDATE tombstones SET date_deleted = :moment',
+                           {'moment': an_hour_ago})
+        db.session.commit()
+
+    def test_full_sync(self):
+        """
+        Test that a sync without a token returns everything the user can see
+        """
+        data = self.sync(self.user1)
+
+        self.assertTrue(data['full'])
+        self.assertTrue(data['token'])
+        self.assertEqual([(s_list['name'], s_list['role']) for s_list in data['shopping_lists']],
+                         [('Groceries', 'owner')])
+        self.assertEqual([item['name'] for item in data['items']], ['Tomatoes', 'Broccoli'])
+        self.assertEqual(data['deleted'], [])
+
+        data = self.sync(self.user2)
+        self.assertEqual(data['shopping_lists'], [])
+        self.assertEqual(data['items'], [])
+
+    def test_sync_changes_since_token(self):
+        """
+        Test that only the changes and deletions since a token are returned
+        """
+        owner_headers = {'x-access-token': self.login_user(self.user1)}
+        self.client.post('/v1/shopping_lists/share', headers=owner_headers,
+                         data={'list_id': 1, 'friend_id': 3})
+        owner_token = self.sync(self.user1)['token']
+        token = self.sync(self.user2)['token']
+        self.age_rows()
+
+        self.client.put('/v1/shopping_lists/1/items/1', headers=owner_headers,
+                        data={'quantity': 10})
+        self.client.delete('/v1/shopping_lists/1/items/2', headers=owner_headers)
+
+        for data in (self.sync(self.user1, owner_token), self.sync(self.user2, token)):
+            self.assertFalse(data['full'])
+            self.assertEqual(data['shopping_lists'], [])
+            self.assertEqual([(item['id'], item['quantity']) for item in data['items']],
+                             [(1, 10)])
+            self.assertEqual(data['shares'], [])
+            self.assertEqual(data['deleted'], [{'type': 'item', 'id': 2, 'list_id': 1}])
+
+    def test_sync_shares(self):
+        """
+        Test that lists are sent whole once shared and removed once unshared
+        """
+        owner_headers = {'x-access-token': self.login_user(self.user1)}
+        owner_token = self.sync(self.user1)['token']
+        token = self.sync(self.user2)['token']
+        self.age_rows()
+
+        self.client.post('/v1/shopping_lists/share', headers=owner_headers,
+                         data={'list_id': 1, 'friend_id': 3})
+        data = self.sync(self.user2, token)
+        self.assertEqual([(s_list['id'], s_list['role']) for s_list in data['shopping_lists']],
+                         [(1, 'shared')])
+        self.assertEqual(len(data['items']), 2)
+        self.assertEqual([(share['shared_by'], share['shared_with']) for share in data['shares']],
+                         [(2, 3)])
+
+        token = data['token']
+        self.age_rows()
+        self.client.delete('/v1/shopping_lists/share/1', data={'friend_id': 3},
+                           headers=owner_headers)
+
+        data = self.sync(self.user2, token)
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['deleted'], [{'type': 'list', 'id': 1, 'list_id': 1}])
+
+        data = self.sync(self.user1, owner_token)
+        self.assertEqual(data['deleted'], [{'type': 'share', 'id': 1, 'list_id': 1}])
+
+    def test_sync_deleted_list(self):
+        """
+        Test that a deleted list leaves a single tombstone for each user who could see it
+        """
+        owner_headers = {'x-access-token': self.login_user(self.user1)}
+        self.client.post('/v1/shopping_lists/share', headers=owner_headers,
+                         data={'list_id': 1, 'friend_id': 3})
+        token = self.sync(self.user2)['token']
+
+        self.client.delete('/v1/shopping_lists/1', headers=owner_headers)
+
+        data = self.sync(self.user2, token)
+        self.assertEqual(data['deleted'], [{'type': 'list', 'id': 1, 'list_id': 1}])
+        self.assertEqual(Tombstone.query.count(), 2)
+
+    def test_sync_token_format(self):
+        """
+        Use a malformed token and one older than the tombstones
+        """
+        headers = {'x-access-token': self.login_user(self.user1)}
+
+        res = self.client.get('/v1/sync?since=yuujk', headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.get('/v1/sync?since={}'.format(encode_token(datetime(2000, 1, 1))),
+                              headers=headers)
+        self.assertEqual(res.status_code, 410)
+
+    def test_sync_with_time_zone_aware_database_time(self):
+        """
+        Test syncing when the database returns its time with a time zone, as PostgreSQL does
+        """
+        token = self.sync(self.user1)['token']
+        query = db.session.query
+
+        def aware_query(*entities):
+            """
+            Return an aware time for the current timestamp and query as usual otherwise
+            """
+            if entities and getattr(entities[0], 'name', None) == 'current_timestamp':
+                return mock.Mock(scalar=lambda: datetime.now(timezone.utc))
+            return query(*entities)
+
+        with mock.patch.object(db.session, 'query', aware_query):
+            data = self.sync(self.user1, token)
+        self.assertFalse(data['full'])
+
+    def test_sync_token_present(self):
+        """
+        Test token is present
+        """
+        res = self.client.get('/v1/sync')
+        self.assertEqual(res.status_code, 401)
+
+    def test_sweep_expired_tombstones(self):
+        """
+        Test that old tombstones are deleted in batches
+        """
+        headers = {'x-access-token': self.login_user(self.user1)}
+        self.client.delete('/v1/shopping_lists/1/items/1', headers=headers)
+        self.client.delete('/v1/shopping_lists/1/items/2', headers=headers)
+
+        self.assertEqual(Tombstone.sweep_expired(datetime.utcnow() - timedelta(days=1)), 0)
+        self.assertEqual(Tombstone.sweep_expired(datetime.utcnow() + timedelta(days=1),
+                                                 batch_size=1), 2)
+        self.assertEqual(Tombstone.query.count(), 0)